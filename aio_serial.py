@@ -0,0 +1,232 @@
+"""
+asyncio transport for SDC serial ports and ptys.
+
+Each port is opened non-blocking and registered with the event loop, so a
+single thread can drive dozens of ports. Bytes are read as soon as they
+arrive, pushed through a FrameDecoder, and complete frames are handed to a
+callback:
+
+    def on_frames(port, frames, ts_ns):
+        ...
+
+    async def main():
+        port = AsyncSerialPort('/dev/ttyACM0', on_frames=on_frames).open()
+        port.write(frame)
+        reply = await port.next_frame(timeout=0.5)
+
+On platforms where the loop cannot watch the port handle (Windows COM ports)
+a small reader thread feeds the loop instead, and writes go through a
+single writer thread so they keep their order without blocking the loop.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import serial
+
+from frame_decoder import FrameDecoder
+
+BAUDRATE = 115200
+READ_SIZE = 4096
+
+
+class AsyncSerialPort:
+    """One serial port or pty on an asyncio loop."""
+
+    def __init__(self, path, baudrate=BAUDRATE, on_frames=None, decoder=None):
+        self.path = path
+        self.baudrate = baudrate
+        self.on_frames = on_frames
+        self.decoder = decoder or FrameDecoder()
+        self.loop = None
+        self.serial = None
+        self.fd = None
+        self.error = None
+        self.closed = None
+        self._waiters = []
+        self._write_buffer = bytearray()
+        self._thread = None
+        self._writer = None
+        self._stop = threading.Event()
+
+    def open(self, loop=None):
+        """Open the port and start reading. Must be called from the loop thread."""
+        self.loop = loop or asyncio.get_running_loop()
+        self.closed = asyncio.Event()
+        self.serial = serial.Serial(self.path, self.baudrate, timeout=0)
+        try:
+            fd = self.serial.fileno()
+            os.set_blocking(fd, False)
+            self.loop.add_reader(fd, self._on_readable)
+            self.fd = fd
+        except (AttributeError, NotImplementedError, OSError):
+            self._thread = threading.Thread(target=self._reader_thread, daemon=True)
+            self._thread.start()
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"write {self.path}")
+        return self
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._fail(e)
+            return
+        if not data:
+            # pty master went away
+            self._fail(EOFError(f"{self.path} closed"))
+            return
+        self._received(data, time.monotonic_ns())
+
+    def _reader_thread(self):
+        ser = self.serial
+        ser.timeout = 0.1
+        while not self._stop.is_set():
+            try:
+                data = ser.read(ser.in_waiting or 1)
+            except (serial.SerialException, OSError) as e:
+                self.loop.call_soon_threadsafe(self._fail, e)
+                return
+            if data:
+                self.loop.call_soon_threadsafe(self._received, data, time.monotonic_ns())
+
+    def _received(self, data, ts_ns):
+        frames = self.decoder.feed(data)
+        if not frames:
+            return
+        # One frame per waiter, oldest waiter first; waiters that timed out are skipped
+        waiters = self._waiters
+        i = 0
+        while waiters and i < len(frames):
+            waiter = waiters.pop(0)
+            if not waiter.done():
+                waiter.set_result(frames[i])
+                i += 1
+        if self.on_frames is not None:
+            self.on_frames(self, frames, ts_ns)
+
+    def _fail(self, error):
+        self.error = error
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_exception(error)
+        self._waiters = []
+        self.close()
+
+    async def next_frame(self, timeout=None):
+        """Wait for the next frame to arrive. Returns None on timeout. Concurrent waiters get one frame each."""
+        if self.error is not None:
+            raise self.error
+        waiter = self.loop.create_future()
+        self._waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def write(self, data):
+        """Queue data for sending. Never blocks the loop."""
+        if self.fd is None:
+            if self._writer is None:
+                return  # Closed
+            # Copied, the caller may reuse its buffer (frame_encoder views) before the thread writes it
+            future = self.loop.run_in_executor(self._writer, self.serial.write, bytes(data))
+            future.add_done_callback(self._thread_written)
+            return
+        if self._write_buffer:
+            self._write_buffer += data
+            return
+        try:
+            sent = os.write(self.fd, data)
+        except BlockingIOError:
+            sent = 0
+        except OSError as e:
+            self._fail(e)
+            return
+        if sent < len(data):
+            self._write_buffer += memoryview(data)[sent:]
+            self.loop.add_writer(self.fd, self._on_writable)
+
+    def _thread_written(self, future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None and self.error is None:
+            self._fail(error)
+
+    def _on_writable(self):
+        try:
+            sent = os.write(self.fd, self._write_buffer)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._fail(e)
+            return
+        del self._write_buffer[:sent]
+        if not self._write_buffer:
+            self.loop.remove_writer(self.fd)
+
+    @property
+    def is_open(self):
+        return self.serial is not None and self.serial.is_open
+
+    def close(self):
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+            if self._write_buffer:
+                self.loop.remove_writer(self.fd)
+            self.fd = None
+        self._stop.set()
+        if self._writer is not None:
+            self._writer.shutdown(wait=False)
+            self._writer = None
+        if self.serial is not None and self.serial.is_open:
+            self.serial.close()
+        if self.closed is not None:
+            self.closed.set()
+
+
+def open_ports(paths, on_frames, baudrate=BAUDRATE, decoders=None):
+    """Open several ports on the running loop. Ports that fail to open are reported and skipped.
+
+    decoders optionally maps a path to the FrameDecoder to use for it.
+    """
+    ports = []
+    for path in paths:
+        decoder = decoders.get(path) if decoders else None
+        try:
+            ports.append(AsyncSerialPort(path, baudrate, on_frames, decoder).open())
+        except (serial.SerialException, OSError) as e:
+            print(f"Failed to open serial port {path}: {e}")
+    return ports
+
+
+async def run_ports(paths, on_frames, baudrate=BAUDRATE, stop=None, decoders=None):
+    """Read the given ports until stop (an asyncio.Event) is set or every port has closed."""
+    ports = open_ports(paths, on_frames, baudrate, decoders)
+    try:
+        await wait_closed(ports, stop)
+    finally:
+        for port in ports:
+            port.close()
+    return ports
+
+
+async def wait_closed(ports, stop=None):
+    """Wait until stop (an asyncio.Event) is set or every port has closed; one port closing is not enough."""
+    async def all_closed():
+        for port in ports:
+            await port.closed.wait()
+
+    waits = [asyncio.ensure_future(all_closed())]
+    if stop is not None:
+        waits.append(asyncio.ensure_future(stop.wait()))
+    try:
+        await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for wait in waits:
+            wait.cancel()
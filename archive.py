@@ -0,0 +1,395 @@
+"""
+Compact archive format for captures and text logs.
+
+Frames of the same talker and Class_B follow each other with only the
+sequence number, a few telemetry bytes and the CRC changing. Each frame is
+stored XORed with the previous frame of the same (talker, Class_B, length),
+so the repeated bytes become zeros, and the records are compressed in
+blocks with zlib or lzma.
+
+File header (9 bytes):
+    6s  magic b'SDCARC'
+    H   format version
+    B   codec (CODEC_ZLIB or CODEC_LZMA)
+
+Then blocks, each a 28 byte header followed by the compressed data:
+    I   compressed size
+    I   uncompressed size
+    I   number of frames
+    q   lowest wall clock timestamp in ns
+    q   highest wall clock timestamp in ns
+
+Every block decodes on its own (the XOR chains restart and the port names
+are repeated), so a reader can skip blocks by their time range and only
+decompress the ones it needs. Uncompressed, a block is laid out in columns:
+    <IH>  frames, ports; then per port <HH> id, name length and the utf-8 name
+    q[n]  timestamps, the first absolute and then differences
+    H[n]  port ids
+    B[n]  directions (capture DIR_RX / DIR_TX)
+    B[n]  flags (capture FLAG_CRC_OK)
+    H[n]  frame lengths
+    the frames; bytes 0-5 as they are, the rest XORed with the previous frame of the same key
+
+Usage:
+    python archive.py pack Data/serial_frames_*.txt [-o all.sdcarc] [--codec zlib]
+    python archive.py unpack archive.sdcarc [out.sdccap]
+    python archive.py dump archive.sdcarc     # the capture.py dump lines: ms, port, TX/RX[ CRC!], hex
+    python archive.py info archive.sdcarc
+"""
+
+import argparse
+import lzma
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+from capture import (CAPTURE_EXT, DIR_RX, DIR_TX, FLAG_CRC_OK, CaptureReader, CaptureWriter, is_capture_file,
+                     iter_text_log)
+from crc16 import check_frame
+
+ARCHIVE_MAGIC = b'SDCARC'
+ARCHIVE_VERSION = 1
+ARCHIVE_EXT = '.sdcarc'
+
+CODEC_ZLIB = 0
+CODEC_LZMA = 1
+CODECS = {'zlib': CODEC_ZLIB, 'lzma': CODEC_LZMA}
+
+ARCHIVE_HEADER = struct.Struct('<6sHB')
+BLOCK_HEADER = struct.Struct('<IIIqq')
+BLOCK_COUNTS = struct.Struct('<IH')
+PORT_HEADER = struct.Struct('<HH')
+
+# Frames per block: bigger blocks compress better, smaller ones seek finer
+BLOCK_FRAMES = 32768
+# Bytes 0-5 (start, length, Class_A, Class_B, talker, listener) are kept as they are, they form the key
+KEY_BYTES = 6
+
+
+def _compress(codec, data, level):
+    if codec == CODEC_LZMA:
+        return lzma.compress(data, preset=6 if level is None else level)
+    return zlib.compress(data, 9 if level is None else level)
+
+
+def _decompress(codec, data):
+    if codec == CODEC_LZMA:
+        return lzma.decompress(data)
+    return zlib.decompress(data)
+
+
+def _xor(data, previous):
+    n = len(data)
+    return (int.from_bytes(data, 'little') ^ int.from_bytes(previous, 'little')).to_bytes(n, 'little')
+
+
+class ArchiveWriter:
+    """
+    Write frames to an archive, a block at a time.
+
+        with ArchiveWriter('Data/june.sdcarc') as writer:
+            port = writer.port_id('/dev/ttyUSB0')
+            writer.write(frame, port, DIR_RX, crc_ok, ts_ns)
+    """
+
+    def __init__(self, path, codec='lzma', level=None, block_frames=BLOCK_FRAMES):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec {codec}, use one of {', '.join(CODECS)}")
+        self.path = path
+        self.codec = CODECS[codec]
+        self.level = level
+        self.block_frames = block_frames
+        self.port_ids = {}
+        self.frames = 0
+        self.raw_bytes = 0
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            # Never truncate, e.g. `pack a.sdcarc` would default to writing over its own input
+            raise FileExistsError(f"{path} already exists, archives are never overwritten")
+        self.file = open(path, 'wb')
+        self.file.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, self.codec))
+        self._reset()
+
+    def _reset(self):
+        self.timestamps = array('q')
+        self.ports = array('H')
+        self.directions = array('B')
+        self.flags = array('B')
+        self.lengths = array('H')
+        self.payload = []
+        self.previous = {}
+        self.last_ts = 0
+
+    def port_id(self, name):
+        port_id = self.port_ids.get(name)
+        if port_id is None:
+            port_id = self.port_ids[name] = len(self.port_ids)
+        return port_id
+
+    def write(self, frame, port=0, direction=DIR_RX, crc_ok=True, ts_ns=0):
+        frame = bytes(frame)
+        length = len(frame)
+        if length > KEY_BYTES:
+            key = (frame[4], frame[3], length)
+            previous = self.previous.get(key)
+            self.previous[key] = frame
+            if previous is not None:
+                frame = frame[:KEY_BYTES] + _xor(frame[KEY_BYTES:], previous[KEY_BYTES:])
+        self.timestamps.append(ts_ns - self.last_ts)
+        self.last_ts = ts_ns
+        self.ports.append(port)
+        self.directions.append(direction)
+        self.flags.append(FLAG_CRC_OK if crc_ok else 0)
+        self.lengths.append(length)
+        self.payload.append(frame)
+        if len(self.lengths) >= self.block_frames:
+            self.flush_block()
+
+    def flush_block(self):
+        count = len(self.lengths)
+        if not count:
+            return
+        # Undo the differences once to find the block's time range
+        ts, low, high = 0, None, None
+        for delta in self.timestamps:
+            ts += delta
+            if low is None or ts < low:
+                low = ts
+            if high is None or ts > high:
+                high = ts
+        parts = [BLOCK_COUNTS.pack(count, len(self.port_ids))]
+        for name, port_id in sorted(self.port_ids.items(), key=lambda item: item[1]):
+            encoded = name.encode('utf-8')
+            parts.append(PORT_HEADER.pack(port_id, len(encoded)) + encoded)
+        parts += [self.timestamps.tobytes(), self.ports.tobytes(), self.directions.tobytes(),
+                  self.flags.tobytes(), self.lengths.tobytes()]
+        parts += self.payload
+        raw = b''.join(parts)
+        data = _compress(self.codec, raw, self.level)
+        self.file.write(BLOCK_HEADER.pack(len(data), len(raw), count, low, high))
+        self.file.write(data)
+        self.frames += count
+        self.raw_bytes += len(raw)
+        self._reset()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush_block()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def is_archive_file(path):
+    with open(path, 'rb') as f:
+        return f.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
+
+
+def decode_block(raw, ports=None):
+    """Yield (ts_ns, port, direction, crc_ok, frame) of one uncompressed block. Port names fill ports."""
+    count, port_count = BLOCK_COUNTS.unpack_from(raw)
+    pos = BLOCK_COUNTS.size
+    for _ in range(port_count):
+        port_id, length = PORT_HEADER.unpack_from(raw, pos)
+        pos += PORT_HEADER.size
+        if ports is not None:
+            ports[port_id] = raw[pos:pos + length].decode('utf-8', 'replace')
+        pos += length
+    columns = []
+    for typecode in 'qHBBH':
+        column = array(typecode)
+        end = pos + count * column.itemsize
+        column.frombytes(raw[pos:end])
+        columns.append(column)
+        pos = end
+    timestamps, port_ids, directions, flags, lengths = columns
+    previous = {}
+    ts_ns = 0
+    for i in range(count):
+        length = lengths[i]
+        frame = raw[pos:pos + length]
+        pos += length
+        if length > KEY_BYTES:
+            key = (frame[4], frame[3], length)
+            before = previous.get(key)
+            if before is not None:
+                frame = frame[:KEY_BYTES] + _xor(frame[KEY_BYTES:], before[KEY_BYTES:])
+            previous[key] = frame
+        ts_ns += timestamps[i]
+        yield ts_ns, port_ids[i], directions[i], bool(flags[i] & FLAG_CRC_OK), frame
+
+
+class ArchiveReader:
+    """
+    Streaming archive reader. Only one block is held in memory at a time.
+
+        with ArchiveReader(path) as reader:
+            for ts_ns, port, direction, crc_ok, frame in reader:
+                ...
+            for record in reader.frames(t0, t1):      # skips blocks outside [t0, t1)
+                ...
+
+    Records are the same as CaptureReader's, with wall clock ns timestamps
+    and frames as bytes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.ports = {}
+        self.file = open(path, 'rb')
+        header = self.file.read(ARCHIVE_HEADER.size)
+        if len(header) < ARCHIVE_HEADER.size:
+            self.file.close()
+            raise ValueError(f"{path} is not an archive")
+        magic, version, codec = ARCHIVE_HEADER.unpack(header)
+        if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION or codec not in CODECS.values():
+            self.file.close()
+            raise ValueError(f"{path} is not an archive of version {ARCHIVE_VERSION}")
+        self.codec = codec
+
+    def blocks(self):
+        """Yield (file offset, compressed size, raw size, frames, low ts, high ts) of every block."""
+        pos = ARCHIVE_HEADER.size
+        f = self.file
+        while True:
+            f.seek(pos)
+            header = f.read(BLOCK_HEADER.size)
+            if len(header) < BLOCK_HEADER.size:
+                return
+            size, raw_size, count, low, high = BLOCK_HEADER.unpack(header)
+            yield pos, size, raw_size, count, low, high
+            pos += BLOCK_HEADER.size + size
+
+    def read_block(self, pos):
+        size = BLOCK_HEADER.unpack(self._read(pos, BLOCK_HEADER.size))[0]
+        data = self._read(pos + BLOCK_HEADER.size, size)
+        if len(data) < size:
+            raise ValueError(f"Truncated block at offset {pos}")
+        return _decompress(self.codec, data)
+
+    def _read(self, pos, size):
+        self.file.seek(pos)
+        return self.file.read(size)
+
+    def frames(self, start_ns=None, end_ns=None):
+        """Yield records with start_ns <= ts < end_ns. Either bound may be None."""
+        for pos, size, raw_size, count, low, high in list(self.blocks()):
+            if (start_ns is not None and high < start_ns) or (end_ns is not None and low >= end_ns):
+                continue
+            try:
+                raw = self.read_block(pos)
+            except (ValueError, lzma.LZMAError, zlib.error) as e:
+                print(f"{self.path}: skipping block at offset {pos}: {e}")
+                continue
+            for record in decode_block(raw, self.ports):
+                ts_ns = record[0]
+                if start_ns is not None and ts_ns < start_ns:
+                    continue
+                if end_ns is not None and ts_ns >= end_ns:
+                    continue
+                yield record
+
+    def __iter__(self):
+        return self.frames()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_archive(path, ports=None):
+    """Yield (ts_ns, port, direction, crc_ok, frame) for every frame, like capture.iter_capture."""
+    with ArchiveReader(path) as reader:
+        yield from reader
+        if ports is not None:
+            ports.update(reader.ports)
+
+
+def pack_files(paths, out_path, codec='lzma', level=None, block_frames=BLOCK_FRAMES):
+    """Archive captures and text logs (in the given order) into out_path. Returns the writer."""
+    if any(os.path.exists(path) and os.path.exists(out_path) and os.path.samefile(path, out_path) for path in paths):
+        raise ValueError(f"{out_path} is also an input")
+    with ArchiveWriter(out_path, codec, level, block_frames) as writer:
+        for path in paths:
+            if is_archive_file(path):
+                with ArchiveReader(path) as reader:
+                    for ts_ns, port, direction, crc_ok, frame in reader:
+                        port = writer.port_id(reader.ports.get(port, str(port)))
+                        writer.write(frame, port, direction, crc_ok, ts_ns)
+            elif is_capture_file(path):
+                with CaptureReader(path) as reader:
+                    for ts_ns, port, direction, crc_ok, frame in reader:
+                        port = writer.port_id(reader.ports.get(port, str(port)))
+                        writer.write(frame, port, direction, crc_ok, ts_ns)
+            else:
+                port = writer.port_id(os.path.basename(path))
+                for ts_ns, direction, frame in iter_text_log(path):
+                    writer.write(frame, port, direction, check_frame(frame), ts_ns)
+    return writer
+
+
+def unpack_file(path, out_path=None):
+    """Write an archive back out as a capture file. Returns the output path and the number of frames."""
+    if out_path is None:
+        out_path = os.path.splitext(path)[0] + CAPTURE_EXT
+    count = 0
+    with ArchiveReader(path) as reader, CaptureWriter(out_path, epoch_ns=0, mono_ns=0) as writer:
+        port_ids = {}
+        for ts_ns, port, direction, crc_ok, frame in reader:
+            port_id = port_ids.get(port)
+            if port_id is None:
+                port_id = port_ids[port] = writer.port_id(reader.ports.get(port, str(port)))
+            writer.write(frame, port_id, direction, crc_ok, ts_ns)
+            count += 1
+    return out_path, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack captures and logs into compact archives, and read them back")
+    parser.add_argument('command', choices=('pack', 'unpack', 'dump', 'info'))
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('-o', '--out', help="output file (pack: default <first input>.sdcarc)")
+    parser.add_argument('--codec', choices=sorted(CODECS), default='lzma')
+    parser.add_argument('--level', type=int, help="compression level (zlib 0-9, lzma 0-9)")
+    parser.add_argument('--block-frames', type=int, default=BLOCK_FRAMES)
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        out = args.out or os.path.splitext(args.paths[0])[0] + ARCHIVE_EXT
+        writer = pack_files(args.paths, out, args.codec, args.level, args.block_frames)
+        source = sum(os.path.getsize(path) for path in args.paths)
+        size = os.path.getsize(out)
+        print(f"Wrote {writer.frames} frames to {out}: {source} -> {size} bytes ({source / max(size, 1):.1f}x)")
+    elif args.command == 'unpack':
+        out, n = unpack_file(args.paths[0], args.out or (args.paths[1] if len(args.paths) > 1 else None))
+        print(f"Wrote {n} frames to {out}")
+    elif args.command == 'dump':
+        # The capture.py dump format, for reading only
+        for path in args.paths:
+            with ArchiveReader(path) as reader:
+                for ts_ns, port, direction, crc_ok, frame in reader:
+                    flags = ('TX' if direction == DIR_TX else 'RX') + ('' if crc_ok else ' CRC!')
+                    print(f"{ts_ns // 1_000_000}\t{reader.ports.get(port, port)}\t{flags}\t{frame.hex(' ').upper()}")
+    else:
+        for path in args.paths:
+            with ArchiveReader(path) as reader:
+                blocks = list(reader.blocks())
+            frames = sum(block[3] for block in blocks)
+            size = os.path.getsize(path)
+            raw = sum(block[2] for block in blocks)
+            print(f"{path}: {frames} frames in {len(blocks)} blocks, {size} bytes "
+                  f"({raw / max(size, 1):.1f}x over the XORed records)")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,241 @@
+"""
+Decode whole captures into NumPy column arrays.
+
+Frames are grouped by (Class_B, length) and stacked into 2-D uint8 arrays.
+Each group is then viewed through a structured dtype built from the
+frame_schema layout, so every field of every frame is extracted in one
+vectorized step instead of a Python loop per frame.
+
+Capture files are stacked without a per-frame loop as well: the record
+offsets come from the capture index (capture_index.py), and the headers and
+frames are gathered from the memory-mapped file with NumPy fancy indexing.
+Archives and text logs are grouped frame by frame. The bench.py 'batch'
+group measures both paths.
+
+    columns = decode_file('Data/serial_frames_xxx.sdccap')
+    c9c = columns[0x9C]
+    c9c['timestamp'], c9c['output_voltage'], c9c['temperature']
+    columns[0x2D]['cell_voltages']      # shape (N, 16)
+
+Usage:
+    python batch_decode.py capture.sdccap|archive.sdcarc|log.txt [out.npz]
+
+Needs numpy.
+"""
+
+import sys
+
+import numpy as np
+
+from archive import iter_archive, is_archive_file
+from capture import FILE_HEADER, FLAG_CRC_OK, RECORD_HEADER, CaptureReader, is_capture_file, iter_text_log
+from crc16 import check_frame
+from frame_schema import HEADER_FIELDS, LAYOUTS
+
+NUMPY_TYPES = {
+    'u8': '<u1',
+    'i8': '<i1',
+    'u16': '<u2',
+    'i16': '<i2',
+    'u32': '<u4',
+    'i32': '<i4',
+}
+
+
+def iter_file(path):
+    """Yield (ts_ns, frame) of the frames with a good CRC from a capture file, an archive or either text log format."""
+    if is_archive_file(path):
+        for ts_ns, port, direction, crc_ok, frame in iter_archive(path):
+            if crc_ok:
+                yield ts_ns, frame
+    elif is_capture_file(path):
+        with CaptureReader(path) as reader:
+            for ts_ns, port, direction, crc_ok, frame in reader:
+                if crc_ok:
+                    yield ts_ns, frame
+    else:
+        for ts_ns, direction, frame in iter_text_log(path):
+            if check_frame(frame):
+                yield ts_ns, frame
+
+
+def stack_frames(records):
+    """
+    Group (ts_ns, frame) pairs by (Class_B, length).
+    Returns {(class_b, length): (timestamps int64[N], frames uint8[N, length])}.
+    """
+    groups = {}
+    for ts_ns, frame in records:
+        if len(frame) < 4:
+            continue
+        key = (frame[3], len(frame))
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = ([], [])
+        group[0].append(ts_ns)
+        group[1].append(frame)
+    stacked = {}
+    for (class_b, length), (timestamps, frames) in groups.items():
+        data = np.frombuffer(b''.join(frames), dtype=np.uint8).reshape(-1, length)
+        stacked[(class_b, length)] = (np.array(timestamps, dtype=np.int64), data)
+    return stacked
+
+
+# Rows gathered per fancy-indexing step, bounds the int64 index matrix to a few MB
+GATHER_ROWS = 8192
+# Record header fields as laid out by RECORD_HEADER ('<QHBBH')
+RECORD_DTYPE = np.dtype([('ts_ns', '<u8'), ('port', '<u2'), ('direction', 'u1'), ('flags', 'u1'), ('length', '<u2')])
+
+
+def gather_rows(raw, starts, length):
+    """raw[start:start + length] for every start, as an (N, length) uint8 array."""
+    out = np.empty((len(starts), length), dtype=np.uint8)
+    columns = np.arange(length)
+    for i in range(0, len(starts), GATHER_ROWS):
+        out[i:i + GATHER_ROWS] = raw[starts[i:i + GATHER_ROWS, None] + columns]
+    return out
+
+
+def stack_capture(path, index=None):
+    """
+    stack_frames() for a capture file, vectorized over its index. Frames with a bad CRC are
+    skipped, like iter_file() does. Returns the same {(class_b, length): (timestamps, frames)}.
+    """
+    from capture_index import CaptureIndex
+
+    if index is None:
+        index = CaptureIndex.for_capture(path)
+    raw = np.memmap(path, dtype=np.uint8, mode='r')
+    epoch_ns, mono_ns = FILE_HEADER.unpack_from(raw, 0)[2:]
+    parts = {}
+    for (class_b, talker, listener), group in index.groups.items():
+        offsets = np.frombuffer(group.offsets, dtype=np.uint64).astype(np.int64)
+        # Only the part of the capture the index covers, in case the file grew since
+        offsets = offsets[offsets + RECORD_HEADER.size <= len(raw)]
+        headers = gather_rows(raw, offsets, RECORD_HEADER.size).view(RECORD_DTYPE).reshape(-1)
+        keep = (headers['flags'] & FLAG_CRC_OK) != 0
+        keep &= offsets + RECORD_HEADER.size + headers['length'] <= len(raw)
+        offsets, headers = offsets[keep], headers[keep]
+        lengths = headers['length']
+        for length in np.unique(lengths):
+            selected = lengths == length
+            starts = offsets[selected] + RECORD_HEADER.size
+            frames = gather_rows(raw, starts, int(length))
+            timestamps = headers['ts_ns'][selected].astype(np.int64) + (epoch_ns - mono_ns)
+            parts.setdefault((class_b, int(length)), []).append((starts, timestamps, frames))
+    stacked = {}
+    for key, chunks in parts.items():
+        # Back into file order, as stack_frames() would have them
+        order = np.argsort(np.concatenate([c[0] for c in chunks]), kind='stable')
+        stacked[key] = (np.concatenate([c[1] for c in chunks])[order], np.concatenate([c[2] for c in chunks])[order])
+    return stacked
+
+
+def concat_stacked(parts):
+    """{key: [(timestamps, frames), ...]} -> {key: (timestamps, frames)}, each list joined in order."""
+    stacked = {}
+    for key, chunks in parts.items():
+        if len(chunks) == 1:
+            stacked[key] = chunks[0]
+        else:
+            stacked[key] = (np.concatenate([c[0] for c in chunks]), np.concatenate([c[1] for c in chunks]))
+    return stacked
+
+
+def stack_files(paths):
+    """stack_frames() over several files of any format; captures go through stack_capture()."""
+    parts = {}
+    for path in paths:
+        stacked = stack_capture(path) if is_capture_file(path) else stack_frames(iter_file(path))
+        for key, value in stacked.items():
+            parts.setdefault(key, []).append(value)
+    return concat_stacked(parts)
+
+
+def structured_dtype(layout, length):
+    """Structured dtype placing each field of the layout at its offset within a frame of the given length."""
+    names, formats, offsets = [], [], []
+    for field in layout.fields:
+        if field.offset + np.dtype(NUMPY_TYPES[field.type]).itemsize * field.count > length:
+            continue
+        names.append(field.name)
+        formats.append((NUMPY_TYPES[field.type], (field.count,)) if field.count > 1 else NUMPY_TYPES[field.type])
+        offsets.append(field.offset)
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': length})
+
+
+def decode_group(class_b, data):
+    """Decode an (N, length) uint8 array of one Class_B into {field: array}. Scaled fields are float64."""
+    layout = LAYOUTS[class_b]
+    data = np.ascontiguousarray(data)
+    records = data.view(structured_dtype(layout, data.shape[1])).reshape(-1)
+    columns = {}
+    for field in layout.fields:
+        if field.name not in records.dtype.names:
+            continue
+        column = records[field.name]
+        if field.scale != 1:
+            column = column * field.scale
+        else:
+            column = column.copy()
+        columns[field.name] = column
+    return columns
+
+
+def decode_stacked(stacked):
+    """
+    Decode the output of stack_frames().
+    Returns {class_b: {'timestamp': int64[N], field: array[N, ...]}}, merged over
+    frame lengths and sorted by time. Unknown Class_B values are skipped.
+    """
+    parts = {}
+    for (class_b, length), (timestamps, data) in stacked.items():
+        if class_b not in LAYOUTS or length < LAYOUTS[class_b].min_length:
+            continue
+        columns = decode_group(class_b, data)
+        columns['timestamp'] = timestamps
+        parts.setdefault(class_b, []).append(columns)
+    result = {}
+    for class_b, chunks in parts.items():
+        if len(chunks) == 1:
+            columns = chunks[0]
+        else:
+            columns = {name: np.concatenate([c[name] for c in chunks]) for name in chunks[0]}
+        order = np.argsort(columns['timestamp'], kind='stable')
+        result[class_b] = {name: column[order] for name, column in columns.items()}
+    return result
+
+
+def decode_frames(records):
+    """Decode an iterable of (ts_ns, frame) into per Class_B column arrays."""
+    return decode_stacked(stack_frames(records))
+
+
+def decode_file(path):
+    return decode_stacked(stack_files([path]))
+
+
+def summary(columns):
+    """Print count and min/mean/max of every decoded field."""
+    header_names = {f.name for f in HEADER_FIELDS}
+    for class_b, fields in sorted(columns.items()):
+        timestamps = fields['timestamp']
+        span = (timestamps[-1] - timestamps[0]) / 1e9 if len(timestamps) else 0
+        print(f"Class_B 0x{class_b:02X}: {len(timestamps)} frames over {span:.1f} s")
+        for field in LAYOUTS[class_b].fields:
+            if field.name in header_names or field.name not in fields:
+                continue
+            column = fields[field.name]
+            print(f"    {field.name:16s} min {column.min():10.3f}  mean {column.mean():10.3f}  max {column.max():10.3f} {field.unit}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python batch_decode.py capture.sdccap|log.txt [out.npz]")
+        sys.exit(1)
+    columns = decode_file(sys.argv[1])
+    summary(columns)
+    if len(sys.argv) > 2:
+        arrays = {f"{class_b:02X}_{name}": column for class_b, fields in columns.items() for name, column in fields.items()}
+        np.savez(sys.argv[2], **arrays)
+        print(f"Saved {len(arrays)} arrays to {sys.argv[2]}")
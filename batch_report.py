@@ -0,0 +1,381 @@
+"""
+Fleet-wide statistics over many logs, one worker process per core.
+
+Every file is parsed and decoded with the frame_schema layouts in a worker,
+which returns a small partial aggregate: frame counts per Class_B, a summary
+per device (talker) and count/min/max/mean plus a histogram of every known
+field. The partials are merged into one report, so the work scales with the
+number of cores and memory stays flat however many files there are.
+
+Usage:
+    python batch_report.py                                  # the default Data/ logs
+    python batch_report.py Data/*.txt other/*.sdccap --workers 8
+    python batch_report.py --histograms 0x9C.temperature,0x9C.charging --json report.json
+
+Both text log formats (serial_log and host_mppt), capture files and archives
+are read. By default the host_mppt captures are left out, they duplicate the
+text logs, and of files sharing a stem (a log converted by capture.py or
+packed by archive.py) only one is read, the archive over the capture over
+the text log.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from archive import ARCHIVE_EXT, iter_archive, is_archive_file
+from capture import CAPTURE_EXT, CaptureReader, is_capture_file, iter_text_log
+from crc16 import check_frame
+from frame_schema import HEADER_FIELDS, LAYOUTS
+
+DEFAULT_PATTERNS = (
+    'Data/serial_frames_*z.txt',
+    'Data/serial_frames_*z.sdccap',
+    'Data/*.sdcarc',
+    'Data/host_mppt_*serial_log_*z.txt',
+)
+# Of default files with the same stem, the first extension here is the one read
+SOURCE_PREFERENCE = (ARCHIVE_EXT, CAPTURE_EXT, '.txt')
+# Histogram bin width by field unit, in the field's scaled unit. Fields without a unit use raw values.
+BIN_WIDTHS = {'V': 0.5, 'A': 0.25, 'W': 10, 'C': 1.0}
+HEADER_NAMES = {f.name for f in HEADER_FIELDS}
+
+
+class FieldStats:
+    """Mergeable count/min/max/sum and histogram of one field, on raw (unscaled) values."""
+    __slots__ = ('count', 'min', 'max', 'total', 'bin_width', 'histogram')
+
+    def __init__(self, bin_width=1):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.total = 0
+        self.bin_width = bin_width
+        self.histogram = {}
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        key = value // self.bin_width
+        self.histogram[key] = self.histogram.get(key, 0) + 1
+
+    def merge(self, other):
+        if not other.count:
+            return
+        self.count += other.count
+        self.total += other.total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        histogram = self.histogram
+        for key, count in other.histogram.items():
+            histogram[key] = histogram.get(key, 0) + count
+
+
+class DeviceSummary:
+    __slots__ = ('frames', 'classes', 'first_ns', 'last_ns', 'files')
+
+    def __init__(self):
+        self.frames = 0
+        self.classes = {}
+        self.first_ns = None
+        self.last_ns = None
+        self.files = 0
+
+    def merge(self, other):
+        self.frames += other.frames
+        for class_b, count in other.classes.items():
+            self.classes[class_b] = self.classes.get(class_b, 0) + count
+        if other.first_ns is not None and (self.first_ns is None or other.first_ns < self.first_ns):
+            self.first_ns = other.first_ns
+        if other.last_ns is not None and (self.last_ns is None or other.last_ns > self.last_ns):
+            self.last_ns = other.last_ns
+        self.files += other.files
+
+
+class Partial:
+    """Aggregates of one or more files. Partials of different files merge into the same result."""
+
+    def __init__(self):
+        self.files = 0
+        self.frames = 0
+        self.bytes = 0
+        self.crc_errors = 0
+        self.undecoded = 0
+        self.first_ns = None
+        self.last_ns = None
+        self.by_class = {}
+        self.devices = {}
+        self.fields = {}
+        self.errors = []
+        self.seconds = 0.0
+
+    def merge(self, other):
+        self.files += other.files
+        self.frames += other.frames
+        self.bytes += other.bytes
+        self.crc_errors += other.crc_errors
+        self.undecoded += other.undecoded
+        if other.first_ns is not None and (self.first_ns is None or other.first_ns < self.first_ns):
+            self.first_ns = other.first_ns
+        if other.last_ns is not None and (self.last_ns is None or other.last_ns > self.last_ns):
+            self.last_ns = other.last_ns
+        for class_b, count in other.by_class.items():
+            self.by_class[class_b] = self.by_class.get(class_b, 0) + count
+        for talker, device in other.devices.items():
+            mine = self.devices.get(talker)
+            if mine is None:
+                self.devices[talker] = device
+            else:
+                mine.merge(device)
+        for key, stats in other.fields.items():
+            mine = self.fields.get(key)
+            if mine is None:
+                self.fields[key] = stats
+            else:
+                mine.merge(stats)
+        self.errors.extend(other.errors)
+        self.seconds += other.seconds
+
+
+def _field_plans():
+    """Per Class_B: the layout struct and (stats key, value index, bin width) of every non-header field value."""
+    plans = {}
+    for class_b, layout in LAYOUTS.items():
+        items = []
+        for name, index, count, scale in layout.plan:
+            if name in HEADER_NAMES:
+                continue
+            unit = layout.by_name[name].unit
+            width = BIN_WIDTHS.get(unit)
+            bin_width = max(1, round(width / scale)) if width else 1
+            for i in range(count):
+                key = (class_b, name if count == 1 else f"{name}[{i}]")
+                items.append((key, index + i, bin_width))
+        plans[class_b] = (layout.struct, layout.min_length, items)
+    return plans
+
+
+def iter_frames(path):
+    """Yield (ts_ns, frame, crc_ok) from a capture file, an archive or either text log format."""
+    if is_archive_file(path):
+        for ts_ns, port, direction, crc_ok, frame in iter_archive(path):
+            yield ts_ns, frame, crc_ok
+    elif is_capture_file(path):
+        with CaptureReader(path) as reader:
+            for ts_ns, port, direction, crc_ok, frame in reader:
+                yield ts_ns, bytes(frame), crc_ok
+    else:
+        for ts_ns, direction, frame in iter_text_log(path):
+            yield ts_ns, frame, check_frame(frame)
+
+
+def analyze_file(path):
+    """Partial aggregates of one file. Runs in a worker process."""
+    start = time.perf_counter()
+    partial = Partial()
+    partial.files = 1
+    plans = _field_plans()
+    fields = partial.fields
+    devices = partial.devices
+    by_class = partial.by_class
+    first_ns = last_ns = None
+    try:
+        for ts_ns, frame, crc_ok in iter_frames(path):
+            if not crc_ok or len(frame) < 8:
+                partial.crc_errors += 1
+                continue
+            partial.frames += 1
+            partial.bytes += len(frame)
+            if first_ns is None or ts_ns < first_ns:
+                first_ns = ts_ns
+            if last_ns is None or ts_ns > last_ns:
+                last_ns = ts_ns
+            class_b = frame[3]
+            by_class[class_b] = by_class.get(class_b, 0) + 1
+
+            device = devices.get(frame[4])
+            if device is None:
+                device = devices[frame[4]] = DeviceSummary()
+                device.files = 1
+            device.frames += 1
+            device.classes[class_b] = device.classes.get(class_b, 0) + 1
+            # Timestamps are not always in order across files and ports
+            if device.first_ns is None or ts_ns < device.first_ns:
+                device.first_ns = ts_ns
+            if device.last_ns is None or ts_ns > device.last_ns:
+                device.last_ns = ts_ns
+
+            plan = plans.get(class_b)
+            if plan is None or len(frame) < plan[1]:
+                partial.undecoded += 1
+                continue
+            values = plan[0].unpack_from(frame)
+            for key, index, bin_width in plan[2]:
+                stats = fields.get(key)
+                if stats is None:
+                    stats = fields[key] = FieldStats(bin_width)
+                stats.add(values[index])
+    except (OSError, ValueError) as e:
+        partial.errors.append((path, str(e)))
+    partial.first_ns = first_ns
+    partial.last_ns = last_ns
+    partial.seconds = time.perf_counter() - start
+    return partial
+
+
+def find_files(patterns):
+    files = []
+    seen = set()
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for path in matches:
+            if path not in seen and os.path.isfile(path):
+                seen.add(path)
+                files.append(path)
+    return files
+
+
+def one_per_stem(paths):
+    """Drop files whose stem has a preferred source too, e.g. a .txt log next to its .sdccap, keeping the order."""
+    rank = {ext: i for i, ext in enumerate(SOURCE_PREFERENCE)}
+    best = {}
+    for path in paths:
+        stem, ext = os.path.splitext(path)
+        current = best.get(stem)
+        if current is None or rank.get(ext, len(rank)) < rank.get(os.path.splitext(current)[1], len(rank)):
+            best[stem] = path
+    return [path for path in paths if best[os.path.splitext(path)[0]] == path]
+
+
+def analyze_files(paths, workers=None, progress=False):
+    """Merge the partials of all files, computed on a pool of workers (workers=1 runs in this process)."""
+    total = Partial()
+    # Largest files first, so one big file doesn't finish alone at the end
+    paths = sorted(paths, key=os.path.getsize, reverse=True)
+    if workers == 1 or len(paths) <= 1:
+        for path in paths:
+            total.merge(analyze_file(path))
+        return total
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(analyze_file, path) for path in paths]
+        for done, future in enumerate(as_completed(futures), 1):
+            total.merge(future.result())
+            if progress:
+                print(f"\r{done}/{len(paths)} files", end='', file=sys.stderr, flush=True)
+    if progress:
+        print(file=sys.stderr)
+    return total
+
+
+def field_unit_scale(class_b, name):
+    field = LAYOUTS[class_b].by_name[name.split('[')[0]]
+    return field.unit, field.scale
+
+
+def _time(ts_ns):
+    return '-' if ts_ns is None else datetime.fromtimestamp(ts_ns / 1e9).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def report_dict(total):
+    """The merged result as plain data (scaled values), e.g. for JSON."""
+    fields = {}
+    for (class_b, name), stats in sorted(total.fields.items()):
+        unit, scale = field_unit_scale(class_b, name)
+        fields[f"0x{class_b:02X}.{name}"] = {
+            'unit': unit,
+            'count': stats.count,
+            'min': stats.min * scale,
+            'max': stats.max * scale,
+            'mean': stats.total / stats.count * scale,
+            'histogram': {round(key * stats.bin_width * scale, 6): count
+                          for key, count in sorted(stats.histogram.items())},
+        }
+    return {
+        'files': total.files,
+        'frames': total.frames,
+        'bytes': total.bytes,
+        'crc_errors': total.crc_errors,
+        'undecoded': total.undecoded,
+        'first': _time(total.first_ns),
+        'last': _time(total.last_ns),
+        'by_class': {f"0x{c:02X}": n for c, n in sorted(total.by_class.items())},
+        'devices': {
+            f"0x{talker:02X}": {
+                'frames': d.frames,
+                'files': d.files,
+                'first': _time(d.first_ns),
+                'last': _time(d.last_ns),
+                'by_class': {f"0x{c:02X}": n for c, n in sorted(d.classes.items())},
+            }
+            for talker, d in sorted(total.devices.items())
+        },
+        'fields': fields,
+        'errors': total.errors,
+    }
+
+
+def print_report(report, histograms=()):
+    print(f"Files: {report['files']}, frames: {report['frames']}, bytes: {report['bytes']}, "
+          f"CRC/short: {report['crc_errors']}, undecoded: {report['undecoded']}")
+    print(f"Time span: {report['first']} .. {report['last']}")
+    print("\nFrames by Class_B:")
+    for class_b, count in report['by_class'].items():
+        print(f"  {class_b}  {count:>10}")
+    print("\nDevices (by talker):")
+    for talker, d in report['devices'].items():
+        classes = ', '.join(f"{c}:{n}" for c, n in d['by_class'].items())
+        print(f"  {talker}  {d['frames']:>10} frames in {d['files']} files, {d['first']} .. {d['last']}  [{classes}]")
+    print("\nFields:")
+    for name, f in report['fields'].items():
+        unit = f" {f['unit']}" if f['unit'] else ''
+        print(f"  {name:<32} n {f['count']:>9}  min {f['min']:>9.2f}  mean {f['mean']:>9.2f}  max {f['max']:>9.2f}{unit}")
+    for name in histograms:
+        f = report['fields'].get(name)
+        if f is None:
+            print(f"\nNo values for {name}")
+            continue
+        print(f"\nHistogram of {name} ({f['unit'] or 'raw'}):")
+        peak = max(f['histogram'].values())
+        for edge, count in f['histogram'].items():
+            print(f"  {edge:>10g}  {count:>9}  {'#' * max(1, round(count / peak * 50))}")
+    for path, error in report['errors']:
+        print(f"Error in {path}: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Statistics over many logs and captures")
+    parser.add_argument('paths', nargs='*', help="files or glob patterns (default: the Data/ logs)")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument('--histograms', default='', help="comma separated fields to print histograms of, e.g. 0x9C.temperature")
+    parser.add_argument('--json', help="also write the full report, histograms included, to this file")
+    args = parser.parse_args()
+
+    files = find_files(args.paths) if args.paths else one_per_stem(find_files(DEFAULT_PATTERNS))
+    if not files:
+        print("No files found.")
+        return 1
+    start = time.perf_counter()
+    total = analyze_files(files, args.workers, progress=sys.stderr.isatty())
+    elapsed = time.perf_counter() - start
+    report = report_dict(total)
+    print_report(report, [name.strip() for name in args.histograms.split(',') if name.strip()])
+    print(f"\n{len(files)} files in {elapsed:.2f} s ({total.frames / elapsed:,.0f} frames/s, "
+          f"{total.seconds:.2f} s of worker time, {args.workers or os.cpu_count()} workers)")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=1)
+        print(f"Report written to {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,351 @@
+"""
+Benchmarks of the protocol hot paths.
+
+Each run prints a table and appends one JSON line (date, git commit,
+machine, results) to bench_results.jsonl, so numbers can be compared over
+time. The last section turns the per-byte and per-frame costs into how many
+ports at 115200 baud one core can keep up with.
+
+Usage:
+    python bench.py                       # everything
+    python bench.py --only crc,decoder    # some groups
+    python bench.py --quick --no-save
+
+Groups: crc, build, decoder, decode, metrics, capture, batch (needs numpy), writer, latency (needs a Linux pty)
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import frame_encoder
+from crc16 import add_crc16_checksum, crc16, verify
+from frame_decoder import FrameDecoder
+from frame_schema import decode
+from metrics import Metrics
+from sdc_frames import FRAME_66, build_frame, build_frame_38, set_sequence
+
+RESULTS_FILE = 'bench_results.jsonl'
+BAUD_RATE = 115200
+# 8N1: 10 bits on the wire per byte
+LINE_BYTES_PER_SEC = BAUD_RATE / 10
+
+results = {}
+
+
+def legacy_add_crc16_checksum(data: bytes) -> bytes:
+    """The original bit by bit implementation from host_mppt, kept as the reference point."""
+    crc = 0x496C
+    poly = 0x1021
+    for byte in data:
+        temp_byte = bin(byte)[2:].zfill(8)[::-1]
+        crc ^= (int(temp_byte, 2) << 8)
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = (crc << 1) ^ poly
+            else:
+                crc <<= 1
+            crc &= 0xFFFF
+    reflected_crc = int(bin(crc)[2:].zfill(16)[::-1], 2)
+    return data + reflected_crc.to_bytes(2, byteorder='little')
+
+
+def measure(name, func, per=1, unit='op', min_time=0.2, repeat=5):
+    """Time func() and record the best time per unit. per = units processed by one call."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 10 or number >= 1 << 24:
+            break
+        number *= 10
+    number = max(1, int(number * (min_time / 10) / max(elapsed, 1e-9)))
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter() - start) / (number * per)
+        best = elapsed if best is None else min(best, elapsed)
+    results[name] = {'seconds_per_unit': best, 'unit': unit}
+    print(f"{name:40s} {best * 1e6:12.3f} us/{unit:6s} {1 / best:14,.0f} {unit}/s")
+    return best
+
+
+def sample_frames(count=1000, seed=1):
+    """A mix like an MPPT link: 0x66/0x9C/0x38/0x20 plus some 0x2D pack frames."""
+    rng = random.Random(seed)
+    frames = []
+    for i in range(count):
+        kind = i % 5
+        if kind == 0:
+            frame = set_sequence(FRAME_66, i, 0xEB)
+        elif kind == 1:
+            frame = build_frame(0x9C, 0xEB, 0xAB, i, 0x80, bytes(rng.randrange(256) for _ in range(26)))
+        elif kind == 2:
+            frame = build_frame_38(0xEB, i, 52.2, 7.65)
+        elif kind == 3:
+            frame = build_frame(0x20, 0xEB, 0xAB, i, 0x80, bytes(rng.randrange(256) for _ in range(11)))
+        else:
+            frame = build_frame(0x2D, 0xEC, 0xAB, i, 0x80, bytes(rng.randrange(256) for _ in range(119)))
+        frames.append(add_crc16_checksum(frame))
+    return frames
+
+
+def noisy_stream(frames, rng, fault_rate=0.05):
+    parts = []
+    for frame in frames:
+        if rng.random() < fault_rate:
+            frame = bytearray(frame)
+            frame[rng.randrange(len(frame))] ^= 0xFF
+            parts.append(bytes(rng.randrange(256) for _ in range(rng.randrange(1, 8))))
+        parts.append(bytes(frame))
+    return b''.join(parts)
+
+
+def bench_crc(quick):
+    frame = build_frame_38(0xEB, 1, 52.2, 7.65)
+    big = add_crc16_checksum(build_frame(0x2D, 0xEC, 0xAB, 1, 0x80, bytes(119)))
+    legacy = measure('crc.legacy_add_crc16_checksum (23B)', lambda: legacy_add_crc16_checksum(frame), unit='frame')
+    table = measure('crc.add_crc16_checksum (23B)', lambda: add_crc16_checksum(frame), unit='frame')
+    results['crc.speedup'] = {'value': legacy / table}
+    print(f"{'crc.speedup':40s} {legacy / table:12.1f} x")
+    measure('crc.crc16 per byte (131B)', lambda: crc16(big), per=len(big), unit='byte')
+    frames = sample_frames(1000)
+    measure('crc.verify bulk', lambda: verify(frames), per=len(frames), unit='frame')
+
+
+def bench_build(quick):
+    # MpptSession.frame_38 / from_template are thin wrappers around these
+    measure('build.build_frame_38', lambda: build_frame_38(0xEB, 1234, 52.2, 7.65), unit='frame')
+    measure('build.set_sequence (0x66)', lambda: set_sequence(FRAME_66, 1234, 0xEB), unit='frame')
+    measure('build.0x38 + crc', lambda: add_crc16_checksum(build_frame_38(0xEB, 1234, 52.2, 7.65)), unit='frame')
+    # Preallocated encoders: sequence, fields and CRC patched in place
+    encoder = frame_encoder.frame_38(0xEB, 52.2, 7.65)
+    measure('build.encoder 0x38 + crc', lambda: encoder.encode(1234), unit='frame')
+    encoder_66 = frame_encoder.frame_66(0xEB)
+    measure('build.encoder 0x66 + crc', lambda: encoder_66.encode(1234), unit='frame')
+    encoder_9c = frame_encoder.frame_9c()
+    values = {'output_voltage': 52.1, 'output_current': 7.5, 'temperature': 31.2}
+    measure('build.encoder 0x9C set 3 fields + crc', lambda: (encoder_9c.set(**values), encoder_9c.encode(1234)),
+            unit='frame')
+
+
+def bench_decoder(quick):
+    frames = sample_frames(2000)
+    clean = b''.join(frames)
+    noisy = noisy_stream(frames, random.Random(2))
+    avg_len = len(clean) / len(frames)
+    results['decoder.avg_frame_len'] = {'value': avg_len}
+
+    def run(stream, chunk):
+        decoder = FrameDecoder()
+        feed = decoder.feed
+        for i in range(0, len(stream), chunk):
+            feed(stream[i:i + chunk])
+
+    for chunk in (1, 64, 4096):
+        measure(f'decoder.clean chunk={chunk}', lambda: run(clean, chunk), per=len(clean), unit='byte')
+    measure('decoder.noisy 5% chunk=64', lambda: run(noisy, 64), per=len(noisy), unit='byte')
+
+
+def bench_decode(quick):
+    frames = {f[3]: f for f in sample_frames(10)}
+    for class_b in (0x9C, 0x38, 0x2D):
+        frame = frames[class_b]
+        measure(f'decode.frame_schema 0x{class_b:02X}', lambda: decode(frame), unit='frame')
+
+
+def bench_metrics(quick):
+    frames = sample_frames(1000)
+    metrics = Metrics()
+    port_metrics = metrics.port('bench')
+    metrics.add_decoder('bench', FrameDecoder())
+    measure('metrics.count (batch of 1000)', lambda: port_metrics.count(frames), per=len(frames), unit='frame')
+    measure('metrics.render', metrics.render, unit='scrape')
+
+
+def bench_capture(quick):
+    from capture import CaptureWriter
+    from replay import parse_file
+
+    count = 20000 if quick else 200000
+    frames = sample_frames(1000)
+    directory = tempfile.mkdtemp(prefix='sdc_bench_')
+    try:
+        text_path = os.path.join(directory, 'serial_frames.txt')
+        capture_path = os.path.join(directory, 'serial_frames.sdccap')
+        with open(text_path, 'w') as f, CaptureWriter(capture_path) as writer:
+            for i in range(count):
+                frame = frames[i % len(frames)]
+                f.write(f"{1700000000000 + i}\t" + '\t'.join(f"0x{b:02X}" for b in frame) + '\n')
+                writer.write(frame)
+        text_size = os.path.getsize(text_path)
+        capture_size = os.path.getsize(capture_path)
+        results['capture.size_ratio'] = {'value': text_size / capture_size}
+        print(f"{'capture.size text/binary':40s} {text_size / capture_size:12.1f} x")
+
+        def consume(path):
+            for _ in parse_file(path):
+                pass
+
+        measure('capture.replay.parse_file text', lambda: consume(text_path), per=count, unit='frame', min_time=0.5, repeat=3)
+        measure('capture.replay.parse_file binary', lambda: consume(capture_path), per=count, unit='frame', min_time=0.5, repeat=3)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_batch(quick):
+    """batch_decode: stacking a whole capture through its index vs frame by frame, then the vectorized decode."""
+    from batch_decode import decode_stacked, iter_file, stack_capture, stack_frames
+    from capture import CaptureWriter
+    from capture_index import CaptureIndex
+
+    count = 100000 if quick else 1000000
+    frames = sample_frames(1000)
+    directory = tempfile.mkdtemp(prefix='sdc_bench_')
+    try:
+        capture_path = os.path.join(directory, 'serial_frames.sdccap')
+        with CaptureWriter(capture_path) as writer:
+            for i in range(count):
+                writer.write(frames[i % len(frames)])
+        index = CaptureIndex.for_capture(capture_path)
+        stacked = stack_capture(capture_path, index)
+        measure('batch.stack_capture (indexed)', lambda: stack_capture(capture_path, index), per=count, unit='frame',
+                min_time=0.5, repeat=3)
+        measure('batch.stack_frames (per frame)', lambda: stack_frames(iter_file(capture_path)), per=count,
+                unit='frame', min_time=0.5, repeat=3)
+        measure('batch.decode_stacked', lambda: decode_stacked(stacked), per=count, unit='frame', min_time=0.5, repeat=3)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_writer(quick):
+    from capture import CaptureLogWriter
+
+    count = 20000 if quick else 200000
+    frames = sample_frames(1000)
+    directory = tempfile.mkdtemp(prefix='sdc_bench_')
+    try:
+        writer = CaptureLogWriter(os.path.join(directory, 'cap_{time}.sdccap')).start()
+        start = time.perf_counter()
+        for i in range(count):
+            writer.write(frames[i % len(frames)])
+        queued = time.perf_counter() - start
+        writer.close()
+        total = time.perf_counter() - start
+        for name, seconds in (('writer.queue (reader side)', queued), ('writer.end to end', total)):
+            results[name] = {'seconds_per_unit': seconds / count, 'unit': 'frame'}
+            print(f"{name:40s} {seconds / count * 1e6:12.3f} us/frame  {count / seconds:14,.0f} frame/s")
+        results['writer.max_backlog'] = {'value': writer.max_backlog}
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_latency(quick):
+    from aio_serial import AsyncSerialPort
+    from request_tracker import RequestTracker
+    from simulators import MpptSim
+
+    count = 200 if quick else 2000
+
+    async def run():
+        sim = MpptSim().start()
+        tracker = RequestTracker(history=count)
+        port = AsyncSerialPort(sim.path, on_frames=lambda p, frames, ts: [tracker.match(f, ts) for f in frames]).open()
+        try:
+            for i in range(count):
+                frame = add_crc16_checksum(set_sequence(FRAME_66, i + 1, 0xEB))
+                reply = tracker.expect(frame, 1.0)
+                port.write(frame)
+                await reply
+        finally:
+            port.close()
+            sim.close()
+        return tracker.stats()
+
+    stats = asyncio.run(run())
+    for key in ('p50_ms', 'p99_ms', 'max_ms'):
+        results[f'latency.pty request/reply {key}'] = {'value': stats[key]}
+    print(f"{'latency.pty request/reply':40s} p50 {stats['p50_ms']:.3f} ms  p99 {stats['p99_ms']:.3f} ms  "
+          f"max {stats['max_ms']:.3f} ms  ({stats['timeouts']} timeouts)")
+
+
+def ports_per_core():
+    """Saturated 115200 baud link: CPU seconds per second per port from the measured costs."""
+    needed = ['decoder.clean chunk=64', 'decode.frame_schema 0x9C', 'writer.queue (reader side)']
+    if not all(name in results for name in needed):
+        return
+    avg_len = results['decoder.avg_frame_len']['value']
+    frames_per_sec = LINE_BYTES_PER_SEC / avg_len
+    per_byte = results['decoder.clean chunk=64']['seconds_per_unit']
+    per_frame = results['decode.frame_schema 0x9C']['seconds_per_unit'] + results['writer.queue (reader side)']['seconds_per_unit']
+    load = LINE_BYTES_PER_SEC * per_byte + frames_per_sec * per_frame
+    results['ports_per_core'] = {'value': 1 / load}
+    print(f"\nOne port at {BAUD_RATE} baud: {LINE_BYTES_PER_SEC:.0f} B/s, {frames_per_sec:.0f} frames/s "
+          f"-> {load * 100:.2f}% of a core. One core sustains about {1 / load:.0f} ports (decode + log, no GUI).")
+
+
+GROUPS = {
+    'crc': bench_crc,
+    'build': bench_build,
+    'decoder': bench_decoder,
+    'decode': bench_decode,
+    'metrics': bench_metrics,
+    'capture': bench_capture,
+    'batch': bench_batch,
+    'writer': bench_writer,
+    'latency': bench_latency,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the SDC protocol hot paths")
+    parser.add_argument('--only', help="comma separated groups: " + ','.join(GROUPS))
+    parser.add_argument('--quick', action='store_true', help="smaller inputs")
+    parser.add_argument('--results', default=RESULTS_FILE, help="JSON lines file the run is appended to")
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    groups = args.only.split(',') if args.only else list(GROUPS)
+    for group in groups:
+        if group not in GROUPS:
+            parser.error(f"unknown group {group}")
+    for group in groups:
+        try:
+            GROUPS[group](args.quick)
+        except (OSError, ImportError) as e:
+            print(f"{group}: skipped ({e})")
+    ports_per_core()
+
+    if not args.no_save:
+        entry = {
+            'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'machine': f"{platform.system()} {platform.machine()} {platform.processor()}".strip(),
+            'quick': args.quick,
+            'results': results,
+        }
+        with open(args.results, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+        print(f"Results appended to {args.results}")
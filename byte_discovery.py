@@ -0,0 +1,305 @@
+"""
+Find candidate fields in the undocumented bytes of a Class_B.
+
+All frames of one Class_B and length are stacked into an (N, length) array.
+Every payload byte (u8) and every byte pair (u16 little and big endian,
+i16 little endian) is then scored column-wise with NumPy:
+
+    distinct    number of different values
+    entropy     bits per frame
+    changes     fraction of consecutive frames where the value changes
+    monotonic   1.0 for a value that only ever goes one way (a counter), 0 for no trend
+    corr        strongest Pearson correlation with a known field (same frame, or the
+                latest frame of another Class_B), and which field that is
+    change pt   largest level shift over time (CUSUM), its time and t-score
+
+and the candidates are ranked by how much structure they show. Bytes covered
+by frame_schema layouts are left out unless --include-known is given.
+
+Usage:
+    python byte_discovery.py Data/serial_frames_*.sdccap --class-b 0x2D
+    python byte_discovery.py log.txt --class-b 0x38 --top 20 --csv candidates.csv
+
+Needs numpy.
+"""
+
+import argparse
+import csv
+import glob
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from batch_decode import NUMPY_TYPES, decode_group, decode_stacked, stack_files
+from frame_schema import HEADER_FIELDS, LAYOUTS
+from sdc_frames import CRC_LEN, HEADER_LEN
+
+# Keep the temporary (frames x columns) arrays to about this many elements
+CHUNK_ELEMENTS = 1 << 23
+KINDS = ('u8', 'u16le', 'u16be', 'i16le')
+HEADER_NAMES = {f.name for f in HEADER_FIELDS}
+
+
+def candidate_blocks(data):
+    """
+    Yield (kind, first offset, (K, N) int array) of the payload bytes viewed as each kind.
+    Each row is the time series of one candidate, contiguous so per-candidate reductions are fast.
+    """
+    start, end = HEADER_LEN, data.shape[1] - CRC_LEN
+    if end <= start:
+        return
+    payload = np.ascontiguousarray(data[:, start:end].T).astype(np.int32)
+    yield 'u8', start, payload
+    if end - start >= 2:
+        low, high = payload[:-1], payload[1:]
+        u16le = low | (high << 8)
+        yield 'u16le', start, u16le
+        yield 'u16be', start, (low << 8) | high
+        yield 'i16le', start, u16le - ((u16le & 0x8000) << 1)
+
+
+def entropy_and_distinct(series, bits):
+    """Shannon entropy (bits) and distinct value count of each row, values in [0, 2**bits)."""
+    k, n = series.shape
+    size = 1 << bits
+    entropy = np.zeros(k)
+    distinct = np.zeros(k, dtype=np.int64)
+    step = max(1, CHUNK_ELEMENTS // max(n, size))
+    for r0 in range(0, k, step):
+        rows = series[r0:r0 + step]
+        c = len(rows)
+        counts = np.bincount((rows + (np.arange(c) * size)[:, None]).ravel(), minlength=c * size)
+        present = np.flatnonzero(counts)
+        row = present // size
+        p = counts[present] / n
+        distinct[r0:r0 + c] = np.bincount(row, minlength=c)
+        # 0 - sum rather than -sum, so a constant row is 0.0 and not -0.0
+        entropy[r0:r0 + c] = 0.0 - np.bincount(row, weights=p * np.log2(p), minlength=c)
+    return entropy, distinct
+
+
+def trend(series):
+    """Fraction of frames where the value changes, and the monotonic score |up - down| / (up + down)."""
+    diff = np.diff(series, axis=1)
+    up = (diff > 0).sum(axis=1)
+    down = (diff < 0).sum(axis=1)
+    moves = up + down
+    changes = moves / max(1, diff.shape[1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        monotonic = np.where(moves > 0, np.abs(up - down) / moves, 0.0)
+    return changes, monotonic
+
+
+def standardize(series):
+    """Rows scaled to mean 0 and standard deviation 1 (constant rows become 0)."""
+    x = series.astype(np.float64)
+    x -= x.mean(axis=1, keepdims=True)
+    std = np.sqrt((x * x).mean(axis=1, keepdims=True))
+    x /= np.where(std > 0, std, np.inf)
+    return x
+
+
+def correlations(z, refs):
+    """
+    (best |r|, index of that reference) per standardized row against the standardized (N, M) references.
+    The index is -1 where nothing correlates at all, e.g. a constant row.
+    """
+    k = len(z)
+    if refs is None or refs.shape[1] == 0:
+        return np.zeros(k), np.full(k, -1)
+    r = np.abs(z @ refs) / z.shape[1]
+    best = r.argmax(axis=1)
+    corr = r[np.arange(k), best]
+    best[corr == 0] = -1
+    return corr, best
+
+
+def change_points(z):
+    """Index and t-score of the largest mean shift of each standardized row (single change point CUSUM)."""
+    k, n = z.shape
+    if n < 2:
+        return np.zeros(k, dtype=np.int64), np.zeros(k)
+    cusum = np.cumsum(z[:, :-1], axis=1)
+    at = np.abs(cusum).argmax(axis=1)
+    before = at + 1                                     # frames up to and including the change
+    after = n - before
+    # Mean before minus mean after, in standard deviations, times sqrt(before * after / n)
+    shift = cusum[np.arange(k), at] * n / (before * after)
+    return before, np.abs(shift) * np.sqrt(before * after / n)
+
+
+def reference_matrix(class_b, data, timestamps, others):
+    """
+    Standardized (N, M) matrix of known scalar fields for the frames in data: the fields of
+    this frame if its Class_B has a layout, otherwise (and also) the latest value of the fields
+    of every other decoded Class_B at each frame's time.
+    """
+    names, columns = [], []
+    if class_b in LAYOUTS and data.shape[1] >= LAYOUTS[class_b].min_length:
+        for name, column in decode_group(class_b, data).items():
+            if name not in HEADER_NAMES and column.ndim == 1:
+                names.append(f"0x{class_b:02X}.{name}")
+                columns.append(column.astype(np.float64))
+    for other_class, fields in others.items():
+        if other_class == class_b or not len(fields['timestamp']):
+            continue
+        index = np.searchsorted(fields['timestamp'], timestamps, side='right') - 1
+        valid = index >= 0
+        for name, column in fields.items():
+            if name == 'timestamp' or name in HEADER_NAMES or column.ndim != 1:
+                continue
+            aligned = column[np.maximum(index, 0)].astype(np.float64)
+            # Before the first frame of the other Class_B use its first value
+            aligned[~valid] = column[0]
+            names.append(f"0x{other_class:02X}.{name}")
+            columns.append(aligned)
+    if not columns:
+        return [], None
+    refs = np.column_stack(columns)
+    std = refs.std(axis=0)
+    keep = std > 0
+    refs = (refs[:, keep] - refs[:, keep].mean(axis=0)) / std[keep]
+    return [name for name, k in zip(names, keep) if k], refs
+
+
+def known_offsets(class_b, length):
+    """Payload offsets covered by the frame_schema layout of class_b."""
+    covered = {}
+    layout = LAYOUTS.get(class_b)
+    if layout is None:
+        return covered
+    for field in layout.fields:
+        if field.name in HEADER_NAMES:
+            continue
+        size = np.dtype(NUMPY_TYPES[field.type]).itemsize
+        for i in range(field.offset, min(length, field.offset + size * field.count)):
+            covered[i] = field.name
+    return covered
+
+
+def label(row):
+    if row['distinct'] == 1:
+        return 'constant'
+    if row['corr'] >= 0.9:
+        return f"tracks {row['corr_field']}"
+    if row['monotonic'] >= 0.95 and row['changes'] >= 0.5:
+        return 'counter'
+    if row['distinct'] <= 8 and row['changes'] < 0.05:
+        return 'flag/enum'
+    if row['corr'] >= 0.5:
+        return f"related to {row['corr_field']}"
+    if row['entropy'] >= 7 and row['changes'] >= 0.9:
+        return 'noisy/checksum'
+    if row['cp_score'] >= 10:
+        return 'level change'
+    return 'measurement?' if row['distinct'] > 16 else 'state?'
+
+
+def analyze(class_b, timestamps, data, others, include_known=False):
+    """Score every candidate of one (Class_B, length) group. Returns the rows, most interesting first."""
+    order = np.argsort(timestamps, kind='stable')
+    timestamps = timestamps[order]
+    data = np.ascontiguousarray(data[order])
+    n, length = data.shape
+    ref_names, refs = reference_matrix(class_b, data, timestamps, others)
+    known = known_offsets(class_b, length)
+    rows = []
+    constant_bytes = set()
+    for kind, start, series in candidate_blocks(data):
+        width = 1 if kind == 'u8' else 2
+        if kind in ('u8', 'u16le'):
+            # The other 16-bit views are one-to-one with u16le, so they share its entropy and distinct count
+            entropy, distinct = entropy_and_distinct(series, 8 if kind == 'u8' else 16)
+        changes, monotonic = trend(series)
+        k = len(series)
+        corr = np.empty(k)
+        corr_index = np.empty(k, dtype=np.int64)
+        cp_index = np.empty(k, dtype=np.int64)
+        cp_score = np.empty(k)
+        step = max(1, CHUNK_ELEMENTS // max(1, n))
+        for r0 in range(0, k, step):
+            z = standardize(series[r0:r0 + step])
+            corr[r0:r0 + step], corr_index[r0:r0 + step] = correlations(z, refs)
+            cp_index[r0:r0 + step], cp_score[r0:r0 + step] = change_points(z)
+        if kind == 'u8':
+            constant_bytes = {start + j for j in np.flatnonzero(distinct == 1)}
+        for j in range(k):
+            offset = start + j
+            if width == 2 and (offset in constant_bytes or offset + 1 in constant_bytes):
+                continue  # Same information as the u8 candidate of the other byte
+            covered = [known[i] for i in range(offset, offset + width) if i in known]
+            if covered and not include_known:
+                continue
+            row = {
+                'candidate': f"{kind}@{offset}",
+                'kind': kind,
+                'offset': offset,
+                'known': ','.join(sorted(set(covered))),
+                'distinct': int(distinct[j]),
+                'entropy': float(entropy[j]),
+                'changes': float(changes[j]),
+                'monotonic': float(monotonic[j]),
+                'corr': float(corr[j]),
+                'corr_field': ref_names[corr_index[j]] if corr_index[j] >= 0 and distinct[j] > 1 else '',
+                'cp_time_ns': int(timestamps[min(cp_index[j], n - 1)]) if n else 0,
+                'cp_score': float(cp_score[j]),
+            }
+            # Counters, tracking values and clean level shifts rank highest; constants last
+            structure = max(row['corr'],
+                            row['monotonic'] if row['changes'] >= 0.01 else 0.0,
+                            row['cp_score'] / (row['cp_score'] + 10))
+            row['score'] = 0.0 if row['distinct'] == 1 else structure
+            row['label'] = label(row)
+            rows.append(row)
+    rows.sort(key=lambda r: (-r['score'], r['offset'], KINDS.index(r['kind'])))
+    return rows
+
+
+def print_rows(class_b, length, n, rows, top):
+    print(f"Class_B 0x{class_b:02X}, length {length}: {n} frames, {len(rows)} candidates")
+    print(f"  {'candidate':<12} {'score':>5} {'distinct':>8} {'entropy':>7} {'changes':>7} {'mono':>5} "
+          f"{'corr':>5} {'with':<22} {'change point':<19} {'t':>7}  label")
+    for row in rows[:top]:
+        cp_time = datetime.fromtimestamp(row['cp_time_ns'] / 1e9).strftime('%Y-%m-%d %H:%M:%S')
+        known = f" [{row['known']}]" if row['known'] else ''
+        print(f"  {row['candidate']:<12} {row['score']:5.2f} {row['distinct']:8d} {row['entropy']:7.2f} "
+              f"{row['changes']:7.3f} {row['monotonic']:5.2f} {row['corr']:5.2f} {row['corr_field']:<22} "
+              f"{cp_time:<19} {row['cp_score']:7.1f}  {row['label']}{known}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rank candidate fields in undocumented payload bytes")
+    parser.add_argument('files', nargs='+', help="captures or text logs (glob patterns allowed)")
+    parser.add_argument('--class-b', required=True, type=lambda v: int(v, 0))
+    parser.add_argument('--length', type=int, help="frame length to analyze (default: the most common)")
+    parser.add_argument('--top', type=int, default=40)
+    parser.add_argument('--include-known', action='store_true', help="also score bytes of documented fields")
+    parser.add_argument('--csv', help="write all candidate rows to this file")
+    args = parser.parse_args()
+
+    paths = [p for pattern in args.files for p in (sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern])]
+    stacked = stack_files(paths)
+    lengths = {length: len(ts) for (class_b, length), (ts, data) in stacked.items() if class_b == args.class_b}
+    if not lengths:
+        print(f"No frames with Class_B 0x{args.class_b:02X}")
+        return 1
+    length = args.length or max(lengths, key=lengths.get)
+    if length not in lengths:
+        print(f"No 0x{args.class_b:02X} frames of length {length}, lengths seen: {sorted(lengths)}")
+        return 1
+    timestamps, data = stacked[(args.class_b, length)]
+    others = decode_stacked(stacked)
+    rows = analyze(args.class_b, timestamps, data, others, args.include_known)
+    print_rows(args.class_b, length, len(timestamps), rows, args.top)
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()) if rows else ['candidate'])
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"Wrote {len(rows)} rows to {args.csv}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,434 @@
+"""
+Binary capture format for SDC serial traffic.
+
+File header (24 bytes):
+    6s  magic b'SDCCAP'
+    H   format version
+    Q   wall clock time in ns (time.time_ns) when the file was started
+    Q   monotonic time in ns (time.monotonic_ns) at the same moment
+
+Then records, each a fixed 14 byte header followed by the raw frame:
+    Q   monotonic timestamp in ns
+    H   port id
+    B   direction (DIR_RX, DIR_TX or DIR_PORT_NAME)
+    B   flags (FLAG_CRC_OK)
+    H   length of the frame that follows
+
+A record with direction DIR_PORT_NAME carries the utf-8 name of a port id
+instead of a frame, so the file stays append-only and self describing.
+
+Usage:
+    python capture.py convert serial_frames_xxx.txt [out.sdccap]
+    python capture.py dump capture.sdccap     # one line per frame: ms, port, TX/RX[ CRC!], hex
+"""
+
+import bisect
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+
+from crc16 import check_frame
+from frame_decoder import FrameDecoder
+from log_writer import LogWriter
+
+CAPTURE_MAGIC = b'SDCCAP'
+CAPTURE_VERSION = 1
+CAPTURE_EXT = '.sdccap'
+
+FILE_HEADER = struct.Struct('<6sHQQ')
+RECORD_HEADER = struct.Struct('<QHBBH')
+
+DIR_RX = 0
+DIR_TX = 1
+DIR_PORT_NAME = 0xFF
+
+FLAG_CRC_OK = 0x01
+
+
+class CaptureWriter:
+    """Write frames to a new capture file. Safe to share between reader threads."""
+
+    def __init__(self, path, epoch_ns=None, mono_ns=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.port_ids = {}
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            # The header's monotonic clock belongs to the process that started the file,
+            # frames timed by another process's clock would get the wrong wall clock times
+            raise FileExistsError(f"{path} already exists, captures are never appended to")
+        self.file = open(path, 'ab')
+        if mono_ns is None:
+            mono_ns = time.monotonic_ns()
+        if epoch_ns is None:
+            epoch_ns = time.time_ns()
+        self.file.write(FILE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, epoch_ns, mono_ns))
+
+    def port_id(self, name):
+        """Return the id for a port name, recording the name in the file on first use."""
+        with self.lock:
+            port_id = self.port_ids.get(name)
+            if port_id is None:
+                port_id = len(self.port_ids)
+                self.port_ids[name] = port_id
+                data = name.encode('utf-8')
+                self.file.write(RECORD_HEADER.pack(0, port_id, DIR_PORT_NAME, 0, len(data)) + data)
+            return port_id
+
+    def write(self, frame, port=0, direction=DIR_RX, crc_ok=True, ts_ns=None):
+        """Append one frame. ts_ns defaults to time.monotonic_ns()."""
+        if ts_ns is None:
+            ts_ns = time.monotonic_ns()
+        header = RECORD_HEADER.pack(ts_ns, port, direction, FLAG_CRC_OK if crc_ok else 0, len(frame))
+        with self.lock:
+            self.file.write(header)
+            self.file.write(frame)
+
+    def write_many(self, frames, port=0, direction=DIR_RX, crc_ok=True, ts_ns=None):
+        """Append several frames received together with one timestamp."""
+        if ts_ns is None:
+            ts_ns = time.monotonic_ns()
+        flags = FLAG_CRC_OK if crc_ok else 0
+        pack = RECORD_HEADER.pack
+        data = b''.join(pack(ts_ns, port, direction, flags, len(frame)) + frame for frame in frames)
+        with self.lock:
+            self.file.write(data)
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CaptureLogWriter(LogWriter):
+    """
+    CaptureWriter with the same write()/write_many()/port_id() calls, but the
+    file work happens on a background thread with batching and rotation.
+    Every rotated file starts with its own header and port names.
+    With index=True each file also gets a capture_index sidecar, built as
+    the records are written and saved when the file is rotated or closed.
+    """
+
+    def __init__(self, path_template, index=False, **kwargs):
+        super().__init__(path_template, **kwargs)
+        self.lock = threading.Lock()
+        self.port_ids = {}
+        self.index_enabled = index
+        self.capture_index = None
+        self.index_offset_ns = 0
+
+    def port_id(self, name):
+        with self.lock:
+            port_id = self.port_ids.get(name)
+            if port_id is None:
+                port_id = len(self.port_ids)
+                self.port_ids[name] = port_id
+                self.put((0, port_id, DIR_PORT_NAME, 0, name.encode('utf-8')))
+            return port_id
+
+    def write(self, frame, port=0, direction=DIR_RX, crc_ok=True, ts_ns=None):
+        if ts_ns is None:
+            ts_ns = time.monotonic_ns()
+        self.put((ts_ns, port, direction, FLAG_CRC_OK if crc_ok else 0, frame))
+
+    def write_many(self, frames, port=0, direction=DIR_RX, crc_ok=True, ts_ns=None):
+        if ts_ns is None:
+            ts_ns = time.monotonic_ns()
+        flags = FLAG_CRC_OK if crc_ok else 0
+        for frame in frames:
+            self.put((ts_ns, port, direction, flags, frame))
+
+    def flush(self):
+        # Flushing is done by the writer thread
+        pass
+
+    def encode(self, item):
+        ts_ns, port, direction, flags, frame = item
+        return RECORD_HEADER.pack(ts_ns, port, direction, flags, len(frame)) + frame
+
+    def header(self):
+        epoch_ns, mono_ns = time.time_ns(), time.monotonic_ns()
+        data = FILE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, epoch_ns, mono_ns)
+        with self.lock:
+            names = sorted(self.port_ids.items(), key=lambda item: item[1])
+        # The port name records queued so far may land in the previous file, so repeat them all here
+        for name, port_id in names:
+            encoded = name.encode('utf-8')
+            data += RECORD_HEADER.pack(0, port_id, DIR_PORT_NAME, 0, len(encoded)) + encoded
+        if self.index_enabled:
+            from capture_index import CaptureIndex
+            self.capture_index = CaptureIndex()
+            self.capture_index.ports.update({port_id: name for name, port_id in names})
+            self.capture_index.covered = len(data)
+            self.index_offset_ns = epoch_ns - mono_ns
+        return data
+
+    def written(self, offset, chunks):
+        if self.capture_index is not None:
+            self.capture_index.add_chunks(offset, chunks, self.index_offset_ns)
+
+    def finish_file(self):
+        if self.capture_index is not None:
+            from capture_index import INDEX_EXT
+            try:
+                self.capture_index.save(self.path + INDEX_EXT)
+            except OSError as e:
+                print(f"Could not save the index of {self.path}: {e}")
+            self.capture_index = None
+
+
+def is_capture_file(path):
+    with open(path, 'rb') as f:
+        return f.read(len(CAPTURE_MAGIC)) == CAPTURE_MAGIC
+
+
+def read_header(path):
+    """Return (epoch_ns, mono_ns, ports) where ports maps port id to name."""
+    with open(path, 'rb') as f:
+        magic, version, epoch_ns, mono_ns = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+    if magic != CAPTURE_MAGIC:
+        raise ValueError(f"{path} is not a capture file")
+    ports = {}
+    for _ in iter_capture(path, ports):
+        pass
+    return epoch_ns, mono_ns, ports
+
+
+class CaptureReader:
+    """
+    Memory mapped capture reader. Nothing is loaded up front; frames are
+    yielded as memoryviews into the mapping, so iterating a multi GB capture
+    costs no copies. Copy a frame with bytes(frame) if it must outlive the reader.
+
+        with CaptureReader(path) as reader:
+            reader.seek(ts_ns)                   # first record at or after ts_ns
+            for ts_ns, port, direction, crc_ok, frame in reader:
+                ...
+            for record in reader[t0:t1]:         # records with t0 <= ts < t1
+                ...
+
+    All timestamps are wall clock ns.
+    """
+
+    # One (ts_ns, offset) checkpoint is kept every CHECKPOINT_EVERY records for seek()
+    CHECKPOINT_EVERY = 1024
+
+    def __init__(self, path):
+        self.path = path
+        self.ports = {}
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size < FILE_HEADER.size:
+            self.file.close()
+            raise ValueError(f"{path} is not a capture file")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mm)
+        magic, version, epoch_ns, mono_ns = FILE_HEADER.unpack_from(self.mm, 0)
+        if magic != CAPTURE_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a capture file")
+        if version != CAPTURE_VERSION:
+            self.close()
+            raise ValueError(f"Unsupported capture version {version}")
+        self.epoch_ns = epoch_ns
+        self.mono_ns = mono_ns
+        self.offset_ns = epoch_ns - mono_ns
+        self.size = size
+        self.pos = FILE_HEADER.size
+        self._checkpoint_ts = []
+        self._checkpoint_pos = []
+        self._scanned_to = FILE_HEADER.size
+        self._scanned_count = 0
+
+    def _records(self, pos, end_ns=None):
+        """Yield (record offset, ts_ns, port, direction, flags, frame view) from pos on."""
+        unpack_from = RECORD_HEADER.unpack_from
+        header_size = RECORD_HEADER.size
+        view = self.view
+        offset_ns = self.offset_ns
+        size = self.size
+        while pos + header_size <= size:
+            ts_ns, port, direction, flags, length = unpack_from(view, pos)
+            start = pos + header_size
+            if start + length > size:
+                return  # Truncated last record, e.g. logger killed mid write
+            if direction == DIR_PORT_NAME:
+                self.ports[port] = bytes(view[start:start + length]).decode('utf-8', 'replace')
+            else:
+                ts_ns += offset_ns
+                if end_ns is not None and ts_ns >= end_ns:
+                    return
+                self._note(pos, ts_ns)
+                yield pos, ts_ns, port, direction, flags, view[start:start + length]
+            pos = start + length
+
+    def _note(self, pos, ts_ns):
+        # Extend the sparse seek index while scanning new ground
+        if pos < self._scanned_to:
+            return
+        if self._scanned_count % self.CHECKPOINT_EVERY == 0:
+            self._checkpoint_ts.append(ts_ns)
+            self._checkpoint_pos.append(pos)
+        self._scanned_count += 1
+        self._scanned_to = pos + 1
+
+    def __iter__(self):
+        """Iterate from the current position (start of file unless seek() was called)."""
+        for pos, ts_ns, port, direction, flags, frame in self._records(self.pos):
+            self.pos = pos
+            yield ts_ns, port, direction, bool(flags & FLAG_CRC_OK), frame
+        self.pos = self.size
+
+    def frames(self, start_ns=None, end_ns=None):
+        """Yield records with start_ns <= ts < end_ns. Either bound may be None."""
+        pos = FILE_HEADER.size if start_ns is None else self._find(start_ns)
+        for pos, ts_ns, port, direction, flags, frame in self._records(pos, end_ns):
+            yield ts_ns, port, direction, bool(flags & FLAG_CRC_OK), frame
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step is not None:
+            raise TypeError("CaptureReader only supports time slices, e.g. reader[t0:t1]")
+        return self.frames(key.start, key.stop)
+
+    def read_at(self, pos):
+        """The record at file offset pos as (ts_ns, port, direction, crc_ok, frame), e.g. from a capture index."""
+        ts_ns, port, direction, flags, length = RECORD_HEADER.unpack_from(self.view, pos)
+        start = pos + RECORD_HEADER.size
+        if start + length > self.size:
+            raise ValueError(f"Truncated record at offset {pos}")
+        return ts_ns + self.offset_ns, port, direction, bool(flags & FLAG_CRC_OK), self.view[start:start + length]
+
+    def seek(self, ts_ns):
+        """Position the reader on the first record at or after ts_ns."""
+        self.pos = self._find(ts_ns)
+
+    def _find(self, ts_ns):
+        # Start from the last checkpoint before ts_ns, then scan forward (extending the checkpoints)
+        i = bisect.bisect_right(self._checkpoint_ts, ts_ns) - 1
+        pos = self._checkpoint_pos[i] if i >= 0 else FILE_HEADER.size
+        for pos, record_ts, port, direction, flags, frame in self._records(pos):
+            if record_ts >= ts_ns:
+                return pos
+        return self.size
+
+    def wall_time_ns(self, mono_ns):
+        return mono_ns + self.offset_ns
+
+    def close(self):
+        try:
+            self.view.release()
+            self.mm.close()
+        except BufferError:
+            # Frames handed out are still referenced, the mapping goes when they do
+            pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_capture(path, ports=None):
+    """
+    Yield (ts_ns, port, direction, crc_ok, frame) for every frame record, frames as bytes.
+    ts_ns is wall clock ns. Port name records fill the optional ports dict.
+    """
+    with CaptureReader(path) as reader:
+        for ts_ns, port, direction, crc_ok, frame in reader:
+            yield ts_ns, port, direction, crc_ok, bytes(frame)
+        if ports is not None:
+            ports.update(reader.ports)
+
+
+# --- Text log conversion ---
+
+_HOST_LOG_LINE = re.compile(r'^\[([^\]]+)\] (SENT|RECV): ([0-9A-Fa-f ]+)$')
+
+
+def iter_text_log(path):
+    """
+    Yield (ts_ns, direction, frame) from either text log format:
+        serial_log:  <ms timestamp>\\t0x55\\t0x0E...
+        host_mppt:   [2024-01-01 12:00:00.123456] SENT: 55 0E ...
+    host_mppt RECV lines are raw reads, they are split into frames with the decoder.
+    """
+    decoder = FrameDecoder()
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line[0] == '[':
+                match = _HOST_LOG_LINE.match(line)
+                if not match:
+                    continue
+                try:
+                    ts_ns = int(datetime.fromisoformat(match.group(1)).timestamp() * 1e9)
+                    data = bytes.fromhex(match.group(3))
+                except ValueError:
+                    continue
+                if match.group(2) == 'SENT':
+                    yield ts_ns, DIR_TX, data
+                else:
+                    for frame in decoder.feed(data):
+                        yield ts_ns, DIR_RX, frame
+                continue
+            parts = line.split('\t')
+            if len(parts) < 2 or not parts[0].isdigit():
+                continue
+            try:
+                data = bytes.fromhex(''.join(b[2:] for b in parts[1:]))
+            except ValueError:
+                continue
+            yield int(parts[0]) * 1_000_000, DIR_RX, data
+
+
+def convert_text_log(txt_path, out_path=None, port_name=None):
+    """Convert a text log to a capture file. Returns the output path and the number of frames."""
+    if out_path is None:
+        out_path = os.path.splitext(txt_path)[0] + CAPTURE_EXT
+    count = 0
+    # Text logs carry wall clock times, so store them as-is with a zero offset
+    with CaptureWriter(out_path, epoch_ns=0, mono_ns=0) as writer:
+        port = writer.port_id(port_name or os.path.basename(txt_path))
+        for ts_ns, direction, frame in iter_text_log(txt_path):
+            writer.write(frame, port, direction, check_frame(frame), ts_ns)
+            count += 1
+    return out_path, count
+
+
+def dump(path):
+    """
+    Print a capture for reading, one frame per line: ms timestamp, port name, TX/RX
+    (then CRC! on a bad CRC) and the hex bytes. Not a text log format, iter_text_log() can't read it back.
+    """
+    with CaptureReader(path) as reader:
+        for ts_ns, port, direction, crc_ok, frame in reader:
+            flags = ('TX' if direction == DIR_TX else 'RX') + ('' if crc_ok else ' CRC!')
+            print(f"{ts_ns // 1_000_000}\t{reader.ports.get(port, port)}\t{flags}\t{frame.hex(' ').upper()}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == 'convert':
+        out, n = convert_text_log(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+        print(f"Wrote {n} frames to {out}")
+    elif len(sys.argv) == 3 and sys.argv[1] == 'dump':
+        dump(sys.argv[2])
+    else:
+        print("Usage: python capture.py convert xxx.txt [out.sdccap] | dump xxx.sdccap")
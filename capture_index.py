@@ -0,0 +1,302 @@
+"""
+Sidecar index for capture files, so a query only touches the records it returns.
+
+For capture.sdccap the index is capture.sdccap.idx and holds:
+    - the file offsets of the frames of each (Class_B, talker, listener)
+    - the sequence number of each of those frames
+    - a sparse time index, one (timestamp, offset) pair every TIME_EVERY records
+    - the port names
+
+CaptureLogWriter(..., index=True) builds it while logging and writes it when
+the file is rotated or closed. For other captures it is built on first use,
+and extended from where it stopped if the capture has grown since.
+
+    index = CaptureIndex.for_capture(path)
+    index.keys()                                      # [(class_b, talker, listener), ...]
+    for ts_ns, port, direction, crc_ok, frame in query(path, class_b=0x2D, talker=0xEC, start_ns=t0, end_ns=t1):
+        ...
+
+Usage:
+    python capture_index.py build capture.sdccap [...]
+    python capture_index.py keys capture.sdccap
+    python capture_index.py query capture.sdccap [--class-b 0x2D] [--talker 0xEC] [--listener 0xAB]
+                                                 [--start 2024-06-01T12:00] [--end ...] [--sequence N] [--count]
+"""
+
+import argparse
+import bisect
+import heapq
+import os
+import struct
+import sys
+from array import array
+from datetime import datetime
+
+from capture import DIR_PORT_NAME, DIR_TX, FILE_HEADER, RECORD_HEADER, CaptureReader
+
+INDEX_MAGIC = b'SDCIDX'
+INDEX_VERSION = 1
+INDEX_EXT = '.idx'
+# magic, version, capture bytes covered, frame records, groups, time entries, ports
+INDEX_HEADER = struct.Struct('<6sHQQIII')
+# class_b, talker, listener, count; followed by count offsets (Q) and count sequence numbers (H)
+GROUP_HEADER = struct.Struct('<BBBI')
+# port id, name length; followed by the utf-8 name
+PORT_HEADER = struct.Struct('<HH')
+TIME_EVERY = 1024
+
+
+class IndexGroup:
+    """Offsets and sequence numbers of the frames with one (Class_B, talker, listener)."""
+    __slots__ = ('offsets', 'sequences', '_by_sequence', '_by_sequence_len')
+
+    def __init__(self):
+        self.offsets = array('Q')
+        self.sequences = array('H')
+        self._by_sequence = None
+        self._by_sequence_len = 0
+
+    def by_sequence(self, sequence):
+        """Offsets of the frames with this sequence number (the sequence map is built on first use)."""
+        if self._by_sequence is None or self._by_sequence_len != len(self.sequences):
+            by_sequence = {}
+            for offset, seq in zip(self.offsets, self.sequences):
+                by_sequence.setdefault(seq, array('Q')).append(offset)
+            self._by_sequence = by_sequence
+            self._by_sequence_len = len(self.sequences)
+        return self._by_sequence.get(sequence, array('Q'))
+
+
+class CaptureIndex:
+    def __init__(self):
+        self.covered = FILE_HEADER.size
+        self.records = 0
+        self.groups = {}
+        self.ports = {}
+        self.time_ns = array('q')
+        self.time_offsets = array('Q')
+
+    # --- Building ---
+
+    def add(self, offset, ts_ns, frame):
+        """Index one frame record at file offset; ts_ns is wall clock ns."""
+        if self.records % TIME_EVERY == 0:
+            self.time_ns.append(ts_ns)
+            self.time_offsets.append(offset)
+        self.records += 1
+        if len(frame) < 8:
+            return  # No header to index by, still found by a full scan
+        key = (frame[3], frame[4], frame[5])
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = IndexGroup()
+        group.offsets.append(offset)
+        group.sequences.append(frame[6] | (frame[7] << 8))
+
+    def add_chunks(self, offset, chunks, offset_ns):
+        """Index encoded records as written by CaptureLogWriter, starting at file offset."""
+        unpack_from = RECORD_HEADER.unpack_from
+        header_size = RECORD_HEADER.size
+        for chunk in chunks:
+            ts_ns, port, direction, flags, length = unpack_from(chunk)
+            if direction == DIR_PORT_NAME:
+                self.ports[port] = chunk[header_size:].decode('utf-8', 'replace')
+            else:
+                self.add(offset, ts_ns + offset_ns, chunk[header_size:])
+            offset += len(chunk)
+        self.covered = offset
+
+    def update(self, capture_path):
+        """Index the records added to the capture since the last update. Returns how many were added."""
+        before = self.records
+        with CaptureReader(capture_path) as reader:
+            end = self.covered
+            for offset, ts_ns, port, direction, flags, frame in reader._records(self.covered):
+                self.add(offset, ts_ns, frame)
+                end = offset + RECORD_HEADER.size + len(frame)
+            self.ports.update(reader.ports)
+            # Port name records after the last frame are read again next time, which is harmless
+            self.covered = end
+        return self.records - before
+
+    # --- Storage ---
+
+    def save(self, path):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, self.covered, self.records,
+                                      len(self.groups), len(self.time_ns), len(self.ports)))
+            for (class_b, talker, listener), group in sorted(self.groups.items()):
+                f.write(GROUP_HEADER.pack(class_b, talker, listener, len(group.offsets)))
+                group.offsets.tofile(f)
+                group.sequences.tofile(f)
+            self.time_ns.tofile(f)
+            self.time_offsets.tofile(f)
+            for port, name in sorted(self.ports.items()):
+                encoded = name.encode('utf-8')
+                f.write(PORT_HEADER.pack(port, len(encoded)) + encoded)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with open(path, 'rb') as f:
+            header = f.read(INDEX_HEADER.size)
+            if len(header) < INDEX_HEADER.size:
+                raise ValueError(f"{path} is not a capture index")
+            magic, version, covered, records, groups, times, ports = INDEX_HEADER.unpack(header)
+            if magic != INDEX_MAGIC or version != INDEX_VERSION:
+                raise ValueError(f"{path} is not a capture index of version {INDEX_VERSION}")
+            index.covered = covered
+            index.records = records
+            for _ in range(groups):
+                class_b, talker, listener, count = GROUP_HEADER.unpack(f.read(GROUP_HEADER.size))
+                group = index.groups[(class_b, talker, listener)] = IndexGroup()
+                group.offsets.fromfile(f, count)
+                group.sequences.fromfile(f, count)
+            index.time_ns.fromfile(f, times)
+            index.time_offsets.fromfile(f, times)
+            for _ in range(ports):
+                port, length = PORT_HEADER.unpack(f.read(PORT_HEADER.size))
+                index.ports[port] = f.read(length).decode('utf-8', 'replace')
+        return index
+
+    @classmethod
+    def for_capture(cls, capture_path, save=True):
+        """The index of a capture: loaded from its sidecar, brought up to date, or built from scratch."""
+        path = capture_path + INDEX_EXT
+        index = None
+        if os.path.exists(path):
+            try:
+                index = cls.load(path)
+            except (OSError, ValueError, EOFError, struct.error) as e:
+                print(f"Rebuilding {path}: {e}")
+            if index is not None and index.covered > os.path.getsize(capture_path):
+                index = None  # Capture was replaced by a shorter file
+        if index is None:
+            index = cls()
+        stale = index.covered < os.path.getsize(capture_path)
+        if stale and index.update(capture_path) and save:
+            try:
+                index.save(path)
+            except OSError as e:
+                # e.g. a read-only archive directory; the index still works from memory
+                print(f"Could not save {path}, using the index in memory: {e}")
+        return index
+
+    # --- Queries ---
+
+    def keys(self):
+        return sorted(self.groups)
+
+    def counts(self):
+        """{(class_b, talker, listener): frame count}"""
+        return {key: len(group.offsets) for key, group in sorted(self.groups.items())}
+
+    def offset_range(self, start_ns=None, end_ns=None):
+        """File offsets [low, high) that hold every record with start_ns <= ts < end_ns (and a few more)."""
+        low, high = 0, self.covered
+        if start_ns is not None:
+            i = bisect.bisect_left(self.time_ns, start_ns) - 1
+            if i >= 0:
+                low = self.time_offsets[i]
+        if end_ns is not None:
+            i = bisect.bisect_left(self.time_ns, end_ns)
+            if i < len(self.time_offsets):
+                high = self.time_offsets[i]
+        return low, high
+
+    def offsets(self, class_b=None, talker=None, listener=None, start_ns=None, end_ns=None, sequence=None):
+        """
+        Sorted offsets of the frames matching every given field. class_b, talker
+        and listener may be a single value or a collection of values. The time bounds
+        are only applied to whole TIME_EVERY blocks here, query() checks them exactly.
+        """
+        low, high = self.offset_range(start_ns, end_ns)
+        class_b, talker, listener = _as_set(class_b), _as_set(talker), _as_set(listener)
+        selected = []
+        for (c, t, l), group in self.groups.items():
+            if (class_b is not None and c not in class_b) or (talker is not None and t not in talker) \
+                    or (listener is not None and l not in listener):
+                continue
+            offsets = group.offsets if sequence is None else group.by_sequence(sequence)
+            i = bisect.bisect_left(offsets, low)
+            j = bisect.bisect_left(offsets, high)
+            if i < j:
+                selected.append(offsets[i:j])
+        if len(selected) == 1:
+            return list(selected[0])
+        return list(heapq.merge(*selected))
+
+
+def _as_set(value):
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return {value}
+    return set(value)
+
+
+def query(capture_path, class_b=None, talker=None, listener=None, start_ns=None, end_ns=None, sequence=None,
+          index=None):
+    """
+    Yield (ts_ns, port, direction, crc_ok, frame) of the matching frames in file order,
+    reading only those records. Frames are memoryviews into the capture, copy them to keep them.
+    """
+    if index is None:
+        index = CaptureIndex.for_capture(capture_path)
+    offsets = index.offsets(class_b, talker, listener, start_ns, end_ns, sequence)
+    with CaptureReader(capture_path) as reader:
+        reader.ports.update(index.ports)
+        read_at = reader.read_at
+        for offset in offsets:
+            record = read_at(offset)
+            ts_ns = record[0]
+            if start_ns is not None and ts_ns < start_ns:
+                continue
+            if end_ns is not None and ts_ns >= end_ns:
+                continue
+            yield record
+
+
+def parse_time(text):
+    """Wall clock ns from an ISO date/time (local time) or seconds since the epoch."""
+    try:
+        return int(float(text) * 1e9)
+    except ValueError:
+        return int(datetime.fromisoformat(text).timestamp() * 1e9)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query capture file indexes")
+    parser.add_argument('command', choices=('build', 'keys', 'query'))
+    parser.add_argument('captures', nargs='+')
+    parser.add_argument('--class-b', type=lambda v: int(v, 0))
+    parser.add_argument('--talker', type=lambda v: int(v, 0))
+    parser.add_argument('--listener', type=lambda v: int(v, 0))
+    parser.add_argument('--sequence', type=lambda v: int(v, 0))
+    parser.add_argument('--start', type=parse_time, help="ISO time or epoch seconds")
+    parser.add_argument('--end', type=parse_time, help="ISO time or epoch seconds")
+    parser.add_argument('--count', action='store_true', help="only print how many frames match")
+    args = parser.parse_args()
+
+    for path in args.captures:
+        index = CaptureIndex.for_capture(path)
+        if args.command == 'build':
+            print(f"{path}{INDEX_EXT}: {index.records} frames, {len(index.groups)} keys")
+        elif args.command == 'keys':
+            print(path)
+            for (class_b, talker, listener), count in index.counts().items():
+                print(f"  class_b 0x{class_b:02X}  talker 0x{talker:02X}  listener 0x{listener:02X}  {count} frames")
+        else:
+            records = query(path, args.class_b, args.talker, args.listener, args.start, args.end, args.sequence, index)
+            if args.count:
+                print(f"{path}: {sum(1 for _ in records)} frames")
+                continue
+            for ts_ns, port, direction, crc_ok, frame in records:
+                flags = ('TX' if direction == DIR_TX else 'RX') + ('' if crc_ok else ' CRC!')
+                print(f"{ts_ns // 1_000_000}\t{index.ports.get(port, port)}\t{flags}\t{frame.hex(' ').upper()}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
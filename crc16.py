@@ -0,0 +1,110 @@
+"""
+CRC16 used on the SDC serial link.
+
+Settings: Poly=0x1021, Init=0x496C, RefIn=True, RefOut=True, XorOut=0x0000
+The CRC covers the whole frame (start byte included) and is appended little endian.
+
+Because input and output are both reflected, the register is kept reflected
+and a 256 entry table of the reflected polynomial (0x8408) is used, so each
+byte costs one table lookup instead of eight shift steps.
+"""
+
+CRC16_POLY = 0x1021
+CRC16_INIT = 0x496C
+
+
+def _reflect(value, width):
+    result = 0
+    for _ in range(width):
+        result = (result << 1) | (value & 1)
+        value >>= 1
+    return result
+
+
+def _build_table():
+    poly = _reflect(CRC16_POLY, 16)
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ poly
+            else:
+                crc >>= 1
+        table.append(crc)
+    return tuple(table)
+
+
+CRC16_TABLE = _build_table()
+# Register start value in reflected form. Pass this to crc16_update() to start a new CRC.
+CRC16_START = _reflect(CRC16_INIT, 16)
+
+
+def crc16_update(crc, data):
+    """Feed more bytes into a running CRC and return the new value."""
+    table = CRC16_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def crc16(data) -> int:
+    """Return the CRC16 of data."""
+    return crc16_update(CRC16_START, data)
+
+
+class Crc16:
+    """Streaming CRC16 for data that arrives in pieces."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, data=b""):
+        self.value = crc16_update(CRC16_START, data)
+
+    def update(self, data):
+        self.value = crc16_update(self.value, data)
+        return self
+
+    def digest(self) -> bytes:
+        """CRC bytes as they appear on the wire (little endian)."""
+        return self.value.to_bytes(2, byteorder='little')
+
+    def reset(self):
+        self.value = CRC16_START
+
+
+def add_crc16_checksum(data: bytes) -> bytes:
+    """
+    Calculates a CRC16 checksum and appends it to the data.
+    The length byte (second byte) should already count the 2 CRC bytes.
+    """
+    if len(data) < 2:
+        raise ValueError("Input bytes must be at least 2 bytes long.")
+    return bytes(data) + crc16(data).to_bytes(2, byteorder='little')
+
+
+def check_frame(frame) -> bool:
+    """
+    Check the CRC of a complete frame (CRC bytes included).
+    Running the CRC over data plus its own little endian CRC leaves 0 in the register.
+    """
+    if len(frame) < 4:
+        return False
+    return crc16_update(CRC16_START, frame) == 0
+
+
+def verify(frames):
+    """Check many frames at once. Returns a list of bools in the same order."""
+    table = CRC16_TABLE
+    start = CRC16_START
+    results = []
+    append = results.append
+    for frame in frames:
+        if len(frame) < 4:
+            append(False)
+            continue
+        crc = start
+        for byte in frame:
+            crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+        append(crc == 0)
+    return results
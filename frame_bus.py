@@ -0,0 +1,273 @@
+"""
+In-process frame bus: one reader per port, any number of consumers.
+
+The bus opens each port once on the asyncio loop and publishes every frame
+the FrameDecoder splits off (and every frame sent through bus.write()) to
+its subscribers:
+
+    bus = FrameBus()
+    bus.tap(writer_callback)                        # called inline, must not block
+    gui = bus.subscribe(maxsize=2000, class_bs=(0x9C, 0x38))
+    await bus.run(['/dev/ttyACM0'], stop)
+
+    for ts_ns, port, direction, frame in gui.drain():   # any thread, e.g. a Tk after() callback
+        ...
+    batch = await sub.get()                         # on the loop
+
+Taps are for consumers that already never block (the log writers only queue,
+metrics only count). Every other consumer gets a Subscription, a bounded
+queue that drops its oldest frames when full, so a slow GUI or socket client
+loses frames itself but never holds up the serial reads or anyone else.
+
+Local clients can follow the traffic over TCP or a Unix socket, one line
+per frame in the capture.py dump format:
+
+    await serve_clients(bus, port=9110)                # or path='/tmp/sdc.sock'
+    $ nc 127.0.0.1 9110
+    1717243200123	/dev/ttyACM0	RX	55 26 04 9C ...
+
+With writable=True a client may also send "<port>\\t<hex bytes>" lines
+(or just the hex when the bus has one port) to write frames to a port.
+"""
+
+import asyncio
+import time
+from collections import deque, namedtuple
+
+import serial
+
+from aio_serial import BAUDRATE, AsyncSerialPort, wait_closed
+from capture import DIR_RX, DIR_TX
+
+DEFAULT_QUEUE = 4096
+DEFAULT_CLIENT_PORT = 9110
+
+BusFrame = namedtuple('BusFrame', 'ts_ns port direction frame')
+
+
+class Subscription:
+    """Bounded drop-oldest queue of BusFrames for one consumer."""
+
+    def __init__(self, bus, maxsize=DEFAULT_QUEUE, ports=None, class_bs=None, directions=None, name=''):
+        self.bus = bus
+        self.name = name
+        self.ports = None if ports is None else frozenset(ports)
+        self.class_bs = None if class_bs is None else frozenset(class_bs)
+        self.directions = None if directions is None else frozenset(directions)
+        self.items = deque(maxlen=maxsize)
+        self.delivered = 0
+        self.dropped = 0
+        self._event = None
+
+    def _wants(self, port, direction, frame):
+        if self.ports is not None and port not in self.ports:
+            return False
+        if self.directions is not None and direction not in self.directions:
+            return False
+        if self.class_bs is not None and (len(frame) < 4 or frame[3] not in self.class_bs):
+            return False
+        return True
+
+    def _put(self, item):
+        items = self.items
+        if len(items) == items.maxlen:
+            # deque(maxlen) pushes the oldest frame out
+            self.dropped += 1
+        items.append(item)
+        self.delivered += 1
+        if self._event is not None:
+            self._event.set()
+
+    def drain(self, max_items=None):
+        """Take the queued frames, oldest first. Safe from any thread."""
+        items = self.items
+        out = []
+        while items and (max_items is None or len(out) < max_items):
+            try:
+                out.append(items.popleft())
+            except IndexError:
+                break
+        return out
+
+    async def get(self, max_items=None):
+        """Wait for frames on the bus's loop and take them."""
+        if self._event is None:
+            self._event = asyncio.Event()
+        while not self.items:
+            self._event.clear()
+            await self._event.wait()
+        return self.drain(max_items)
+
+    def backlog(self):
+        return len(self.items)
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class FrameBus:
+    def __init__(self, maxsize=DEFAULT_QUEUE):
+        self.maxsize = maxsize
+        self.subscriptions = []
+        self.taps = []
+        self.ports = {}
+        self.published = 0
+        # Frames carry time.monotonic_ns() like the capture writers; this turns them into wall clock ns
+        self.offset_ns = time.time_ns() - time.monotonic_ns()
+
+    # --- Consumers ---
+
+    def tap(self, callback):
+        """callback(port, frames, ts_ns, direction) for every batch, on the loop thread."""
+        self.taps.append(callback)
+        return callback
+
+    def untap(self, callback):
+        if callback in self.taps:
+            self.taps.remove(callback)
+
+    def subscribe(self, maxsize=None, ports=None, class_bs=None, directions=None, name=''):
+        subscription = Subscription(self, maxsize or self.maxsize, ports, class_bs, directions, name)
+        # Replaced, not appended to, so publish() can iterate without a lock
+        self.subscriptions = self.subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscriptions = [s for s in self.subscriptions if s is not subscription]
+
+    def stats(self):
+        return {
+            'published': self.published,
+            'subscriptions': [{'name': s.name, 'backlog': s.backlog(), 'delivered': s.delivered,
+                               'dropped': s.dropped} for s in self.subscriptions],
+        }
+
+    # --- Producers ---
+
+    def publish(self, port, frames, ts_ns, direction=DIR_RX):
+        """Hand a batch of frames to every tap and subscription. Called on the loop thread."""
+        self.published += len(frames)
+        for callback in self.taps:
+            try:
+                callback(port, frames, ts_ns, direction)
+            except Exception as e:
+                print(f"Frame bus tap {callback!r} failed: {e}")
+        subscriptions = self.subscriptions
+        if not subscriptions:
+            return
+        for frame in frames:
+            item = BusFrame(ts_ns, port, direction, frame)
+            for subscription in subscriptions:
+                if subscription._wants(port, direction, frame):
+                    subscription._put(item)
+
+    def open(self, paths, baudrate=BAUDRATE, decoders=None):
+        """Open the ports on the running loop, once each. Ports that fail to open are reported and skipped."""
+        opened = []
+        for path in paths:
+            if path in self.ports:
+                opened.append(self.ports[path])
+                continue
+            decoder = decoders.get(path) if decoders else None
+            try:
+                port = AsyncSerialPort(path, baudrate, self._on_frames, decoder).open()
+            except (serial.SerialException, OSError) as e:
+                print(f"Failed to open serial port {path}: {e}")
+                continue
+            self.ports[path] = port
+            opened.append(port)
+        return opened
+
+    def _on_frames(self, port, frames, ts_ns):
+        self.publish(port.path, frames, ts_ns, DIR_RX)
+
+    def port(self, path):
+        """The AsyncSerialPort the bus opened for path."""
+        return self.ports[path]
+
+    def write(self, path, frame, ts_ns=None):
+        """Send a frame on a bus port and publish it as DIR_TX."""
+        self.ports[path].write(frame)
+        if ts_ns is None:
+            ts_ns = time.monotonic_ns()
+        self.publish(path, (frame,), ts_ns, DIR_TX)
+
+    async def run(self, paths, stop=None, baudrate=BAUDRATE, decoders=None):
+        """
+        Read the ports until stop is set or every port has closed, like aio_serial.run_ports.
+        Only the ports this call opened are closed; those already on the bus (e.g. a session's) stay open.
+        """
+        new = [path for path in paths if path not in self.ports]
+        ports = self.open(paths, baudrate, decoders)
+        try:
+            await wait_closed(ports, stop)
+        finally:
+            for path in new:
+                port = self.ports.pop(path, None)
+                if port is not None:
+                    port.close()
+        return ports
+
+    def close(self):
+        for port in self.ports.values():
+            port.close()
+
+
+def format_frame(item, offset_ns=0):
+    """One line in the capture.py dump format; offset_ns turns the monotonic timestamp into wall clock."""
+    ts_ns, port, direction, frame = item
+    return f"{(ts_ns + offset_ns) // 1_000_000}\t{port}\t{'TX' if direction == DIR_TX else 'RX'}\t{frame.hex(' ').upper()}\n"
+
+
+async def _client(bus, reader, writer, maxsize, writable):
+    subscription = bus.subscribe(maxsize, name=f"client {writer.get_extra_info('peername') or 'unix'}")
+    tasks = [asyncio.ensure_future(_send_frames(subscription, writer, bus.offset_ns))]
+    if writable:
+        tasks.append(asyncio.ensure_future(_receive_frames(bus, reader)))
+    else:
+        tasks.append(asyncio.ensure_future(reader.read()))  # Only to notice the client leaving
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        subscription.close()
+        writer.close()
+
+
+async def _send_frames(subscription, writer, offset_ns):
+    reported = 0
+    while True:
+        items = await subscription.get()
+        lines = []
+        if subscription.dropped != reported:
+            lines.append(f"# dropped {subscription.dropped - reported}\n")
+            reported = subscription.dropped
+        lines.extend(format_frame(item, offset_ns) for item in items)
+        writer.write(''.join(lines).encode('utf-8'))
+        # Waiting here only backs up this client's own queue
+        await writer.drain()
+
+
+async def _receive_frames(bus, reader):
+    async for line in reader:
+        text = line.decode('utf-8', 'replace').strip()
+        if not text or text.startswith('#'):
+            continue
+        path, _, data = text.rpartition('\t')
+        if not path and len(bus.ports) == 1:
+            path = next(iter(bus.ports))
+        try:
+            bus.write(path, bytes.fromhex(data))
+        except (KeyError, ValueError) as e:
+            print(f"Frame bus client sent an unusable line {text!r}: {e}")
+
+
+async def serve_clients(bus, port=DEFAULT_CLIENT_PORT, host='127.0.0.1', path=None, maxsize=None, writable=False):
+    """Accept clients on host:port, or on the Unix socket path. Returns the asyncio server."""
+    async def handle(reader, writer):
+        await _client(bus, reader, writer, maxsize, writable)
+
+    if path is not None:
+        return await asyncio.start_unix_server(handle, path)
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,94 @@
+"""
+Push style frame decoder for the SDC serial stream.
+
+Feed it whatever the port returned (any chunk size) and it returns the
+complete frames found so far. A frame is only accepted when its CRC matches,
+so a corrupt length byte or noise on the line costs a few dropped bytes and
+the decoder picks up again at the next 0x55.
+"""
+
+from crc16 import CRC16_START, CRC16_TABLE
+
+START_BYTE = 0x55
+# 10 bytes header + 2 bytes CRC. Shortest frame seen on the wire is 0x0E.
+MIN_FRAME_LEN = 12
+# Every length byte is accepted by default: the longest frame on the wire is not known (most of
+# 0x2D is undecoded), and a corrupt length only holds back the frames behind it until that many
+# bytes have arrived or the CRC fails. A tool that knows its traffic may pass a lower max_length.
+MAX_FRAME_LEN = 255
+
+
+class FrameDecoder:
+    """Reassemble frames from a byte stream, resyncing on bad length or CRC."""
+
+    def __init__(self, min_length=MIN_FRAME_LEN, max_length=MAX_FRAME_LEN):
+        self.min_length = min_length
+        self.max_length = max_length
+        self.buffer = bytearray()
+        self.frames = 0          # good frames returned
+        self.bytes_in = 0        # bytes fed in
+        self.dropped_bytes = 0   # bytes thrown away while hunting for a frame
+        self.crc_errors = 0      # candidate frames rejected by CRC
+        self.length_errors = 0   # candidate frames rejected by an impossible length byte
+
+    def feed(self, data):
+        """Add received bytes. Returns a list of complete frames (bytes), maybe empty."""
+        buf = self.buffer
+        if data:
+            buf += data
+            self.bytes_in += len(data)
+        frames = []
+        table = CRC16_TABLE
+        min_length = self.min_length
+        max_length = self.max_length
+        size = len(buf)
+        pos = 0
+        while True:
+            start = buf.find(START_BYTE, pos)
+            if start < 0:
+                self.dropped_bytes += size - pos
+                pos = size
+                break
+            self.dropped_bytes += start - pos
+            pos = start
+            if size - start < 2:
+                break
+            length = buf[start + 1]
+            if length < min_length or length > max_length:
+                self.length_errors += 1
+                self.dropped_bytes += 1
+                pos = start + 1
+                continue
+            end = start + length
+            if end > size:
+                # Wait for the rest of the frame
+                break
+            crc = CRC16_START
+            for byte in memoryview(buf)[start:end]:
+                crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+            if crc != 0:
+                self.crc_errors += 1
+                self.dropped_bytes += 1
+                pos = start + 1
+                continue
+            frames.append(bytes(buf[start:end]))
+            pos = end
+        if pos:
+            del buf[:pos]
+        self.frames += len(frames)
+        return frames
+
+    def reset(self):
+        """Throw away any partial frame, e.g. after reopening the port."""
+        self.dropped_bytes += len(self.buffer)
+        self.buffer.clear()
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "bytes_in": self.bytes_in,
+            "dropped_bytes": self.dropped_bytes,
+            "crc_errors": self.crc_errors,
+            "length_errors": self.length_errors,
+            "buffered": len(self.buffer),
+        }
@@ -0,0 +1,130 @@
+"""
+Preallocated frame encoders for the frames the tools send.
+
+Each FrameEncoder owns one buffer holding a whole frame, CRC included.
+Sending another frame of the same type only patches the sequence number,
+any fields that changed and the CRC in place, and returns a memoryview of
+the buffer that can go straight to write():
+
+    encoder = frame_38(listener=0xEB)
+    encoder.set(voltage=52.2, current=7.65)     # scaled through frame_schema, only when they change
+    port.write(encoder.encode(sequence))         # no new buffers per frame
+
+The view is overwritten by the next encode(); copy it with bytes(view) to
+keep it, e.g. for a log or a queue. Bytes 0-5 rarely change, so the CRC
+register after them is kept and each encode() only runs the CRC over the
+rest of the frame.
+"""
+
+import struct
+
+from crc16 import CRC16_START, crc16_update
+from frame_schema import LAYOUTS, TYPES
+from sdc_frames import (BATTPAK_ID, CRC_LEN, DIR_FROM_POWER_UNIT, DIR_TO_POWER_UNIT, FRAME_66, HEADER_LEN, MPPT_ID,
+                        POWER_UNIT_ID, build_frame, build_frame_38, set_sequence)
+
+# Bytes 0-5: start, length, Class_A, Class_B, talker, listener
+PREFIX_LEN = 6
+SEQUENCE = struct.Struct('<H')
+CRC = struct.Struct('<H')
+
+FRAME_9C_LEN = 38
+FRAME_20_LEN = 23
+# Length of 0xFC is not known for certain; byte 17 (LCD flags) must fit
+FRAME_FC_LEN = 22
+
+
+class FrameEncoder:
+    """One frame type's buffer, patched in place by set() and encode()."""
+
+    __slots__ = ('buffer', 'view', 'length', '_body', '_crc_at', '_prefix_crc', '_fields', '_values')
+
+    def __init__(self, template):
+        """template: a frame without its CRC, as built by sdc_frames."""
+        length = len(template) + CRC_LEN
+        if length != template[1]:
+            raise ValueError(f"Length byte {template[1]} does not match the {length} byte frame")
+        self.buffer = bytearray(template) + bytearray(CRC_LEN)
+        self.view = memoryview(self.buffer)
+        self.length = length
+        self._crc_at = length - CRC_LEN
+        self._body = self.view[PREFIX_LEN:self._crc_at]
+        self._fields = {}
+        self._values = {}
+        layout = LAYOUTS.get(template[3])
+        if layout is not None:
+            for field in layout.fields[4:]:  # The header fields are set by set_listener() and encode()
+                code = TYPES[field.type]
+                packer = struct.Struct(f'<{field.count}{code}')
+                if field.offset + packer.size <= self._crc_at:
+                    self._fields[field.name] = (packer, field.offset, field.scale, field.count)
+        self._update_prefix()
+
+    def _update_prefix(self):
+        self._prefix_crc = crc16_update(CRC16_START, self.view[:PREFIX_LEN])
+
+    def set_listener(self, listener):
+        if self.buffer[5] != listener:
+            self.buffer[5] = listener
+            self._update_prefix()
+
+    def set(self, **values):
+        """Patch frame_schema fields, in their scaled units (V, A, ...). Unchanged values cost a dict lookup."""
+        for name, value in values.items():
+            if self._values.get(name) == value:
+                continue
+            packer, offset, scale, count = self._fields[name]
+            if count == 1:
+                packer.pack_into(self.buffer, offset, round(value / scale))
+            else:
+                packer.pack_into(self.buffer, offset, *(round(v / scale) for v in value))
+            self._values[name] = value
+
+    def set_bytes(self, offset, data):
+        """Copy raw bytes into the frame at offset, e.g. a payload to echo."""
+        self.buffer[offset:offset + len(data)] = data
+        self._values.clear()
+
+    def encode(self, sequence):
+        """Patch the sequence number and CRC; returns a view of the whole frame."""
+        buffer = self.buffer
+        SEQUENCE.pack_into(buffer, 6, sequence & 0xFFFF)
+        CRC.pack_into(buffer, self._crc_at, crc16_update(self._prefix_crc, self._body))
+        return self.view
+
+
+def frame_66(listener=MPPT_ID):
+    """0x66 request from the power unit, answered by 0x9C."""
+    return FrameEncoder(set_sequence(FRAME_66, 0, listener))
+
+
+def frame_38(listener=MPPT_ID, voltage=0.0, current=0.0):
+    """0x38 setpoints from the power unit, answered by 0x20. set(voltage=..., current=...)"""
+    return FrameEncoder(build_frame_38(listener, 0, voltage, current))
+
+
+def frame_20(listener=POWER_UNIT_ID, talker=MPPT_ID):
+    """0x20 echo of a 0x38 from the MPPT. set_bytes(10, request[10:-2]) or set(voltage=..., current=...)"""
+    payload = build_frame_38(listener, 0, 0.0, 0.0)[HEADER_LEN:]
+    return FrameEncoder(build_frame(0x20, talker, listener, 0, DIR_TO_POWER_UNIT, payload))
+
+
+def frame_9c(listener=POWER_UNIT_ID, talker=MPPT_ID):
+    """0x9C telemetry from the MPPT, set(output_voltage=..., ...) with the frame_schema field names."""
+    payload = bytes(FRAME_9C_LEN - HEADER_LEN - CRC_LEN)
+    return FrameEncoder(build_frame(0x9C, talker, listener, 0, DIR_TO_POWER_UNIT, payload))
+
+
+def frame_fc(listener=BATTPAK_ID, length=FRAME_FC_LEN):
+    """0xFC from the power unit to the battery pack, set(lcd_flags=...)"""
+    payload = bytes(length - HEADER_LEN - CRC_LEN)
+    return FrameEncoder(build_frame(0xFC, POWER_UNIT_ID, listener, 0, DIR_FROM_POWER_UNIT, payload))
+
+
+ENCODERS = {
+    0x66: frame_66,
+    0x38: frame_38,
+    0x20: frame_20,
+    0x9C: frame_9c,
+    0xFC: frame_fc,
+}
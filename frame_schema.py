@@ -0,0 +1,158 @@
+"""
+Field layouts of the known Class_B frames, in one place.
+
+Each entry is (name, byte offset, type, scale, unit[, count]). Offsets are
+from the 0x55 start byte, as in the README. To add a newly decoded field,
+add one line to its Class_B list below.
+
+The layouts are compiled once into struct.Struct unpackers, so decoding a
+frame is a single unpack_from() call into a slotted record:
+
+    record = decode(frame)
+    if record is not None and record.class_b == 0x9C:
+        print(record.output_voltage, record.temperature)
+"""
+
+import struct
+from collections import namedtuple
+
+Field = namedtuple('Field', 'name offset type scale unit count', defaults=(1, '', 1))
+
+# type name -> struct code (all little endian)
+TYPES = {
+    'u8': 'B',
+    'i8': 'b',
+    'u16': 'H',
+    'i16': 'h',
+    'u32': 'I',
+    'i32': 'i',
+}
+
+# Decoded for every frame, from the common header
+HEADER_FIELDS = [
+    Field('talker', 4, 'u8'),
+    Field('listener', 5, 'u8'),
+    Field('sequence', 6, 'u16'),
+    Field('direction', 8, 'u8'),
+]
+
+SCHEMAS = {
+    0x20: [
+        Field('voltage', 12, 'u16', 0.01, 'V'),
+        Field('current', 14, 'u16', 0.01, 'A'),
+    ],
+    0x2D: [
+        Field('pack_voltage', 77, 'u16', 0.001, 'V'),
+        Field('pack_current', 85, 'i16', 0.001, 'A'),
+        Field('cell_voltages', 97, 'u16', 0.01, 'V', 16),
+    ],
+    0x38: [
+        Field('voltage', 12, 'u16', 0.01, 'V'),
+        Field('current', 14, 'u16', 0.01, 'A'),
+    ],
+    0x9C: [
+        Field('output_voltage', 16, 'u16', 0.01, 'V'),
+        Field('output_current', 18, 'u16', 0.01, 'A'),
+        Field('input_voltage', 20, 'u16', 0.01, 'V'),
+        Field('input_current', 22, 'u16', 0.01, 'A'),
+        Field('input_count', 24, 'u8'),
+        Field('charging', 25, 'u8'),
+        Field('input_power', 26, 'u16', 1, 'W'),
+        Field('temperature', 28, 'u16', 0.1, 'C'),
+        Field('input_voltage_1', 30, 'u16', 0.01, 'V'),
+        Field('input_voltage_2', 32, 'u16', 0.01, 'V'),
+        Field('input_voltage_3', 34, 'u16', 0.01, 'V'),
+    ],
+    0xFC: [
+        Field('lcd_flags', 17, 'u8'),
+    ],
+}
+
+
+class FrameRecord:
+    """Base class of the decoded records. Subclasses get one slot per field."""
+
+    __slots__ = ('class_b',)
+    layout = None
+
+    def __repr__(self):
+        values = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({values})"
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in ('class_b',) + self.__slots__}
+
+
+class Layout:
+    """A compiled Class_B layout."""
+
+    def __init__(self, class_b, fields):
+        self.class_b = class_b
+        self.fields = list(HEADER_FIELDS) + sorted(fields, key=lambda f: f.offset)
+        self.by_name = {f.name: f for f in self.fields}
+
+        fmt = '<'
+        pos = 0
+        plan = []
+        index = 0
+        for field in self.fields:
+            if field.offset < pos:
+                raise ValueError(f"Class_B 0x{class_b:02X}: field {field.name} overlaps the previous field")
+            code = TYPES[field.type]
+            if field.offset > pos:
+                fmt += f'{field.offset - pos}x'
+            fmt += f'{field.count}{code}' if field.count > 1 else code
+            pos = field.offset + struct.calcsize('<' + code) * field.count
+            plan.append((field.name, index, field.count, field.scale))
+            index += field.count
+        self.struct = struct.Struct(fmt)
+        self.min_length = pos
+        self.plan = plan
+        self.record_class = type(
+            f'Frame{class_b:02X}',
+            (FrameRecord,),
+            {'__slots__': tuple(f.name for f in self.fields), 'layout': self},
+        )
+
+    def decode(self, frame):
+        """Decode a frame into a record, None if the frame is too short for this layout."""
+        if len(frame) < self.min_length:
+            return None
+        values = self.struct.unpack_from(frame)
+        record = self.record_class.__new__(self.record_class)
+        record.class_b = self.class_b
+        for name, index, count, scale in self.plan:
+            if count == 1:
+                value = values[index]
+                setattr(record, name, value if scale == 1 else value * scale)
+            elif scale == 1:
+                setattr(record, name, values[index:index + count])
+            else:
+                setattr(record, name, tuple(v * scale for v in values[index:index + count]))
+        return record
+
+
+LAYOUTS = {class_b: Layout(class_b, fields) for class_b, fields in SCHEMAS.items()}
+
+
+def decode(frame):
+    """Decode a frame with the layout of its Class_B. None for unknown Class_B or short frames."""
+    if len(frame) < 4:
+        return None
+    layout = LAYOUTS.get(frame[3])
+    if layout is None:
+        return None
+    return layout.decode(frame)
+
+
+def format_record(record):
+    """One line of 'name: value unit' pairs for display or logs."""
+    parts = []
+    for field in record.layout.fields[len(HEADER_FIELDS):]:
+        value = getattr(record, field.name)
+        if field.count > 1:
+            text = ' '.join(f'{v:g}' for v in value)
+        else:
+            text = f'{value:g}' if isinstance(value, float) else str(value)
+        parts.append(f"{field.name}: {text}{(' ' + field.unit) if field.unit else ''}")
+    return ', '.join(parts)
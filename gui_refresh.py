@@ -0,0 +1,110 @@
+"""
+Hand GUI updates from the serial threads to the Tk thread.
+
+Tk widgets must only be touched from the thread running mainloop(). The
+serial side calls set() / config() / append() from any thread; these only
+store the update (latest value wins for labels, bounded line buffer for
+payload panes). The Tk side drains everything on a fixed after() cadence, so
+a burst of frames costs one redraw and the panes never grow past max_lines.
+
+    ui = GuiRefresher(root, interval_ms=66, max_lines=500)
+    ui.set(temperature_var, "Temperature: 25.0 C")     # any thread
+    ui.append(text_area_9C, "Payload: 55 26 ...")       # any thread
+    ui.config(status_label, text="Serial connected", fg="green")
+    ui.poll(handle_new_frames)                          # called on the Tk thread before each refresh
+
+Only dict/deque operations that are atomic in CPython are used on the
+thread boundary, so no locks are taken on the per-frame path.
+"""
+
+from collections import deque
+
+DEFAULT_INTERVAL_MS = 66   # ~15 Hz
+DEFAULT_MAX_LINES = 500
+
+
+class GuiRefresher:
+    def __init__(self, root, interval_ms=DEFAULT_INTERVAL_MS, max_lines=DEFAULT_MAX_LINES):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.max_lines = max_lines
+        self._latest = {}      # key -> (func, args, kwargs), only the newest update is kept
+        self._lines = {}       # text widget -> deque of lines not yet shown
+        self._pane_limits = {}
+        self._pollers = []
+        self._running = False
+        self.dropped_lines = 0
+
+    def set(self, var, value):
+        """Set a StringVar (or anything with .set()) on the next refresh."""
+        self._latest[var] = (var.set, (value,), None)
+
+    def config(self, widget, **kwargs):
+        """Call widget.config(**kwargs) on the next refresh."""
+        self._latest[(widget, 'config')] = (widget.config, (), kwargs)
+
+    def add_pane(self, widget, max_lines=None):
+        """Register a text widget that append() may write to, capped at max_lines."""
+        limit = max_lines or self.max_lines
+        self._pane_limits[widget] = limit
+        self._lines[widget] = deque(maxlen=limit)
+
+    def append(self, widget, line):
+        """Append a line to a text pane on the next refresh."""
+        lines = self._lines.get(widget)
+        if lines is None:
+            self.add_pane(widget)
+            lines = self._lines[widget]
+        if len(lines) == lines.maxlen:
+            # Oldest line would be trimmed from the pane anyway
+            self.dropped_lines += 1
+        lines.append(line)
+
+    def poll(self, func):
+        """Call func() on the Tk thread at the start of every refresh, e.g. to drain a frame_bus subscription."""
+        self._pollers.append(func)
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self.root.after(self.interval_ms, self._tick)
+
+    def stop(self):
+        self._running = False
+
+    def _tick(self):
+        if not self._running:
+            return
+        try:
+            self.refresh()
+        finally:
+            self.root.after(self.interval_ms, self._tick)
+
+    def refresh(self):
+        """Apply all pending updates. Must run on the Tk thread."""
+        for func in self._pollers:
+            func()
+        latest = self._latest
+        while latest:
+            try:
+                key, (func, args, kwargs) = latest.popitem()
+            except KeyError:
+                break
+            func(*args, **(kwargs or {}))
+
+        for widget, lines in self._lines.items():
+            if not lines:
+                continue
+            chunk = []
+            while lines:
+                try:
+                    chunk.append(lines.popleft())
+                except IndexError:
+                    break
+            widget.insert('end', '\n'.join(chunk) + '\n')
+            # Keep the pane as a ring buffer of max_lines lines
+            line_count = int(widget.index('end-1c').split('.')[0]) - 1
+            excess = line_count - self._pane_limits[widget]
+            if excess > 0:
+                widget.delete('1.0', f'{excess + 1}.0')
+            widget.see('end')
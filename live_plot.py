@@ -0,0 +1,323 @@
+"""
+Live charts of decoded fields for the GUIs, on a Tk Canvas.
+
+Every plotted value is a Series of fixed size, however long the session:
+    - the last RAW_SAMPLES samples in a ring buffer, for the recent detail
+    - rings of HISTORY_BUCKETS min/max buckets per width in BUCKET_WIDTHS,
+      from 1 s up to 1 h, for the longer spans
+
+A redraw takes the finest level that reaches back over the shown span,
+reduces it to one min/max pair per pixel column (so short spikes stay
+visible) and moves the existing canvas lines with coords(). Its cost is
+bounded by the buffer sizes and the plot width, not by how long the
+session has run.
+
+    charts = ChartWindow(root, MPPT_CHARTS)     # hidden until charts.show()
+    charts.put(time.monotonic(), record)   # any thread, a frame_schema record
+    ui.poll(charts.poll)                   # drained and redrawn on the Tk thread
+
+Only the GUIs import this module, since it needs tkinter.
+"""
+
+import time
+import tkinter as tk
+from array import array
+from collections import deque
+
+# Recent samples kept at full resolution, per series
+RAW_SAMPLES = 4096
+# Then min/max buckets of these widths in s, HISTORY_BUCKETS of each
+# (1 s covers 17 minutes, 10 s 2.8 hours, 60 s 17 hours, 10 min 7 days, 1 h 42 days)
+HISTORY_BUCKETS = 1024
+BUCKET_WIDTHS = (1, 10, 60, 600, 3600)
+# Records waiting for the Tk thread; the oldest are dropped if it falls behind
+CHART_QUEUE = 10000
+PLOT_WIDTH = 900
+PLOT_HEIGHT = 160
+# Redraw every this many GuiRefresher ticks (~4 Hz at 66 ms)
+REDRAW_TICKS = 4
+SPANS = (("1 min", 60), ("10 min", 600), ("1 h", 3600), ("1 day", 86400), ("All", None))
+COLORS = ('#1f77b4', '#d62728', '#2ca02c', '#ff7f0e', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f',
+          '#bcbd22', '#17becf', '#393b79', '#637939', '#8c6d31', '#843c39', '#7b4173', '#3182bd')
+
+# (title, field names) per chart; 'cell_voltages[0]' is one element of an array field
+MPPT_CHARTS = (
+    ("Voltage (V)", ('input_voltage', 'output_voltage', 'input_voltage_1', 'input_voltage_2', 'input_voltage_3')),
+    ("Current (A)", ('input_current', 'output_current')),
+    ("Temperature (C)", ('temperature',)),
+)
+PACK_CHARTS = (
+    ("Cell voltage (V)", tuple(f'cell_voltages[{i}]' for i in range(16))),
+    ("Pack voltage (V)", ('pack_voltage',)),
+    ("Pack current (A)", ('pack_current',)),
+)
+
+
+class Level:
+    """Ring buffer of min/max buckets of a fixed width in s; width 0 keeps every sample."""
+
+    def __init__(self, width, capacity):
+        self.width = width
+        self.capacity = capacity
+        self.starts = array('d', [0.0]) * capacity
+        self.lows = array('d', [0.0]) * capacity
+        # Raw samples are their own min and max
+        self.highs = self.lows if width == 0 else array('d', [0.0]) * capacity
+        self.count = 0
+        # [start, min, max, time of its first sample] of the bucket still being filled
+        self.open = None
+
+    def add(self, t, value):
+        if self.width == 0:
+            self._push(t, value, value)
+            return
+        bucket = self.open
+        if bucket is not None and bucket[0] <= t < bucket[0] + self.width:
+            if value < bucket[1]:
+                bucket[1] = value
+            elif value > bucket[2]:
+                bucket[2] = value
+            return
+        if bucket is not None:
+            # Closed buckets keep the time of their first sample, not the rounded down start
+            self._push(bucket[3], bucket[1], bucket[2])
+        self.open = [t - t % self.width, value, value, t]
+
+    def _push(self, start, low, high):
+        i = self.count % self.capacity
+        self.starts[i] = start
+        self.lows[i] = low
+        self.highs[i] = high
+        self.count += 1
+
+    def oldest(self):
+        """Time of the oldest sample this level still holds, None when it has none."""
+        if self.count:
+            return self.starts[self.count % self.capacity if self.count > self.capacity else 0]
+        return None if self.open is None else self.open[3]
+
+    def buckets(self, t0):
+        """(start, min, max) from the bucket holding t0 on, oldest first."""
+        n = min(self.count, self.capacity)
+        first = self.count - n
+        cap = self.capacity
+        starts, lows, highs = self.starts, self.lows, self.highs
+        t0 -= self.width
+        # Buckets are in time order from the oldest, so the window start can be bisected
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if starts[(first + mid) % cap] < t0:
+                lo = mid + 1
+            else:
+                hi = mid
+        # At most two contiguous runs of the ring, oldest first
+        begin = (first + lo) % cap
+        stop = begin + n - lo
+        for a, b in ((begin, min(stop, cap)), (0, stop - cap)):
+            if a < b:
+                yield from zip(starts[a:b], lows[a:b], highs[a:b])
+        if self.open is not None:
+            yield self.open[3], self.open[1], self.open[2]
+
+
+class Series:
+    """History of one value at constant memory: the recent samples, then min/max buckets of growing width."""
+
+    def __init__(self, name, capacity=RAW_SAMPLES, buckets=HISTORY_BUCKETS, widths=BUCKET_WIDTHS):
+        self.name = name
+        self.levels = [Level(0, capacity)] + [Level(width, buckets) for width in widths]
+        self.count = 0
+        self.last = None
+
+    def add(self, t, value):
+        for level in self.levels:
+            level.add(t, value)
+        self.count += 1
+        self.last = value
+
+    def oldest(self):
+        return self.levels[-1].oldest()
+
+    def columns(self, t0, t1, width):
+        """Min and max per column for width columns over t0..t1, None where there is no data."""
+        low = [None] * width
+        high = [None] * width
+        if self.count == 0 or t1 <= t0:
+            return low, high
+        # The coarsest level still finer than a column, of those whose closed buckets reach back to t0.
+        # When none does (e.g. the session is younger than the span), the finest level going back furthest.
+        column_s = (t1 - t0) / width
+        held = [level for level in self.levels if level.count]
+        reaching = [level for level in held if level.oldest() <= t0]
+        fine = [level for level in reaching if level.width <= column_s]
+        if fine:
+            level = fine[-1]
+        elif reaching:
+            level = reaching[0]
+        else:
+            level = min(held, key=Level.oldest)
+        scale = width / (t1 - t0)
+        for t, v_min, v_max in level.buckets(t0):
+            if t > t1:
+                break
+            x = int((t - t0) * scale)
+            if x < 0:
+                x = 0
+            elif x >= width:
+                x = width - 1
+            current = low[x]
+            if current is None:
+                low[x] = v_min
+                high[x] = v_max
+            else:
+                if v_min < current:
+                    low[x] = v_min
+                if v_max > high[x]:
+                    high[x] = v_max
+        return low, high
+
+
+class LivePlot:
+    """One chart: a canvas with a line per series, auto-scaled to what is shown."""
+
+    MARGIN_LEFT = 60
+    MARGIN_RIGHT = 10
+    MARGIN_TOP = 18
+    MARGIN_BOTTOM = 6
+
+    def __init__(self, parent, title, series, width=PLOT_WIDTH, height=PLOT_HEIGHT):
+        self.title = title
+        self.series = series
+        self.width = width
+        self.height = height
+        self.canvas = tk.Canvas(parent, width=width, height=height, bg='white', highlightthickness=0)
+        canvas = self.canvas
+        # Room for a second legend line when there are many series
+        self.top = self.MARGIN_TOP if len(series) <= 6 else 2 * self.MARGIN_TOP
+        left, top = self.MARGIN_LEFT, self.top
+        right, bottom = width - self.MARGIN_RIGHT, height - self.MARGIN_BOTTOM
+        canvas.create_rectangle(left, top, right, bottom, outline='#c0c0c0')
+        canvas.create_text(4, 2, text=title, anchor='nw', font='TkDefaultFont 9 bold')
+        self._y_max = canvas.create_text(left - 4, top, text='', anchor='ne', font='TkFixedFont')
+        self._y_min = canvas.create_text(left - 4, bottom, text='', anchor='se', font='TkFixedFont')
+        self._legend = canvas.create_text(left + 120, 2, text='', anchor='nw', font='TkFixedFont',
+                                          width=width - left - 120 - self.MARGIN_RIGHT)
+        self.lines = [canvas.create_line(0, 0, 0, 0, fill=COLORS[i % len(COLORS)], width=1)
+                      for i in range(len(series))]
+
+    def redraw(self, t0, t1):
+        left, top = self.MARGIN_LEFT, self.top
+        columns = self.width - self.MARGIN_RIGHT - left
+        bottom = self.height - self.MARGIN_BOTTOM
+        reduced = [s.columns(t0, t1, columns) for s in self.series]
+        y_low = min((v for low, _ in reduced for v in low if v is not None), default=None)
+        y_high = max((v for _, high in reduced for v in high if v is not None), default=None)
+        canvas = self.canvas
+        if y_low is None:
+            for line in self.lines:
+                canvas.coords(line, 0, 0, 0, 0)
+            return
+        if y_high - y_low < 1e-6:
+            y_low, y_high = y_low - 0.5, y_high + 0.5
+        y_scale = (bottom - top) / (y_high - y_low)
+        for line, (low, high) in zip(self.lines, reduced):
+            points = []
+            for x, v_min in enumerate(low):
+                if v_min is not None:
+                    # A vertical stroke per column from its max to its min keeps every spike
+                    points += (left + x, bottom - (high[x] - y_low) * y_scale, left + x, bottom - (v_min - y_low) * y_scale)
+            canvas.coords(line, *(points if len(points) >= 4 else (0, 0, 0, 0)))
+        canvas.itemconfig(self._y_max, text=f"{y_high:.2f}")
+        canvas.itemconfig(self._y_min, text=f"{y_low:.2f}")
+        legend = '  '.join(f"{s.name} {s.last:.2f}" for s in self.series if s.last is not None)
+        canvas.itemconfig(self._legend, text=legend)
+
+
+def series_label(name):
+    """'output_voltage' as is, 'cell_voltages[3]' as '#4'."""
+    attr, _, index = name.partition('[')
+    return f"#{int(index[:-1]) + 1}" if index else attr
+
+
+class ChartWindow:
+    """Toplevel window with one LivePlot per chart, fed with frame_schema records."""
+
+    def __init__(self, root, charts, title="Charts", width=PLOT_WIDTH, height=PLOT_HEIGHT, redraw_ticks=REDRAW_TICKS):
+        self.window = tk.Toplevel(root)
+        self.window.title(title)
+        # Hidden until show(), e.g. from a Charts button. Closing only hides it again, the series keep filling
+        self.window.withdraw()
+        self.window.protocol("WM_DELETE_WINDOW", self.window.withdraw)
+        self.redraw_ticks = redraw_ticks
+        self.series = {}
+        self.plots = []
+        self.span = tk.IntVar(value=SPANS[1][1])
+        self.dropped = 0
+        self._queue = deque(maxlen=CHART_QUEUE)
+        self._fields = {}
+        self._ticks = 0
+
+        buttons = tk.Frame(self.window)
+        buttons.pack(anchor=tk.W, padx=10, pady=5)
+        for text, seconds in SPANS:
+            tk.Radiobutton(buttons, text=text, variable=self.span, value=seconds or 0, indicatoron=False,
+                           command=self.redraw, width=7).pack(side=tk.LEFT)
+        for chart_title, names in charts:
+            series = [self.series.setdefault(name, Series(series_label(name))) for name in names]
+            plot = LivePlot(self.window, chart_title, series, width, height)
+            plot.canvas.pack(padx=10, pady=2)
+            self.plots.append(plot)
+
+    def show(self):
+        self.window.deiconify()
+        self.window.lift()
+        self.redraw()
+
+    def put(self, t, record):
+        """Queue a decoded record with its time in s (time.monotonic() based). Safe from any thread."""
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append((t, record))
+
+    def _record_fields(self, record):
+        """(series, attribute, index) for the fields of this record type that are charted."""
+        fields = self._fields.get(type(record))
+        if fields is None:
+            fields = []
+            for name, series in self.series.items():
+                attr, _, index = name.partition('[')
+                if attr in type(record).__slots__:
+                    fields.append((series, attr, int(index[:-1]) if index else None))
+            self._fields[type(record)] = fields
+        return fields
+
+    def add_record(self, t, record):
+        """Add a record on the Tk thread."""
+        for series, attr, index in self._record_fields(record):
+            value = getattr(record, attr)
+            series.add(t, value if index is None else value[index])
+
+    def poll(self):
+        """GuiRefresher poller: take the queued records, redraw every redraw_ticks while shown."""
+        queue = self._queue
+        while queue:
+            try:
+                t, record = queue.popleft()
+            except IndexError:
+                break
+            self.add_record(t, record)
+        self._ticks += 1
+        if self._ticks % self.redraw_ticks == 0 and self.window.winfo_viewable():
+            self.redraw()
+
+    def redraw(self):
+        t1 = time.monotonic()
+        span = self.span.get()
+        if span:
+            t0 = t1 - span
+        else:
+            starts = [s.oldest() for s in self.series.values() if s.count]
+            t0 = min(starts) if starts else t1 - SPANS[0][1]
+        for plot in self.plots:
+            plot.redraw(t0, t1)
@@ -0,0 +1,230 @@
+"""
+Background log writing.
+
+Reader threads call put() (or a subclass helper like write()), which only
+appends to a queue. One writer thread takes everything queued, encodes it,
+writes it in one go and flushes when enough bytes are pending or
+flush_interval has passed (group commit). Files are rotated by size and/or
+on the hour; path_template may use {time} (UTC, YYYYmmdd_HHMMSS) and
+{index} (rotation counter):
+
+    writer = TextLogWriter('Data/host_mppt_serial_log_{time}z.txt', rotate_bytes=50_000_000)
+    writer.start()
+    writer.write_line("SENT: 55 0E ...")     # never blocks on disk
+    writer.backlog()                         # items waiting to be written
+    writer.close()                           # drains, flushes and joins
+"""
+
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+DEFAULT_FLUSH_BYTES = 64 * 1024
+DEFAULT_FLUSH_INTERVAL = 0.5
+MAX_BATCH = 4096
+
+_STOP = object()
+
+
+class LogWriter:
+    """Batched writer thread. Subclasses override encode() and header()."""
+
+    def __init__(self, path_template, flush_bytes=DEFAULT_FLUSH_BYTES, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 rotate_bytes=0, rotate_hourly=False):
+        self.path_template = path_template
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self.rotate_hourly = rotate_hourly
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.file = None
+        self.path = None
+        self.paths = []
+        self.file_bytes = 0
+        self.file_hour = None
+        self.index = 0
+        self.pending = []
+        self.pending_bytes = 0
+        self.last_flush = time.monotonic()
+        # Statistics
+        self.items_written = 0
+        self.bytes_written = 0
+        self.flushes = 0
+        self.max_backlog = 0
+        self.error = None
+
+    # --- Producer side, any thread ---
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def backlog(self):
+        """Items queued but not yet handed to the file."""
+        return self.queue.qsize()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name=f"LogWriter {self.path_template}", daemon=True)
+            self.thread.start()
+        return self
+
+    def close(self, timeout=5):
+        """Write out everything queued so far and stop the thread."""
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(_STOP)
+            self.thread.join(timeout)
+        self.thread = None
+
+    def stats(self):
+        return {
+            'backlog': self.backlog(),
+            'max_backlog': self.max_backlog,
+            'items_written': self.items_written,
+            'bytes_written': self.bytes_written,
+            'flushes': self.flushes,
+            'files': len(self.paths),
+            'path': self.path,
+        }
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- Subclass hooks, writer thread ---
+
+    def encode(self, item):
+        """Turn a queued item into bytes."""
+        return item
+
+    def header(self):
+        """Bytes written at the start of every new file."""
+        return b''
+
+    def written(self, offset, chunks):
+        """Called after the encoded items in chunks were written to self.path, starting at offset."""
+
+    def finish_file(self):
+        """Called before self.path is closed, on rotation and on close()."""
+
+    # --- Writer thread ---
+
+    def _run(self):
+        get = self.queue.get
+        get_nowait = self.queue.get_nowait
+        while True:
+            timeout = self.flush_interval if self.pending else None
+            try:
+                item = get(timeout=timeout)
+            except queue.Empty:
+                self._flush()
+                continue
+            stop = False
+            batch = 0
+            while True:
+                if item is _STOP:
+                    stop = True
+                    break
+                data = self.encode(item)
+                self.pending.append(data)
+                self.pending_bytes += len(data)
+                batch += 1
+                if batch >= MAX_BATCH:
+                    break
+                try:
+                    item = get_nowait()
+                except queue.Empty:
+                    break
+            backlog = self.queue.qsize() + batch
+            if backlog > self.max_backlog:
+                self.max_backlog = backlog
+            self.items_written += batch
+            if stop or self.pending_bytes >= self.flush_bytes or time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+            if stop:
+                break
+        if self.file is not None:
+            self.finish_file()
+            self.file.close()
+            self.file = None
+
+    def _flush(self):
+        if self.pending:
+            data = b''.join(self.pending)
+            try:
+                self._rotate_if_needed()
+                offset = self.file_bytes
+                self.file.write(data)
+                self.file.flush()
+                self.file_bytes += len(data)
+                self.bytes_written += len(data)
+                self.written(offset, self.pending)
+            except OSError as e:
+                # Keep this thread and the readers alive: the batch is dropped, the error reported once
+                if self.error is None:
+                    print(f"Log writer error on {self.path}: {e}")
+                self.error = e
+            self.flushes += 1
+            self.pending = []
+            self.pending_bytes = 0
+        self.last_flush = time.monotonic()
+
+    def _rotate_if_needed(self):
+        now = datetime.now(timezone.utc)
+        hour = now.strftime('%Y%m%d%H')
+        if self.file is not None:
+            rotate = ((self.rotate_bytes and self.file_bytes >= self.rotate_bytes)
+                      or (self.rotate_hourly and hour != self.file_hour))
+            if not rotate:
+                return
+            self.finish_file()
+            file, self.file = self.file, None
+            file.close()
+            self.index += 1
+        path = self.path_template.format(time=now.strftime('%Y%m%d_%H%M%S'), index=self.index)
+        # Never append to an existing file, e.g. two rotations within the same second
+        base, ext = os.path.splitext(path)
+        n = 1
+        while os.path.exists(path):
+            path = f"{base}_{n}{ext}"
+            n += 1
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        file = open(path, 'ab')
+        header = self.header()
+        try:
+            file.write(header)
+        except OSError:
+            file.close()
+            raise
+        # Only a file that was opened is used, a failed open is retried on the next flush
+        self.file = file
+        self.file_hour = hour
+        self.paths.append(path)
+        self.file_bytes = len(header)
+
+
+class TextLogWriter(LogWriter):
+    """Background writer for text lines."""
+
+    def __init__(self, path_template, title=None, **kwargs):
+        super().__init__(path_template, **kwargs)
+        self.title = title
+
+    def write_line(self, line):
+        self.put(line)
+
+    def encode(self, item):
+        return (item + '\n').encode('utf-8')
+
+    def header(self):
+        text = f"Serial Log Start - {datetime.now()}\n"
+        if self.title:
+            text += f"{self.title}\n\n"
+        return text.encode('utf-8')
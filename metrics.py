@@ -0,0 +1,254 @@
+"""
+Live counters for the reader, decoder, writer and request paths, served on
+localhost in the Prometheus text format.
+
+The per-frame cost is one count() call per received batch: a dict lookup
+and two integer adds per frame. Everything that already keeps its own
+counters (FrameDecoder, LogWriter, RequestTracker) is only registered here
+and read when the endpoint is scraped.
+
+    metrics = Metrics()
+    port_metrics = metrics.port("/dev/ttyACM0")
+    metrics.add_decoder("/dev/ttyACM0", decoder)
+    metrics.add_writer("capture", writer)
+    metrics.add_tracker("/dev/ttyACM0", tracker)   # request/reply latency histogram
+    metrics.add_bus("capture", bus)                # frame_bus subscriber backlogs and drops
+    metrics.add_packs(monitor)                     # pack_analytics.PackMonitor gauges
+    serve(metrics, 9108)                           # http://127.0.0.1:9108/metrics
+
+    # in the receive callback
+    port_metrics.count(frames)
+
+Rates (frames/s, bytes/s) come from the *_total counters, e.g.
+rate(sdc_frames_total[1m]) on the Prometheus side.
+"""
+
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from request_tracker import sequence_gap
+
+DEFAULT_PORT = 9108
+# Reply latency buckets in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+class Histogram:
+    """Fixed bucket histogram, observe() is a bisect and three adds."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, **labels):
+        lines = []
+        total = 0
+        counts = list(self.counts)
+        for bound, count in zip(self.bounds, counts):
+            total += count
+            lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {total}")
+        total += counts[-1]
+        lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {total}")
+        lines.append(f"{name}_sum{_labels(**labels)} {self.sum}")
+        lines.append(f"{name}_count{_labels(**labels)} {total}")
+        return lines
+
+
+class PortMetrics:
+    """Frame and byte counters of one port, by direction and Class_B, plus sequence gaps of received frames."""
+
+    def __init__(self, port):
+        self.port = port
+        self.by_class = {}         # (direction, class_b) -> [frames, bytes]
+        self.last_sequence = {}    # talker -> sequence number
+        self.sequence_gaps = 0
+        self.sequence_missing = 0
+
+    def count(self, frames, direction='rx'):
+        by_class = self.by_class
+        last_sequence = self.last_sequence
+        for frame in frames:
+            key = (direction, frame[3])
+            counter = by_class.get(key)
+            if counter is None:
+                counter = by_class[key] = [0, 0]
+            counter[0] += 1
+            counter[1] += len(frame)
+            if direction != 'rx':
+                continue
+            talker = frame[4]
+            sequence = frame[6] | (frame[7] << 8)
+            previous = last_sequence.get(talker)
+            last_sequence[talker] = sequence
+            if previous is not None:
+                gap = sequence_gap(previous, sequence)
+                # 0 is a repeat (e.g. a resend), large values are a restart or reordering
+                if 1 < gap < 0x8000:
+                    self.sequence_gaps += 1
+                    self.sequence_missing += gap - 1
+
+
+class Metrics:
+    """Registry of everything the endpoint reports."""
+
+    def __init__(self):
+        self.ports = {}
+        self.decoders = {}
+        self.writers = {}
+        self.trackers = {}
+        self.latency = {}
+        self.buses = {}
+        self.pack_monitors = []
+
+    def port(self, name):
+        port_metrics = self.ports.get(name)
+        if port_metrics is None:
+            port_metrics = self.ports[name] = PortMetrics(name)
+        return port_metrics
+
+    def add_decoder(self, port, decoder):
+        self.decoders[port] = decoder
+
+    def add_writer(self, name, writer):
+        self.writers[name] = writer
+
+    def add_tracker(self, name, tracker):
+        """Report a RequestTracker's counters and record its reply latencies in a histogram."""
+        self.trackers[name] = tracker
+        tracker.histogram = self.latency[name] = Histogram()
+
+    def add_bus(self, name, bus):
+        self.buses[name] = bus
+
+    def add_packs(self, monitor):
+        self.pack_monitors.append(monitor)
+
+    def render(self):
+        out = []
+
+        def metric(name, kind, help_text, samples):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                out.append(f"{name}{_labels(**labels)} {value}")
+
+        ports = list(self.ports.values())
+        frames = []
+        frame_bytes = []
+        for p in ports:
+            for (direction, class_b), (count, size) in sorted(list(p.by_class.items())):
+                labels = {'port': p.port, 'direction': direction, 'class_b': f'0x{class_b:02X}'}
+                frames.append((labels, count))
+                frame_bytes.append((labels, size))
+        metric('sdc_frames_total', 'counter', "Frames by port, direction and Class_B.", frames)
+        metric('sdc_frame_bytes_total', 'counter', "Frame bytes by port, direction and Class_B.", frame_bytes)
+        metric('sdc_sequence_gaps_total', 'counter', "Received frames whose sequence number skipped ahead.",
+               [({'port': p.port}, p.sequence_gaps) for p in ports])
+        metric('sdc_sequence_missing_total', 'counter', "Sequence numbers skipped in received frames.",
+               [({'port': p.port}, p.sequence_missing) for p in ports])
+
+        decoders = list(self.decoders.items())
+        metric('sdc_received_bytes_total', 'counter', "Bytes read from the port.",
+               [({'port': port}, d.bytes_in) for port, d in decoders])
+        metric('sdc_crc_errors_total', 'counter', "Frames dropped on a CRC mismatch.",
+               [({'port': port}, d.crc_errors) for port, d in decoders])
+        metric('sdc_length_errors_total', 'counter', "Start bytes dropped on an impossible length.",
+               [({'port': port}, d.length_errors) for port, d in decoders])
+        metric('sdc_resync_dropped_bytes_total', 'counter', "Bytes skipped while resynchronising.",
+               [({'port': port}, d.dropped_bytes) for port, d in decoders])
+
+        writers = list(self.writers.items())
+        metric('sdc_writer_backlog', 'gauge', "Items queued for the log writer thread.",
+               [({'writer': name}, w.backlog()) for name, w in writers])
+        metric('sdc_writer_max_backlog', 'gauge', "Largest log writer backlog seen.",
+               [({'writer': name}, w.max_backlog) for name, w in writers])
+        metric('sdc_writer_bytes_total', 'counter', "Bytes written by the log writer.",
+               [({'writer': name}, w.bytes_written) for name, w in writers])
+        metric('sdc_writer_flushes_total', 'counter', "Log writer flushes.",
+               [({'writer': name}, w.flushes) for name, w in writers])
+
+        subscriptions = [(name, s) for name, bus in list(self.buses.items()) for s in bus.subscriptions]
+        metric('sdc_bus_published_total', 'counter', "Frames published on the frame bus.",
+               [({'bus': name}, bus.published) for name, bus in list(self.buses.items())])
+        metric('sdc_bus_backlog', 'gauge', "Frames queued for a frame bus subscriber.",
+               [({'bus': name, 'subscriber': s.name}, s.backlog()) for name, s in subscriptions])
+        metric('sdc_bus_dropped_total', 'counter', "Frames a frame bus subscriber lost to a full queue.",
+               [({'bus': name, 'subscriber': s.name}, s.dropped) for name, s in subscriptions])
+
+        packs = [pack for monitor in self.pack_monitors for pack in list(monitor.packs.values())]
+        if packs:
+            def pack_metric(name, help_text, attr):
+                metric(name, 'gauge', help_text, [({'pack': f'0x{p.talker:02X}'}, getattr(p, attr)) for p in packs])
+
+            pack_metric('sdc_pack_voltage_volts', "Pack voltage from 0x2D.", 'pack_voltage')
+            pack_metric('sdc_pack_current_amperes', "Pack current from 0x2D, positive is charging.", 'pack_current')
+            pack_metric('sdc_pack_charge_in_ah', "Charge into the pack since the start, Ah.", 'charge_in_ah')
+            pack_metric('sdc_pack_charge_out_ah', "Charge out of the pack since the start, Ah.", 'charge_out_ah')
+            pack_metric('sdc_pack_cell_spread_volts', "Highest minus lowest cell voltage.", 'spread')
+            metric('sdc_pack_cell_voltage_volts', 'gauge', "Cell voltage from 0x2D.",
+                   [({'pack': f'0x{p.talker:02X}', 'cell': str(i + 1)}, v) for p in packs for i, v in enumerate(p.cells)])
+            metric('sdc_pack_anomalies_total', 'counter', "Pack anomaly flags raised.",
+                   [({'pack': f'0x{p.talker:02X}', 'flag': flag}, count) for p in packs
+                    for flag, count in list(p.flag_counts.items())])
+
+        trackers = list(self.trackers.items())
+        metric('sdc_requests_total', 'counter', "Requests sent.",
+               [({'session': name}, t.sent) for name, t in trackers])
+        metric('sdc_request_timeouts_total', 'counter', "Requests without a reply in time.",
+               [({'session': name}, t.timeouts) for name, t in trackers])
+        metric('sdc_late_replies_total', 'counter', "Replies that arrived after their request timed out.",
+               [({'session': name}, t.late) for name, t in trackers])
+        out.append("# HELP sdc_reply_latency_seconds Time from sending a request to receiving its reply.")
+        out.append("# TYPE sdc_reply_latency_seconds histogram")
+        for name, histogram in list(self.latency.items()):
+            out.extend(histogram.lines('sdc_reply_latency_seconds', session=name))
+        return '\n'.join(out) + '\n'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(metrics, port=DEFAULT_PORT, host='127.0.0.1'):
+    """Serve metrics from a daemon thread. Returns the server, or None if the port could not be bound."""
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        print(f"Metrics endpoint not started on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Metrics on http://{host}:{server.server_port}/metrics")
+    return server
@@ -0,0 +1,195 @@
+"""
+Drive many power-unit sessions from one process, one MpptSession per MPPT.
+
+    python mppt_controller.py /dev/ttyACM0 /dev/ttyACM1 --voltage 52.2 --current 7.65
+    python mppt_controller.py --config rack.json
+
+The config file is JSON; per-session keys override the top-level defaults:
+
+    {
+        "voltage": 52.2, "current": 7.65, "period": 0.5,
+        "poll_period": 0.25, "ramp_current": 2.0,
+        "sessions": [
+            {"port": "/dev/ttyACM0", "name": "left"},
+            {"port": "/dev/ttyACM1", "name": "right", "current": 3.0}
+        ]
+    }
+
+All sessions share one asyncio loop. Every report interval the aggregate
+throughput and one health line per session are printed. Each session logs to
+its own text log and capture in Data/.
+"""
+
+import argparse
+import asyncio
+import json
+import signal
+import time
+
+from metrics import Metrics, serve
+from mppt_session import BAUD_RATE, PERIOD, REPLY_TIMEOUT, MpptSession
+
+REPORT_INTERVAL = 10.0
+# Keys a session entry (or the top level of the config) may set
+SESSION_KEYS = ('name', 'voltage', 'current', 'baudrate', 'period', 'reply_timeout', 'poll_period', 'setpoint_period',
+                'ramp_voltage', 'ramp_current')
+
+
+def load_config(path):
+    """Session keyword arguments from a JSON config file."""
+    with open(path) as f:
+        config = json.load(f)
+    defaults = {key: config[key] for key in SESSION_KEYS if key in config and key != 'name'}
+    sessions = []
+    for entry in config.get('sessions', []):
+        if 'port' not in entry:
+            raise ValueError(f"Session without a port in {path}: {entry}")
+        unknown = set(entry) - set(SESSION_KEYS) - {'port'}
+        if unknown:
+            raise ValueError(f"Unknown session keys in {path}: {', '.join(sorted(unknown))}")
+        kwargs = dict(defaults)
+        kwargs.update(entry)
+        sessions.append(kwargs)
+    return sessions
+
+
+def make_sessions(entries, metrics=None, verbose=False, bus=None):
+    """MpptSession for each entry, with unique names. With a frame bus the sessions share its port readers."""
+    names = set()
+    sessions = []
+    for entry in entries:
+        session = MpptSession(verbose=verbose, metrics=metrics, bus=bus, **entry)
+        if session.name in names:
+            # Session names end up in the log file names
+            session.name = f"{session.name}_{len(sessions)}"
+        names.add(session.name)
+        sessions.append(session)
+    return sessions
+
+
+def format_health(h):
+    def ms(value):
+        return '-' if value is None else f"{value:.1f}"
+
+    age = '-' if h['last_reply_age'] is None else f"{h['last_reply_age']:.1f}s"
+    output = '-' if h['output_voltage'] is None else f"{h['output_voltage']:.2f}V {h['output_current']:.2f}A"
+    applied = '-' if h['applied_voltage'] is None else f"{h['applied_voltage']:.2f}V {h['applied_current']:.2f}A"
+    line = (f"  {h['name']:<12} {h['state']:<9} 0x{h['listener']:02X} sent {h['sent']:>7} recv {h['received']:>7} "
+            f"timeouts {h['timeouts']:>5} p50 {ms(h['p50_ms']):>6}ms p99 {ms(h['p99_ms']):>6}ms "
+            f"last {age:>6} set {applied} out {output}")
+    if h['error']:
+        line += f" error: {h['error']}"
+    return line
+
+
+class Controller:
+    """Runs a set of sessions concurrently and reports on them."""
+
+    def __init__(self, sessions, report_interval=REPORT_INTERVAL):
+        self.sessions = sessions
+        self.report_interval = report_interval
+        self.stop_event = None
+        self._last = None
+
+    def stop(self):
+        if self.stop_event is not None:
+            self.stop_event.set()
+        for session in self.sessions:
+            session.stop()
+
+    def totals(self):
+        return {
+            'sessions': len(self.sessions),
+            'running': sum(1 for s in self.sessions if s.state == 'running'),
+            'sent': sum(s.frames_sent for s in self.sessions),
+            'received': sum(s.frames_received for s in self.sessions),
+            'bytes': sum(s.bytes_sent + s.bytes_received for s in self.sessions),
+            'timeouts': sum(s.tracker.timeouts for s in self.sessions),
+        }
+
+    def report(self):
+        now = time.monotonic()
+        totals = self.totals()
+        last_time, last = self._last or (now, totals)
+        elapsed = now - last_time
+        if elapsed > 0:
+            rate = (f"{(totals['sent'] - last['sent']) / elapsed:.1f} frames/s out, "
+                    f"{(totals['received'] - last['received']) / elapsed:.1f} frames/s in, "
+                    f"{(totals['bytes'] - last['bytes']) / elapsed / 1024:.1f} KiB/s")
+        else:
+            rate = "starting"
+        self._last = (now, totals)
+        print(f"[{time.strftime('%H:%M:%S')}] {totals['running']}/{totals['sessions']} running, {rate}, "
+              f"{totals['timeouts']} timeouts")
+        for session in self.sessions:
+            print(format_health(session.health()))
+
+    async def _reporter(self):
+        while not self.stop_event.is_set():
+            try:
+                await asyncio.wait_for(self.stop_event.wait(), self.report_interval)
+            except asyncio.TimeoutError:
+                self.report()
+
+    async def run(self, duration=None, signals=True):
+        """Run until every session has finished; SIGINT/SIGTERM stop them unless signals is False."""
+        loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM) if signals else ():
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass  # Windows, or not the main thread
+        if duration:
+            loop.call_later(duration, self.stop)
+        self.report()
+        reporter = asyncio.create_task(self._reporter())
+        await asyncio.gather(*(session.run() for session in self.sessions))
+        self.stop_event.set()
+        await reporter
+        self.report()
+        for session in self.sessions:
+            print(f"{session.name}: {session.tracker.summary()}")
+            if session.log_paths:
+                print(f"  logs: {', '.join(session.log_paths)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulate power units for many MPPTs from one process.")
+    parser.add_argument('ports', nargs='*', help="Serial ports, one session each")
+    parser.add_argument('--config', help="JSON file describing the sessions")
+    parser.add_argument('--voltage', type=float, default=52.20, help="Target voltage in V (default 52.20)")
+    parser.add_argument('--current', type=float, default=7.65, help="Target current in A (default 7.65)")
+    parser.add_argument('--baud', type=int, default=BAUD_RATE)
+    parser.add_argument('--period', type=float, default=PERIOD, help="Seconds between request rounds (default 0.5)")
+    parser.add_argument('--reply-timeout', type=float, default=REPLY_TIMEOUT)
+    parser.add_argument('--poll-period', type=float, help="Seconds between 0x66 polls (default --period)")
+    parser.add_argument('--setpoint-period', type=float, help="Seconds between 0x38 keep-alives (default --period)")
+    parser.add_argument('--ramp-voltage', type=float, help="Ramp voltage setpoint changes at this many V/s")
+    parser.add_argument('--ramp-current', type=float, help="Ramp current setpoint changes at this many A/s")
+    parser.add_argument('--report-interval', type=float, default=REPORT_INTERVAL)
+    parser.add_argument('--duration', type=float, help="Stop after this many seconds")
+    parser.add_argument('--verbose', action='store_true', help="Print every frame")
+    parser.add_argument('--metrics-port', type=int, help="Serve Prometheus metrics on this localhost port")
+    args = parser.parse_args()
+
+    defaults = {'voltage': args.voltage, 'current': args.current, 'baudrate': args.baud,
+                'period': args.period, 'reply_timeout': args.reply_timeout, 'poll_period': args.poll_period,
+                'setpoint_period': args.setpoint_period, 'ramp_voltage': args.ramp_voltage,
+                'ramp_current': args.ramp_current}
+    entries = [dict(defaults, **entry) for entry in load_config(args.config)] if args.config else []
+    entries += [dict(defaults, port=port) for port in args.ports]
+    if not entries:
+        parser.error("no sessions, give ports or --config")
+
+    metrics = None
+    if args.metrics_port:
+        metrics = Metrics()
+        serve(metrics, args.metrics_port)
+
+    sessions = make_sessions(entries, metrics, args.verbose)
+    asyncio.run(Controller(sessions, args.report_interval).run(args.duration))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+"""
+One power-unit session: the port, handshake state, sequence counter,
+listener id and setpoints of one emulated power unit talking to one MPPT.
+
+Sessions are plain asyncio coroutines, so one event loop can drive many of
+them (see mppt_controller.py); host_mppt.py runs a single one behind its GUI.
+
+    session = MpptSession("/dev/ttyACM0", voltage=52.2, current=7.65)
+    await session.run()                   # until session.stop()
+    session.set_targets(48.0, 1.0)        # any thread, the 0x38 goes out right away
+    session.health()
+
+0x66 polls and 0x38 setpoints run on their own cadences (poll_period and
+setpoint_period, both default to period). A new setpoint is sent as soon as
+it is set and confirmed against the 0x20 echo; a 0x38 that is not echoed
+with the same values is resent. With ramp_voltage / ramp_current (V/s, A/s)
+the setpoint moves towards the target in steps of ramp_step seconds, each
+step confirmed before the next.
+
+With bus=frame_bus.FrameBus() the session does not open the port itself but
+shares the bus's reader, so the same port can be captured and driven at once
+and every frame it sends is published on the bus.
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime
+
+from aio_serial import AsyncSerialPort
+from capture import CAPTURE_EXT, DIR_RX, DIR_TX, CaptureLogWriter
+from crc16 import add_crc16_checksum
+from frame_encoder import frame_38, frame_66
+from frame_schema import LAYOUTS
+from log_writer import TextLogWriter
+from request_tracker import RequestTracker, next_sequence
+from sdc_frames import INITIAL_BYTES1, INITIAL_BYTES2, set_sequence
+
+BAUD_RATE = 115200
+PERIOD = 0.5
+# Time between ramp steps, and how often an unconfirmed setpoint is resent
+RAMP_STEP = 0.05
+SETPOINT_RETRIES = 3
+# How long to wait for the reply with the same sequence number, and how often to resend the handshake
+REPLY_TIMEOUT = 0.2
+HANDSHAKE_RETRIES = 5
+# {name} is the session name, {time} is filled in when each file is started
+LOG_FILE_TEMPLATE = "Data/host_mppt_{name}_serial_log_{time}z.txt"
+CAPTURE_FILE_TEMPLATE = "Data/host_mppt_{name}_serial_log_{time}z" + CAPTURE_EXT
+LOG_ROTATE_BYTES = 64 * 1024 * 1024
+# A running session with no reply for this long is reported as stale
+STALE_AFTER = 5.0
+
+
+class MpptSession:
+    """Handshake with one MPPT, then poll with 0x66 and keep the setpoints up with 0x38. Replies are handled as they arrive."""
+
+    def __init__(self, port, name=None, voltage=52.20, current=7.65, baudrate=BAUD_RATE, period=PERIOD,
+                 reply_timeout=REPLY_TIMEOUT, log_template=LOG_FILE_TEMPLATE, capture_template=CAPTURE_FILE_TEMPLATE,
+                 rotate_bytes=LOG_ROTATE_BYTES, verbose=False, on_record=None, on_status=None, metrics=None, bus=None,
+                 poll_period=None, setpoint_period=None, ramp_voltage=None, ramp_current=None, ramp_step=RAMP_STEP):
+        self.port = port
+        self.name = name or os.path.basename(port)
+        self.target_voltage = voltage
+        self.target_current = current
+        self.baudrate = baudrate
+        self.period = period
+        self.poll_period = poll_period or period
+        self.setpoint_period = setpoint_period or period
+        # V/s and A/s, None to jump straight to the target
+        self.ramp_voltage = ramp_voltage
+        self.ramp_current = ramp_current
+        self.ramp_step = ramp_step
+        self.reply_timeout = reply_timeout
+        self.log_template = log_template
+        self.capture_template = capture_template
+        self.rotate_bytes = rotate_bytes
+        self.verbose = verbose
+        # on_record(session, record) for each decoded 0x9C, on_status(session, text, color) on state changes
+        self.on_record = on_record
+        self.on_status = on_status
+        # metrics.Metrics to report to, if any
+        self.metrics = metrics
+        self.port_metrics = None if metrics is None else metrics.port(port)
+        # frame_bus.FrameBus to read and write the port through, if any
+        self.bus = bus
+
+        self.listener = 0x00
+        self.sequence_number = 1
+        self.state = 'idle'
+        self.connection = None
+        self.tracker = RequestTracker()
+        self.last_record = None
+        self.last_reply = None
+        self.started = None
+        self.frames_sent = 0
+        self.frames_received = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.error = None
+        self.log_paths = []
+        # Setpoint last echoed by the MPPT in a 0x20, in V and A
+        self.applied_voltage = None
+        self.applied_current = None
+        self.setpoint_latency = None
+        self.setpoint_failures = 0
+        self._target_changed_at = None
+        self._stop = None
+        self._wake = None
+        self._loop = None
+        # 0x66 and 0x38 are patched in place for every request instead of being rebuilt
+        self._encoder_66 = frame_66(self.listener)
+        self._encoder_38 = frame_38(self.listener)
+
+    # --- Any thread ---
+
+    def set_targets(self, voltage, current):
+        """New setpoints, sent right away (or ramped to) by the running session."""
+        if not (0 <= voltage <= 655.35 and 0 <= current <= 655.35):
+            raise ValueError(f"Setpoint out of range: {voltage} V, {current} A")
+        self.target_voltage = voltage
+        self.target_current = current
+        self._target_changed_at = time.monotonic()
+        if self._loop is not None and self._wake is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def stop(self):
+        """Ask run() to finish; safe to call from other threads."""
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    def health(self):
+        now = time.monotonic()
+        state = self.state
+        if state == 'running' and (self.last_reply is None or now - self.last_reply > STALE_AFTER):
+            state = 'stale'
+        stats = self.tracker.stats()
+        return {
+            'name': self.name,
+            'port': self.port,
+            'state': state,
+            'listener': self.listener,
+            'sent': self.frames_sent,
+            'received': self.frames_received,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'timeouts': stats['timeouts'],
+            'p50_ms': stats['p50_ms'],
+            'p99_ms': stats['p99_ms'],
+            'last_reply_age': None if self.last_reply is None else now - self.last_reply,
+            'uptime': 0.0 if self.started is None else now - self.started,
+            'output_voltage': None if self.last_record is None else self.last_record.output_voltage,
+            'output_current': None if self.last_record is None else self.last_record.output_current,
+            'applied_voltage': self.applied_voltage,
+            'applied_current': self.applied_current,
+            'setpoint_latency_ms': None if self.setpoint_latency is None else self.setpoint_latency * 1000,
+            'setpoint_failures': self.setpoint_failures,
+            'error': None if self.error is None else str(self.error),
+        }
+
+    # --- Frames ---
+
+    def frame_38(self, voltage=None, current=None):
+        """
+        Next 0x38 with the CRC, with the target setpoints unless others are given.
+        A view of the session's encoder, valid until the next 0x38.
+        """
+        if voltage is None:
+            voltage, current = self.target_voltage, self.target_current
+        encoder = self._encoder_38
+        encoder.set_listener(self.listener)
+        encoder.set(voltage=voltage, current=current)
+        frame = encoder.encode(self.sequence_number)
+        self.sequence_number = next_sequence(self.sequence_number)
+        return frame
+
+    def frame_66(self):
+        """Next 0x66 with the CRC, a view of the session's encoder valid until the next 0x66."""
+        encoder = self._encoder_66
+        encoder.set_listener(self.listener)
+        frame = encoder.encode(self.sequence_number)
+        self.sequence_number = next_sequence(self.sequence_number)
+        return frame
+
+    def next_step(self, elapsed):
+        """(voltage, current) to send next: the target, or a ramp step of elapsed seconds towards it."""
+        def step(applied, target, rate):
+            if applied is None or not rate:
+                return target
+            limit = rate * elapsed
+            return min(target, applied + limit) if target > applied else max(target, applied - limit)
+
+        return (step(self.applied_voltage, self.target_voltage, self.ramp_voltage),
+                step(self.applied_current, self.target_current, self.ramp_current))
+
+    def from_template(self, data):
+        """Copy of a template with this session's listener id, next sequence number and the CRC."""
+        frame = add_crc16_checksum(set_sequence(data, self.sequence_number, self.listener))
+        self.sequence_number = next_sequence(self.sequence_number)
+        return frame
+
+    # --- Event loop ---
+
+    def _status(self, state, text, color):
+        self.state = state
+        if self.on_status is not None:
+            self.on_status(self, text, color)
+
+    def _log(self, entry):
+        log_entry = f"[{datetime.now()}] {entry}"
+        if self.verbose:
+            print(log_entry)
+        self._log_file.write_line(log_entry)
+
+    def _send(self, frame):
+        if self.bus is not None:
+            # Bus subscribers keep the frame
+            frame = bytes(frame)
+            self.bus.write(self.port, frame)
+        else:
+            self.connection.write(frame)
+            # The logs keep the frame, the encoder view is reused
+            frame = bytes(frame)
+        self._capture.write(frame, self._port_id, DIR_TX)
+        self.frames_sent += 1
+        self.bytes_sent += len(frame)
+        if self.port_metrics is not None:
+            self.port_metrics.count((frame,), 'tx')
+        self._log(f"SENT: {' '.join(f'{byte:02X}' for byte in frame)}")
+
+    def _on_bus_frames(self, port, frames, ts_ns, direction):
+        if port == self.port and direction == DIR_RX:
+            self._on_frames(None, frames, ts_ns)
+
+    def _on_frames(self, port, frames, ts_ns):
+        self._capture.write_many(frames, self._port_id, ts_ns=ts_ns)
+        self.last_reply = time.monotonic()
+        if self.port_metrics is not None:
+            self.port_metrics.count(frames)
+        for frame in frames:
+            self.frames_received += 1
+            self.bytes_received += len(frame)
+            self._log(f"RECV: {' '.join(f'{byte:02X}' for byte in frame)}")
+            self.tracker.match(frame, ts_ns)
+            if frame[3] == 0x9C:
+                record = LAYOUTS[0x9C].decode(frame)
+                if record is None:
+                    continue
+                self.last_record = record
+                if self.on_record is not None:
+                    try:
+                        self.on_record(self, record)
+                    except Exception as e:
+                        print(f"{self.name}: error processing 0x9C frame: {e}")
+
+    async def request(self, build_frame, retries=0):
+        """
+        Send a request built by build_frame() (CRC included) and wait for its reply, resending on timeout.
+        Returns None without waiting further once stop() is called.
+        """
+        for attempt in range(retries + 1):
+            if self._stop.is_set():
+                return None
+            frame = build_frame()
+            reply_future = self.tracker.expect(frame, self.reply_timeout)
+            self._send(frame)
+            stop_wait = asyncio.ensure_future(self._stop.wait())
+            try:
+                await asyncio.wait([reply_future, stop_wait], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                stop_wait.cancel()
+            if not reply_future.done():
+                return None
+            reply = reply_future.result()
+            if reply is not None:
+                return reply
+            self._log(f"No reply to 0x{frame[3]:02X} seq {frame[6] | (frame[7] << 8)}")
+        return None
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._wake = asyncio.Event()
+        self.started = time.monotonic()
+        self.error = None
+        try:
+            if self.bus is not None:
+                opened = self.bus.open([self.port], self.baudrate)
+                if not opened:
+                    raise OSError("not opened by the frame bus")
+                self.connection = opened[0]
+            else:
+                self.connection = AsyncSerialPort(self.port, self.baudrate).open()
+        except Exception as e:
+            self.error = e
+            self._status('error', f"Failed to open serial port {self.port}: {e}", "red")
+            return
+        self._status('handshake', "Serial connected", "green")
+
+        # Text log for reading, frames also go to a binary capture
+        self._log_file = TextLogWriter(self.log_template.replace('{name}', self.name),
+                                       title=f"Port: {self.port}, Baud: {self.baudrate}", rotate_bytes=self.rotate_bytes)
+        self._capture = CaptureLogWriter(self.capture_template.replace('{name}', self.name), index=True,
+                                         rotate_bytes=self.rotate_bytes)
+        try:
+            with self._log_file, self._capture:
+                self._port_id = self._capture.port_id(self.port)
+                if self.metrics is not None:
+                    self.metrics.add_decoder(self.port, self.connection.decoder)
+                    self.metrics.add_tracker(self.name, self.tracker)
+                    self.metrics.add_writer(f"{self.name} log", self._log_file)
+                    self.metrics.add_writer(f"{self.name} capture", self._capture)
+                if self.bus is not None:
+                    self.bus.tap(self._on_bus_frames)
+                else:
+                    self.connection.on_frames = self._on_frames
+                await self._session()
+            self.log_paths = self._log_file.paths + self._capture.paths
+        finally:
+            if self.bus is not None:
+                # The port belongs to the bus
+                self.bus.untap(self._on_bus_frames)
+            else:
+                self.connection.close()
+            self._status('error' if self.error is not None else 'stopped', "Serial disconnected", "red")
+
+    async def _wait(self, delay, wake=False):
+        """Sleep for delay seconds; returns early on stop(), and on set_targets() if wake is set."""
+        if delay <= 0:
+            return
+        events = [self._stop] + ([self._wake] if wake else [])
+        waits = [asyncio.ensure_future(event.wait()) for event in events]
+        try:
+            await asyncio.wait(waits, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for wait in waits:
+                wait.cancel()
+
+    def _check_connection(self):
+        if self.connection.error is not None:
+            raise self.connection.error
+
+    async def _poll_loop(self):
+        """0x66 every poll_period, answered by 0x9C."""
+        loop = self._loop
+        next_send_time = loop.time()
+        while not self._stop.is_set():
+            self._check_connection()
+            delay = next_send_time - loop.time()
+            if delay > 0:
+                await self._wait(delay)
+                continue
+            next_send_time += self.poll_period
+            if next_send_time < loop.time():
+                # Fell behind (slow replies), don't burst to catch up
+                next_send_time = loop.time() + self.poll_period
+            await self.request(self.frame_66)
+
+    async def _setpoint_loop(self):
+        """
+        0x38 on every setpoint change (or ramp step) and every setpoint_period, confirmed by the 0x20 echo.
+        The first 0x38 after the handshake carries the target as is, there is nothing to ramp from yet.
+        """
+        loop = self._loop
+        ramped = self.ramp_voltage or self.ramp_current
+        last_sent = None
+        # _target_changed_at when the last 0x38 went unconfirmed, so only a new target skips the retry wait
+        failed_for = unconfirmed = object()
+        while not self._stop.is_set():
+            self._check_connection()
+            self._wake.clear()
+            now = loop.time()
+            settled = (self.applied_voltage, self.applied_current) == (self.target_voltage, self.target_current)
+            if last_sent is not None:
+                if failed_for is not unconfirmed and failed_for == self._target_changed_at \
+                        and now < last_sent + self.setpoint_period:
+                    # Not echoed: try again at the keep-alive cadence rather than flooding the port
+                    await self._wait(last_sent + self.setpoint_period - now, wake=True)
+                    continue
+                if settled and now < last_sent + self.setpoint_period:
+                    # Nothing to change, wait for the keep-alive or a new target
+                    await self._wait(last_sent + self.setpoint_period - now, wake=True)
+                    continue
+                if not settled and ramped and now < last_sent + self.ramp_step:
+                    await self._wait(last_sent + self.ramp_step - now)
+                    continue
+            # Slow replies stretch the ramp rather than making its steps bigger
+            elapsed = self.ramp_step if last_sent is None else min(now - last_sent, self.ramp_step)
+            voltage, current = self.next_step(elapsed)
+            changed_at = self._target_changed_at
+            last_sent = loop.time()
+            if not await self._send_setpoint(voltage, current):
+                failed_for = changed_at
+                # The retry wait runs from the last resend, not from the first try
+                last_sent = loop.time()
+                continue
+            failed_for = unconfirmed
+            if changed_at is not None and changed_at == self._target_changed_at:
+                self.setpoint_latency = time.monotonic() - changed_at
+                self._target_changed_at = None
+
+    async def _send_setpoint(self, voltage, current):
+        """Send a 0x38 until the MPPT echoes it. Returns True once confirmed."""
+        # The echo is checked against the setpoint bytes actually sent, not a second encoding of them
+        sent = []
+
+        def build():
+            frame = self.frame_38(voltage, current)
+            sent[:] = [bytes(frame[12:16])]
+            return frame
+
+        for attempt in range(SETPOINT_RETRIES):
+            reply = await self.request(build)
+            if reply is not None and reply[3] == 0x20 and bytes(reply[12:16]) == sent[0]:
+                echo = LAYOUTS[0x20].decode(reply)
+                self.applied_voltage, self.applied_current = voltage, current
+                if echo is not None:
+                    self._log(f"Setpoint confirmed: {echo.voltage:.2f} V, {echo.current:.2f} A")
+                return True
+            if self._stop.is_set():
+                return False
+        self.setpoint_failures += 1
+        self._log(f"Setpoint {voltage:.2f} V, {current:.2f} A not confirmed")
+        return False
+
+    async def _session(self):
+        reply = await self.request(lambda: self.from_template(INITIAL_BYTES1), HANDSHAKE_RETRIES)
+        if reply is not None:
+            self.listener = reply[4]
+            self._log(f"Device: 0x{self.listener:02X}")
+        await self.request(lambda: self.from_template(INITIAL_BYTES2), HANDSHAKE_RETRIES)
+        self.state = 'running'
+
+        tasks = [asyncio.ensure_future(self._poll_loop()), asyncio.ensure_future(self._setpoint_loop())]
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        except Exception as e:
+            self.error = e
+            self._log(f"Error in serial communication: {e}")
+            self.state = 'error'
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        self.tracker.cancel_all()
+        self._log(f"Replies: {self.tracker.summary()}")
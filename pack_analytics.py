@@ -0,0 +1,298 @@
+"""
+Streaming cell analytics for expansion battery packs, from their 0x2D frames.
+
+Per pack (talker) the state is a handful of fixed size arrays, updated in
+O(1) per frame however long the pack is watched:
+    - pack voltage and signed current (positive is charging)
+    - per cell: last, min, max and mean voltage, the mean over the last
+      `window` frames (ring buffer with a running sum) and dV/dt
+      (exponentially smoothed over DVDT_TAU seconds)
+    - imbalance: max - min cell voltage, now and the largest seen
+    - coulomb counting: Ah in, Ah out and Wh, integrated from the current
+      (trapezoid rule, not across gaps longer than MAX_GAP)
+    - anomaly flags (see THRESHOLDS), counted when they are raised
+
+    monitor = PackMonitor(on_anomaly=print)
+    monitor.feed(frame, ts_ns)               # or bus.tap(monitor.tap)
+    monitor.packs[0xEC].summary()
+
+Usage:
+    python pack_analytics.py Data/serial_frames_*.sdccap [--window 300] [--json packs.json]
+"""
+
+import argparse
+import json
+import math
+import sys
+from array import array
+from datetime import datetime
+
+from frame_schema import LAYOUTS
+
+CELL_COUNT = 16
+# Frames in the rolling window
+WINDOW = 120
+# Smoothing time constant of dV/dt, in s
+DVDT_TAU = 60.0
+# Frames further apart than this (s) are not integrated over, and raise 'gap'
+MAX_GAP = 10.0
+
+# Limits in V and A. The defaults suit LiFePO4 cells.
+THRESHOLDS = {
+    'cell_high': 3.65,       # any cell above
+    'cell_low': 2.80,        # any cell below
+    'imbalance': 0.05,       # max - min cell above
+    'cell_step': 0.05,       # a cell moved more than this since the previous frame
+    'sum_mismatch': 0.25,    # sum of the cells differs from the pack voltage by more than this
+    'over_current': 30.0,    # |pack current| above
+}
+FLAGS = ('cell_high', 'cell_low', 'imbalance', 'cell_step', 'sum_mismatch', 'over_current', 'gap')
+
+LAYOUT_2D = LAYOUTS[0x2D]
+
+
+class PackStats:
+    """Running state of one pack."""
+
+    def __init__(self, talker, cells=CELL_COUNT, window=WINDOW, thresholds=None, offset_ns=0):
+        self.talker = talker
+        # Added to the frame timestamps for display: 0 for wall clock times, frame_bus offset_ns for monotonic ones
+        self.offset_ns = offset_ns
+        self.cell_count = cells
+        self.window = window
+        self.thresholds = dict(THRESHOLDS, **(thresholds or {}))
+        self.frames = 0
+        self.first_ns = None
+        self.last_ns = None
+        self.pack_voltage = None
+        self.pack_current = None
+        self.cells = array('d', [0.0]) * cells
+        self.cell_min = array('d', [math.inf]) * cells
+        self.cell_max = array('d', [-math.inf]) * cells
+        self.cell_sum = array('d', [0.0]) * cells
+        self.dvdt = array('d', [0.0]) * cells
+        # Ring buffer of the last `window` frames, cells x window, and the sum of each cell over it
+        self._ring = array('d', [0.0]) * (cells * window)
+        self._ring_pos = 0
+        self._ring_len = 0
+        self.window_sum = array('d', [0.0]) * cells
+        self.spread = 0.0
+        self.max_spread = 0.0
+        self.charge_in_ah = 0.0
+        self.charge_out_ah = 0.0
+        self.energy_wh = 0.0
+        self.flag_counts = dict.fromkeys(FLAGS, 0)
+        self.active = set()
+
+    def update(self, ts_ns, pack_voltage, pack_current, cells):
+        """Add one frame. Returns the flags raised by it (not those still active from before)."""
+        raised = set()
+        limits = self.thresholds
+        n = self.cell_count
+        dt = None if self.last_ns is None else (ts_ns - self.last_ns) / 1e9
+        if dt is not None and (dt > MAX_GAP or dt < 0):
+            raised.add('gap')
+            dt = None
+
+        if dt:
+            # Coulomb counting, trapezoid rule over the interval
+            current = (pack_current + self.pack_current) / 2
+            if current >= 0:
+                self.charge_in_ah += current * dt / 3600
+            else:
+                self.charge_out_ah -= current * dt / 3600
+            self.energy_wh += (pack_voltage * pack_current + self.pack_voltage * self.pack_current) / 2 * dt / 3600
+            alpha = 1 - math.exp(-dt / DVDT_TAU)
+
+        previous = self.cells
+        ring = self._ring
+        base = self._ring_pos * n
+        full = self._ring_len == self.window
+        low, high = math.inf, -math.inf
+        step_limit = limits['cell_step']
+        for i in range(n):
+            v = cells[i]
+            if self.frames:
+                if dt:
+                    self.dvdt[i] += alpha * ((v - previous[i]) / dt - self.dvdt[i])
+                if abs(v - previous[i]) > step_limit:
+                    raised.add('cell_step')
+            previous[i] = v
+            if v < self.cell_min[i]:
+                self.cell_min[i] = v
+            if v > self.cell_max[i]:
+                self.cell_max[i] = v
+            self.cell_sum[i] += v
+            if full:
+                self.window_sum[i] -= ring[base + i]
+            ring[base + i] = v
+            self.window_sum[i] += v
+            if v < low:
+                low = v
+            if v > high:
+                high = v
+        self._ring_pos = (self._ring_pos + 1) % self.window
+        if not full:
+            self._ring_len += 1
+
+        self.spread = high - low
+        if self.spread > self.max_spread:
+            self.max_spread = self.spread
+        if high > limits['cell_high']:
+            raised.add('cell_high')
+        if low < limits['cell_low']:
+            raised.add('cell_low')
+        if self.spread > limits['imbalance']:
+            raised.add('imbalance')
+        if abs(sum(cells[:n]) - pack_voltage) > limits['sum_mismatch']:
+            raised.add('sum_mismatch')
+        if abs(pack_current) > limits['over_current']:
+            raised.add('over_current')
+
+        self.pack_voltage = pack_voltage
+        self.pack_current = pack_current
+        if self.first_ns is None:
+            self.first_ns = ts_ns
+        self.last_ns = ts_ns
+        self.frames += 1
+
+        new = raised - self.active
+        for flag in new:
+            self.flag_counts[flag] += 1
+        self.active = raised
+        return new
+
+    def window_range(self, i):
+        """(min, max) of cell i over the window. O(window), for reports rather than every frame."""
+        n = self.cell_count
+        values = self._ring[i:self._ring_len * n:n]
+        return (min(values), max(values)) if values else (None, None)
+
+    def summary(self):
+        n = self.cell_count
+        frames = max(self.frames, 1)
+        window = max(self._ring_len, 1)
+
+        def wall_clock(ts_ns):
+            return None if ts_ns is None else datetime.fromtimestamp((ts_ns + self.offset_ns) / 1e9).isoformat(' ')
+
+        cells = []
+        for i in range(n):
+            window_min, window_max = self.window_range(i)
+            cells.append({
+                'voltage': self.cells[i],
+                'min': self.cell_min[i] if self.frames else None,
+                'max': self.cell_max[i] if self.frames else None,
+                'mean': self.cell_sum[i] / frames,
+                'window_mean': self.window_sum[i] / window,
+                'window_min': window_min,
+                'window_max': window_max,
+                'dvdt_mv_per_min': self.dvdt[i] * 1000 * 60,
+            })
+        return {
+            'talker': f"0x{self.talker:02X}",
+            'frames': self.frames,
+            'first': wall_clock(self.first_ns),
+            'last': wall_clock(self.last_ns),
+            'pack_voltage': self.pack_voltage,
+            'pack_current': self.pack_current,
+            'charge_in_ah': self.charge_in_ah,
+            'charge_out_ah': self.charge_out_ah,
+            'net_ah': self.charge_in_ah - self.charge_out_ah,
+            'energy_wh': self.energy_wh,
+            'spread': self.spread,
+            'max_spread': self.max_spread,
+            'cells': cells,
+            'flags': dict(self.flag_counts),
+            'active': sorted(self.active),
+        }
+
+
+class PackMonitor:
+    """
+    PackStats for every pack seen. on_anomaly(pack, flags) is called when a frame raises flags.
+    Live frames carry monotonic timestamps; set offset_ns to the bus's offset_ns to report wall clock times.
+    """
+
+    def __init__(self, window=WINDOW, thresholds=None, on_anomaly=None, offset_ns=0):
+        self.window = window
+        self.offset_ns = offset_ns
+        self.thresholds = thresholds
+        self.on_anomaly = on_anomaly
+        self.packs = {}
+        self.undecoded = 0
+
+    def feed(self, frame, ts_ns):
+        if len(frame) < 4 or frame[3] != 0x2D:
+            return None
+        record = LAYOUT_2D.decode(frame)
+        if record is None:
+            self.undecoded += 1
+            return None
+        pack = self.packs.get(record.talker)
+        if pack is None:
+            pack = self.packs[record.talker] = PackStats(record.talker, len(record.cell_voltages), self.window,
+                                                         self.thresholds, self.offset_ns)
+        raised = pack.update(ts_ns, record.pack_voltage, record.pack_current, record.cell_voltages)
+        if raised and self.on_anomaly is not None:
+            self.on_anomaly(pack, raised)
+        return pack
+
+    def tap(self, port, frames, ts_ns, direction):
+        """frame_bus tap."""
+        for frame in frames:
+            if len(frame) > 3 and frame[3] == 0x2D:
+                self.feed(frame, ts_ns)
+
+
+def format_pack(s):
+    """A few lines about one pack, for the console and the GUI."""
+    def value(v, fmt):
+        return '-' if v is None else format(v, fmt)
+
+    lines = [
+        f"Pack {s['talker']}: {value(s['pack_voltage'], '.3f')} V {value(s['pack_current'], '+.3f')} A, "
+        f"in {s['charge_in_ah']:.3f} Ah, out {s['charge_out_ah']:.3f} Ah, {s['energy_wh']:+.1f} Wh, "
+        f"spread {s['spread'] * 1000:.0f} mV (max {s['max_spread'] * 1000:.0f}), {s['frames']} frames",
+        "  cell      V     min     max    mean  dV/dt mV/min",
+    ]
+    for i, c in enumerate(s['cells']):
+        lines.append(f"  {i + 1:>4} {c['voltage']:6.3f} {value(c['min'], '7.3f')} {value(c['max'], '7.3f')} "
+                     f"{c['mean']:7.3f} {c['dvdt_mv_per_min']:+8.2f}")
+    flags = ', '.join(f"{flag} {count}" for flag, count in s['flags'].items() if count)
+    lines.append(f"  anomalies: {flags or 'none'}" + (f" (active: {', '.join(s['active'])})" if s['active'] else ''))
+    return '\n'.join(lines)
+
+
+def main():
+    from batch_report import find_files, iter_frames
+
+    parser = argparse.ArgumentParser(description="Cell analytics of the battery packs in logs and captures")
+    parser.add_argument('paths', nargs='+', help="files or glob patterns, read in order")
+    parser.add_argument('--window', type=int, default=WINDOW, help="frames in the rolling window")
+    parser.add_argument('--anomalies', action='store_true', help="print every anomaly as it is raised")
+    parser.add_argument('--json', help="write the summaries to this file")
+    args = parser.parse_args()
+
+    def show(pack, flags):
+        ts = datetime.fromtimestamp(pack.last_ns / 1e9).isoformat(' ', 'milliseconds')
+        print(f"{ts} pack 0x{pack.talker:02X}: {', '.join(sorted(flags))}")
+
+    monitor = PackMonitor(args.window, on_anomaly=show if args.anomalies else None)
+    for path in find_files(args.paths):
+        for ts_ns, frame, crc_ok in iter_frames(path):
+            if crc_ok:
+                monitor.feed(frame, ts_ns)
+    summaries = [pack.summary() for _, pack in sorted(monitor.packs.items())]
+    for s in summaries:
+        print(format_pack(s))
+    if not summaries:
+        print("No 0x2D frames found.")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summaries, f, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,94 +1,223 @@
-import serial, serial.tools.list_ports
-import time
-import sys
-
-def select_serial_port():
-    ports = list(serial.tools.list_ports.comports())
-    if not ports:
-        print("No serial ports available. ")
-        return None
-    
-    for i, port in enumerate(ports):
-        print(f"{i}: {port.device} - {port.description}")
-
-    while True:
-        choice = input(f"Select port [0-{len(ports)-1}]: ")
-        if choice.isdigit():
-            idx = int(choice)
-            if 0<= idx < len(ports):
-                return ports[idx].device
-        print("Invalid selection. Please try again. ")
-
-def parse_file(filename):
-    messages = []
-    with open(filename, 'r') as f:
-        for line in f:
-            parts = line.strip().split('\t')
-            if len(parts) < 2:
-                continue
-            timestamp = int(parts[0])
-            data = bytearray(int(b, 16) for b in parts[1:])
-            messages.append((timestamp, data))
-    return messages
-
-def read_frame(ser, timeout=0.6):
-    """Read a frame starting with 0x55, where the second byte is the length."""
-    start_time = time.time()
-    while True:
-        if time.time() - start_time > timeout:
-            return None
-        byte = ser.read(1)
-        if not byte:
-            continue
-        if byte[0] == 0x55:
-            length_byte = ser.read(1)
-            if not length_byte:
-                return None
-            frame_length = length_byte[0]
-            rest = ser.read(frame_length - 2)
-            if len(rest) != frame_length - 2:
-                return None
-            frame = bytearray([0x55, frame_length]) + rest
-            return frame
-
-def replay_messages(messages, com_port, baudrate=115200):
-    ser = serial.Serial(com_port, baudrate, timeout=0.1)
-    try:
-        base_time = messages[0][0]
-        replay_start = time.time()
-        for i, (timestamp, data) in enumerate(messages):
-            target_time = replay_start + (timestamp - base_time) / 1000.0
-            now = time.time()
-            sleep_time = target_time - now
-            if sleep_time > 0:
-                time.sleep(sleep_time)
-            # Send command
-            if data[4] == 0xAB:
-                ser.write(data)
-                print(f"Sent at {timestamp}: {data.hex(' ')}")
-
-            # Listen for response frame
-            frame = read_frame(ser)
-            if frame:
-                print(f"Received response: {frame.hex(' ')}")
-    finally:
-        ser.close()
-        print("COM port closed.")
-
-
-if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        filename = sys.argv[1]
-    else:
-        print("Usage: python replay.py xxx.txt.")
-        exit()
-
-    com_port = select_serial_port()
-    
-    messages = parse_file(filename)
-    if messages:
-        print(f"Loaded {len(messages)} messages. Starting replay...")
-
-        replay_messages(messages, com_port, 115200)
-    else:
-        print("No valid messages found in the file.")
\ No newline at end of file
+import argparse
+import serial, serial.tools.list_ports
+import sys
+import threading
+import time
+from array import array
+
+from archive import ArchiveReader, is_archive_file
+from capture import CaptureReader, is_capture_file
+from capture_index import parse_time, query
+from crc16 import check_frame
+from frame_decoder import FrameDecoder
+from metrics import Metrics, serve
+
+def select_serial_port():
+    ports = list(serial.tools.list_ports.comports())
+    if not ports:
+        print("No serial ports available. ")
+        return None
+    
+    for i, port in enumerate(ports):
+        print(f"{i}: {port.device} - {port.description}")
+
+    while True:
+        choice = input(f"Select port [0-{len(ports)-1}]: ")
+        if choice.isdigit():
+            idx = int(choice)
+            if 0<= idx < len(ports):
+                return ports[idx].device
+        print("Invalid selection. Please try again. ")
+
+def parse_file(filename, talkers=None, class_bs=None, start_ns=None, end_ns=None, bad_crc=False):
+    """
+    Yield (timestamp ms, frame) from a text log, a capture file or an archive, one at a time.
+    With filters, a capture is read through its index so only the matching frames are touched.
+    Archives are decompressed a block at a time, skipping blocks outside the time range.
+    Frames with a bad CRC are skipped in every format unless bad_crc is set.
+    """
+    if is_archive_file(filename):
+        with ArchiveReader(filename) as reader:
+            for ts_ns, port, direction, crc_ok, frame in reader.frames(start_ns, end_ns):
+                if (crc_ok or bad_crc) and len(frame) > 4 and (not talkers or frame[4] in talkers) \
+                        and (not class_bs or frame[3] in class_bs):
+                    yield ts_ns // 1_000_000, frame
+        return
+    if is_capture_file(filename):
+        if talkers or class_bs or start_ns is not None or end_ns is not None:
+            for ts_ns, port, direction, crc_ok, frame in query(filename, class_bs or None, talkers or None,
+                                                               start_ns=start_ns, end_ns=end_ns):
+                if crc_ok or bad_crc:
+                    yield ts_ns // 1_000_000, frame
+            return
+        with CaptureReader(filename) as reader:
+            for ts_ns, port, direction, crc_ok, frame in reader:
+                if crc_ok or bad_crc:
+                    yield ts_ns // 1_000_000, frame
+        return
+    with open(filename, 'r') as f:
+        for line in f:
+            parts = line.strip().split('\t')
+            if len(parts) < 2:
+                continue
+            timestamp = int(parts[0])
+            if start_ns is not None and timestamp * 1_000_000 < start_ns:
+                continue
+            if end_ns is not None and timestamp * 1_000_000 >= end_ns:
+                continue
+            data = bytes.fromhex(''.join(b[2:] for b in parts[1:]))
+            if bad_crc or check_frame(data):
+                yield timestamp, data
+
+class ReplayScheduler:
+    """
+    Turns capture timestamps into send times on the monotonic clock.
+    Sleeps until spin seconds before the target, then spins for the rest.
+    speed 2.0 plays twice as fast, 0 sends as fast as possible.
+    """
+
+    def __init__(self, speed=1.0, spin=0.001):
+        self.speed = speed
+        self.spin = spin
+        self.base_ms = None
+        self.start = None
+        self.lateness = array('d')
+
+    def wait(self, timestamp_ms):
+        """Block until the send time of a frame recorded at timestamp_ms."""
+        now = time.perf_counter()
+        if self.base_ms is None:
+            self.base_ms = timestamp_ms
+            self.start = now
+        if not self.speed:
+            return
+        target = self.start + (timestamp_ms - self.base_ms) / 1000.0 / self.speed
+        remaining = target - now
+        if remaining > self.spin:
+            time.sleep(remaining - self.spin)
+        while time.perf_counter() < target:
+            pass
+        self.lateness.append(time.perf_counter() - target)
+
+    def jitter(self):
+        """Send time error statistics in ms, None when nothing was scheduled."""
+        if not self.lateness:
+            return None
+        values = sorted(self.lateness)
+        count = len(values)
+        return {
+            'count': count,
+            'mean_ms': sum(values) / count * 1000,
+            'p50_ms': values[count // 2] * 1000,
+            'p99_ms': values[min(count - 1, int(count * 0.99))] * 1000,
+            'max_ms': values[-1] * 1000,
+        }
+
+
+def capture_replies(ser, decoder, stop_event, replies, quiet=False, port_metrics=None):
+    """Reader thread: collect reply frames while the main thread keeps sending."""
+    while not stop_event.is_set():
+        try:
+            data = ser.read(ser.in_waiting or 1)
+        except serial.SerialException as e:
+            print(f"Read error: {e}")
+            return
+        frames = decoder.feed(data)
+        if port_metrics is not None:
+            port_metrics.count(frames)
+        for frame in frames:
+            replies.append((time.perf_counter(), frame))
+            if not quiet:
+                print(f"Received response: {frame.hex(' ')}")
+
+
+def replay_messages(messages, com_port, baudrate=115200, speed=1.0, talkers=(0xAB,), class_bs=None,
+                    spin=0.001, linger=0.6, quiet=False, metrics=None):
+    """
+    Replay an iterable of (timestamp ms, frame), starting as soon as the first one is available.
+    Only frames from talkers (and with a Class_B in class_bs, if given) are sent.
+    Replies are read by a separate thread so dense traffic keeps its original timing.
+    Sent and received frames are counted in metrics (a metrics.Metrics), if given.
+    """
+    ser = serial.Serial(com_port, baudrate, timeout=0.1)
+    decoder = FrameDecoder()
+    scheduler = ReplayScheduler(speed, spin)
+    replies = []
+    port_metrics = None
+    if metrics is not None:
+        port_metrics = metrics.port(com_port)
+        metrics.add_decoder(com_port, decoder)
+    stop_event = threading.Event()
+    reader = threading.Thread(target=capture_replies, args=(ser, decoder, stop_event, replies, quiet, port_metrics), daemon=True)
+    reader.start()
+    count = 0
+    sent = 0
+    try:
+        for timestamp, data in messages:
+            count += 1
+            if len(data) < 5:
+                continue
+            if talkers and data[4] not in talkers:
+                continue
+            if class_bs and data[3] not in class_bs:
+                continue
+            scheduler.wait(timestamp)
+            ser.write(data)
+            sent += 1
+            if port_metrics is not None:
+                port_metrics.count((data,), 'tx')
+            if not quiet:
+                print(f"Sent at {timestamp}: {data.hex(' ')}")
+        # Late replies to the last frames
+        time.sleep(linger)
+    finally:
+        stop_event.set()
+        reader.join(timeout=1)
+        ser.close()
+        if decoder.dropped_bytes:
+            print(f"Dropped {decoder.dropped_bytes} bytes ({decoder.crc_errors} CRC errors) while receiving.")
+        print(f"Read {count} messages, sent {sent}, received {len(replies)} replies. COM port closed.")
+        jitter = scheduler.jitter()
+        if jitter:
+            print(f"Send timing error: mean {jitter['mean_ms']:.3f} ms, p50 {jitter['p50_ms']:.3f} ms, "
+                  f"p99 {jitter['p99_ms']:.3f} ms, max {jitter['max_ms']:.3f} ms")
+    return replies
+
+
+def parse_byte_list(text):
+    """'0xAB,0xEB' -> (0xAB, 0xEB). Empty string means no filter."""
+    return tuple(int(value, 0) for value in text.split(',') if value.strip())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a serial capture with its original timing")
+    parser.add_argument('filename', help="xxx.txt, xxx.sdccap or xxx.sdcarc")
+    parser.add_argument('--port', help="serial port to replay to (asks when not given)")
+    parser.add_argument('--baud', type=int, default=115200)
+    parser.add_argument('--speed', type=float, default=1.0, help="time multiplier, e.g. 0.5 or 10. 0 = as fast as possible")
+    parser.add_argument('--talker', default='0xAB', help="comma separated talker ids to send, '' for all")
+    parser.add_argument('--class-b', default='', help="comma separated Class_B values to send, default all")
+    parser.add_argument('--start', type=parse_time, help="only frames from this time on (ISO time or epoch seconds)")
+    parser.add_argument('--end', type=parse_time, help="only frames before this time")
+    parser.add_argument('--spin-ms', type=float, default=1.0, help="busy-wait this long before each send for precise timing")
+    parser.add_argument('--linger', type=float, default=0.6, help="seconds to keep listening after the last frame")
+    parser.add_argument('--quiet', action='store_true', help="don't print every frame")
+    parser.add_argument('--bad-crc', action='store_true', help="also replay frames recorded with a bad CRC")
+    parser.add_argument('--metrics-port', type=int, help="serve Prometheus metrics on this localhost port")
+    args = parser.parse_args()
+
+    com_port = args.port or select_serial_port()
+    if com_port is None:
+        sys.exit(1)
+
+    metrics = None
+    if args.metrics_port:
+        metrics = Metrics()
+        serve(metrics, args.metrics_port)
+
+    print("Starting replay...")
+    talkers = parse_byte_list(args.talker)
+    class_bs = parse_byte_list(args.class_b)
+    messages = parse_file(args.filename, talkers, class_bs, args.start, args.end, args.bad_crc)
+    replay_messages(messages, com_port, args.baud, speed=args.speed, talkers=talkers, class_bs=class_bs,
+                    spin=args.spin_ms / 1000, linger=args.linger, quiet=args.quiet, metrics=metrics)
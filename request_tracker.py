@@ -0,0 +1,161 @@
+"""
+Pair requests with their replies using the 16-bit sequence number.
+
+The power unit and the peripheral echo the same sequence number (bytes 6-7)
+in a request and its reply, and the reply swaps talker and listener. A
+request sent to listener 0x00 (before the device id is known) is matched by
+any talker that answers with the right sequence number.
+
+    tracker = RequestTracker()
+    future = tracker.expect(frame, timeout=0.2)
+    port.write(frame)
+    reply = await future        # the reply frame, or None after the timeout
+
+    # in the receive callback
+    tracker.match(frame)
+"""
+
+import asyncio
+import time
+from collections import deque
+
+SEQUENCE_MASK = 0xFFFF
+
+
+def next_sequence(sequence):
+    """Next sequence number. Wraps from 0xFFFF to 0x0001, the power unit starts counting at 1."""
+    sequence = (sequence + 1) & SEQUENCE_MASK
+    return sequence or 1
+
+
+def sequence_gap(previous, current):
+    """How far current is ahead of previous, modulo 16 bits (1 means no gap)."""
+    return (current - previous) & SEQUENCE_MASK
+
+
+def frame_key(frame):
+    """(talker, listener, sequence) of a frame."""
+    return frame[4], frame[5], frame[6] | (frame[7] << 8)
+
+
+class PendingRequest:
+    __slots__ = ('key', 'class_b', 'sent_ns', 'future', 'timer')
+
+    def __init__(self, key, class_b, sent_ns, future, timer):
+        self.key = key
+        self.class_b = class_b
+        self.sent_ns = sent_ns
+        self.future = future
+        self.timer = timer
+
+
+class RequestTracker:
+    """Table of requests waiting for a reply, with round trip latency statistics."""
+
+    def __init__(self, history=1000):
+        self.pending = {}
+        self.sent = 0
+        self.answered = 0
+        self.timeouts = 0
+        self.late = 0
+        self.unmatched = 0
+        self.latencies_ms = deque(maxlen=history)
+        self.min_latency_ms = None
+        self.max_latency_ms = None
+        self.total_latency_ms = 0.0
+        # Optional metrics.Histogram of latencies in seconds
+        self.histogram = None
+        # Keys of requests that timed out recently, to count replies that arrive too late
+        self._expired = deque(maxlen=64)
+
+    def expect(self, frame, timeout):
+        """Register a request frame before sending it. Returns a future giving the reply or None on timeout."""
+        loop = asyncio.get_running_loop()
+        key = frame_key(frame)
+        old = self.pending.pop(key, None)
+        if old is not None:
+            # Same key still pending after 65535 requests: the old one can never be answered now
+            self._expire(old)
+        future = loop.create_future()
+        timer = loop.call_later(timeout, self._timeout, key)
+        self.pending[key] = PendingRequest(key, frame[3], time.monotonic_ns(), future, timer)
+        self.sent += 1
+        return future
+
+    def match(self, frame, ts_ns=None):
+        """Match a received frame against the pending requests. Returns the request it answers, or None."""
+        if len(frame) < 8:
+            return None
+        talker, listener, sequence = frame_key(frame)
+        request = self.pending.pop((listener, talker, sequence), None)
+        if request is None:
+            # Request was sent to listener 0x00 before the device id was known
+            request = self.pending.pop((listener, 0x00, sequence), None)
+        if request is None:
+            if (listener, talker, sequence) in self._expired or (listener, 0x00, sequence) in self._expired:
+                self.late += 1
+            else:
+                self.unmatched += 1
+            return None
+        request.timer.cancel()
+        if ts_ns is None:
+            ts_ns = time.monotonic_ns()
+        latency_ms = (ts_ns - request.sent_ns) / 1e6
+        self.answered += 1
+        self.latencies_ms.append(latency_ms)
+        self.total_latency_ms += latency_ms
+        if self.histogram is not None:
+            self.histogram.observe(latency_ms / 1000)
+        if self.min_latency_ms is None or latency_ms < self.min_latency_ms:
+            self.min_latency_ms = latency_ms
+        if self.max_latency_ms is None or latency_ms > self.max_latency_ms:
+            self.max_latency_ms = latency_ms
+        if not request.future.done():
+            request.future.set_result(frame)
+        return request
+
+    def _timeout(self, key):
+        request = self.pending.pop(key, None)
+        if request is not None:
+            self.timeouts += 1
+            self._expire(request)
+
+    def _expire(self, request):
+        request.timer.cancel()
+        self._expired.append(request.key)
+        if not request.future.done():
+            request.future.set_result(None)
+
+    def cancel_all(self):
+        for request in list(self.pending.values()):
+            self._expire(request)
+        self.pending.clear()
+
+    def stats(self):
+        recent = sorted(self.latencies_ms)
+
+        def percentile(p):
+            if not recent:
+                return None
+            return recent[min(len(recent) - 1, int(p * len(recent)))]
+
+        return {
+            'sent': self.sent,
+            'answered': self.answered,
+            'timeouts': self.timeouts,
+            'late': self.late,
+            'unmatched': self.unmatched,
+            'pending': len(self.pending),
+            'min_ms': self.min_latency_ms,
+            'mean_ms': self.total_latency_ms / self.answered if self.answered else None,
+            'p50_ms': percentile(0.5),
+            'p99_ms': percentile(0.99),
+            'max_ms': self.max_latency_ms,
+        }
+
+    def summary(self):
+        s = self.stats()
+        if not s['answered']:
+            return f"{s['sent']} requests, no replies ({s['timeouts']} timeouts)"
+        return (f"{s['sent']} requests, {s['answered']} replies, {s['timeouts']} timeouts, {s['late']} late, "
+                f"latency min {s['min_ms']:.1f} / p50 {s['p50_ms']:.1f} / p99 {s['p99_ms']:.1f} / max {s['max_ms']:.1f} ms")
@@ -0,0 +1,136 @@
+"""
+Headless service: capture ports and emulate power units from one process,
+without tkinter, until SIGINT or SIGTERM.
+
+    python sdc_daemon.py --capture /dev/ttyUSB0 /dev/ttyUSB1 --host /dev/ttyACM0
+    python sdc_daemon.py --config logger.json
+    python sdc_daemon.py --capture /dev/ttyACM0 --host /dev/ttyACM0 --clients-port 9110
+
+The config file uses the mppt_controller.py format for the host sessions,
+plus a "capture" section and the metrics port:
+
+    {
+        "metrics_port": 9108,
+        "capture": {"ports": ["/dev/ttyUSB0"], "out": "Data/serial_frames_",
+                    "rotate_bytes": 268435456, "hourly": true},
+        "voltage": 52.2, "current": 7.65,
+        "sessions": [{"port": "/dev/ttyACM0", "name": "mppt1"}]
+    }
+
+All ports are read through one frame bus (frame_bus.py), so a port can be
+captured and driven by a host session at the same time, and local clients
+can follow the live traffic on --clients-port / --clients-socket (or
+"clients_port" / "clients_socket" in the config).
+
+On a signal every session finishes its current request and the capture and
+session logs are flushed and closed before the process exits.
+"""
+
+import argparse
+import asyncio
+import json
+import signal
+
+from capture import CAPTURE_EXT, CaptureLogWriter
+from frame_bus import FrameBus, serve_clients
+from metrics import Metrics, serve
+from mppt_controller import REPORT_INTERVAL, Controller, load_config, make_sessions
+from serial_log import OUTPUT_FILE_PFX, ROTATE_BYTES, capture_ports
+
+
+async def run(capture_names, capture_options, sessions, metrics=None, report_interval=REPORT_INTERVAL, bus=None,
+              clients_port=None, clients_socket=None):
+    stop = asyncio.Event()
+    if bus is None:
+        bus = FrameBus()
+    controller = Controller(sessions, report_interval)
+
+    def shutdown():
+        print("Stopping...")
+        stop.set()
+        controller.stop()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, shutdown)
+
+    tasks = []
+    writer = None
+    if capture_names:
+        writer = CaptureLogWriter(capture_options['out'] + "{time}z" + CAPTURE_EXT, index=True,
+                                  rotate_bytes=capture_options['rotate_bytes'],
+                                  rotate_hourly=capture_options['hourly']).start()
+        if metrics is not None:
+            metrics.add_writer("capture", writer)
+        tasks.append(capture_ports(capture_names, writer, metrics, stop, bus))
+    elif metrics is not None:
+        metrics.add_bus("daemon", bus)
+    server = None
+    if clients_port or clients_socket:
+        server = await serve_clients(bus, clients_port, path=clients_socket)
+    if sessions:
+        tasks.append(controller.run(signals=False))
+    print(f"Running: {len(capture_names)} capture ports, {len(sessions)} host sessions. Stop with Ctrl-C or SIGTERM.")
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        if server is not None:
+            server.close()
+        bus.close()
+        if writer is not None:
+            writer.close()
+            print(f"Captured to {', '.join(writer.paths)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless capture and power unit emulation")
+    parser.add_argument('--config', help="JSON file, see the module docstring")
+    parser.add_argument('--capture', nargs='*', default=[], help="ports to capture")
+    parser.add_argument('--host', nargs='*', default=[], help="ports to run a power unit session on")
+    parser.add_argument('--voltage', type=float, default=52.20, help="host target voltage in V")
+    parser.add_argument('--current', type=float, default=7.65, help="host target current in A")
+    parser.add_argument('--out', default=OUTPUT_FILE_PFX, help="capture file prefix")
+    parser.add_argument('--rotate-bytes', type=int, default=ROTATE_BYTES)
+    parser.add_argument('--hourly', action='store_true')
+    parser.add_argument('--metrics-port', type=int, help="Prometheus endpoint port")
+    parser.add_argument('--report-interval', type=float, default=REPORT_INTERVAL)
+    parser.add_argument('--clients-port', type=int, help="stream live frames to localhost TCP clients on this port")
+    parser.add_argument('--clients-socket', help="stream live frames to clients on this Unix socket")
+    args = parser.parse_args()
+
+    capture_names = list(args.capture)
+    capture_options = {'out': args.out, 'rotate_bytes': args.rotate_bytes, 'hourly': args.hourly}
+    entries = []
+    metrics_port = args.metrics_port
+    clients_port, clients_socket = args.clients_port, args.clients_socket
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+        section = config.get('capture', {})
+        capture_names += section.get('ports', [])
+        capture_options['out'] = section.get('out', capture_options['out'])
+        capture_options['rotate_bytes'] = section.get('rotate_bytes', capture_options['rotate_bytes'])
+        capture_options['hourly'] = section.get('hourly', capture_options['hourly'])
+        if metrics_port is None:
+            metrics_port = config.get('metrics_port')
+        clients_port = clients_port or config.get('clients_port')
+        clients_socket = clients_socket or config.get('clients_socket')
+        entries += load_config(args.config)
+    defaults = {'voltage': args.voltage, 'current': args.current}
+    entries = [dict(defaults, **entry) for entry in entries]
+    entries += [dict(defaults, port=port) for port in args.host]
+    if not capture_names and not entries:
+        parser.error("nothing to do, give --capture, --host or --config")
+
+    metrics = None
+    if metrics_port:
+        metrics = Metrics()
+        serve(metrics, metrics_port)
+    bus = FrameBus()
+    sessions = make_sessions(entries, metrics, bus=bus)
+    asyncio.run(run(capture_names, capture_options, sessions, metrics, args.report_interval, bus,
+                    clients_port, clients_socket))
+
+
+if __name__ == "__main__":
+    main()
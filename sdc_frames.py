@@ -0,0 +1,63 @@
+"""
+Frame constants and builders shared by the host, the simulators and the benchmarks.
+
+Builders return frames without the CRC, pass them through
+crc16.add_crc16_checksum() before sending.
+"""
+
+START_BYTE = 0x55
+CLASS_A = 0x04
+POWER_UNIT_ID = 0xAB
+MPPT_ID = 0xEB
+# Not seen on a real pack yet, any id works with the tools
+BATTPAK_ID = 0xEC
+
+# Byte 8
+DIR_FROM_POWER_UNIT = 0x40
+DIR_TO_POWER_UNIT = 0x80
+DIR_BROADCAST = 0x00
+
+HEADER_LEN = 10
+CRC_LEN = 2
+
+INITIAL_BYTES1 = bytes([0x55, 0x0E, 0x04, 0x66, 0xAB, 0x00, 0x01, 0x00, 0x40, 0x00, 0x01, 0x01])
+INITIAL_BYTES2 = bytes([0x55, 0x0E, 0x04, 0x66, 0xAB, 0xEB, 0x01, 0x00, 0x40, 0x5A, 0x01, 0x01])
+
+FRAME_66 =       bytes([0x55, 0x0E, 0x04, 0x66, 0xAB, 0xEB, 0x01, 0x00, 0x40, 0x5A, 0x02, 0x01])
+
+
+def set_sequence(data: bytes, sequence, listener) -> bytes:
+    """Copy of a frame template with the listener (byte 5) and sequence number (bytes 6-7) filled in."""
+    if len(data) < 8:
+        raise ValueError("Data frame is too short to update sequence number.")
+    frame = bytearray(data)
+    frame[5] = listener
+    frame[6] = sequence & 0xFF
+    frame[7] = (sequence >> 8) & 0xFF
+    return bytes(frame)
+
+
+def build_frame(class_b, talker, listener, sequence, direction, payload, byte9=0x5A) -> bytes:
+    """Build a frame from its header fields and payload. The length byte counts the CRC that is added later."""
+    length = HEADER_LEN + len(payload) + CRC_LEN
+    if length > 0xFF:
+        raise ValueError(f"Frame too long: {length} bytes")
+    header = bytes([START_BYTE, length, CLASS_A, class_b, talker, listener,
+                    sequence & 0xFF, (sequence >> 8) & 0xFF, direction, byte9])
+    return header + bytes(payload)
+
+
+def build_frame_38(listener, sequence, voltage, current) -> bytes:
+    """0x38 from the power unit: max voltage (V) and current (A) the charger may output."""
+    payload = bytearray()
+    payload.append(0x03)  # 10: fixed byte
+    payload.append(0x01)  # 11: Charging enable?
+    # Voltage in x0.01V, current in x0.01A (2 bytes each). Rounded, int() would turn 0.29 into 0.28
+    payload.extend(round(voltage * 100).to_bytes(2, byteorder='little'))
+    payload.extend(round(current * 100).to_bytes(2, byteorder='little'))
+    payload.append(0x01)  # 16: charging enable?
+    payload.append(0x01)  # 17: is charging?
+    payload.append(0x00)  # 18: fixed byte
+    payload.append(0x71)  # 19: bitwise flags?
+    payload.append(0x01)  # 20: is charging?
+    return build_frame(0x38, POWER_UNIT_ID, listener, sequence, DIR_FROM_POWER_UNIT, payload)
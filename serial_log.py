@@ -1,16 +1,37 @@
-import serial, serial.tools.list_ports
+import argparse
+import asyncio
+import signal
 import threading
 import time
-from datetime import datetime, timezone
-import tkinter as tk
-from tkinter import scrolledtext
+
+from capture import CAPTURE_EXT, DIR_TX, CaptureLogWriter
+from frame_bus import FrameBus, serve_clients
+from frame_decoder import FrameDecoder
+from frame_schema import decode
+from gui_refresh import GuiRefresher
+from metrics import Metrics, serve
+from pack_analytics import PackMonitor, format_pack
 
 BAUDRATE = 115200
 OUTPUT_FILE_PFX = 'Data/serial_frames_'
+# Start a new capture file after this many bytes (0 = never) and/or every hour
+ROTATE_BYTES = 256 * 1024 * 1024
+ROTATE_HOURLY = False
 # Supported DEVICEMODE are MPPT3 or BATTPAK for now
 DEVICEMODE = "MPPT3"
+# GUI redraw period and how many lines each payload pane keeps
+GUI_REFRESH_MS = 66
+MAX_PANE_LINES = 500
+# Frames waiting for the GUI; when it falls behind the oldest are dropped, the capture is not affected
+GUI_QUEUE = 2000
+GUI_CLASS_BS = {"MPPT3": (0x38, 0x9C), "BATTPAK": (0xFC, 0x2D)}
+# How often the GUI redraws the pack analytics, in refreshes
+PACK_REFRESH_TICKS = 15
+# Prometheus metrics on http://127.0.0.1:METRICS_PORT/metrics (e.g. 9108), off unless set or --metrics-port is given
+METRICS_PORT = None
 
 def select_serial_ports():
+    import serial.tools.list_ports
     ports = list(serial.tools.list_ports.comports())
     if not ports:
         print("No serial ports available. ")
@@ -40,36 +61,94 @@ def select_serial_ports():
     return selected_ports
 
 
-def read_serial(port_name, file_lock):
-    ser = serial.Serial(port_name, BAUDRATE, timeout=0.6)
-    buffer = bytearray()
-    while True:
-        data = ser.read(1)
-        if not data:
-            continue
-        byte = data[0]
-        if len(buffer) == 0:
-            if byte == 0x55:
-                buffer.append(byte)
-        elif len(buffer) == 1:
-            frame_len = data[0]
-            buffer.append(frame_len)
-            while len(buffer) < frame_len:
-                next_bytes = ser.read(frame_len - len(buffer))
-                if next_bytes:
-                    buffer.extend(next_bytes)
-            # Frame complete
-            parse_frame(buffer)
-            timestamp = int(time.time() * 1000)
-            with file_lock:
-                with open(OUTPUT_FILE, 'a') as f:
-                    line = f"{timestamp}\t" + '\t'.join(f"0x{b:02X}" for b in buffer) + '\n'
-                    f.write(line)
-            buffer.clear()
-        else:
-            buffer.clear()  # Reset if out of sync
-
-def parse_frame(frame):
+async def capture_ports(port_names, writer, metrics=None, stop=None, bus=None, clients_port=None, clients_socket=None,
+                        packs=None):
+    """
+    Read every port on the running loop until stop is set and log the frames as they arrive.
+    The ports are read through a frame bus (a new one unless given) that the writer, metrics and the
+    pack monitor (if given) tap; the GUI and socket clients subscribe to it.
+    """
+    if bus is None:
+        bus = FrameBus()
+    port_ids = {name: writer.port_id(name) for name in port_names}
+    decoders = {name: FrameDecoder() for name in port_names}
+    port_metrics = {}
+    if metrics is not None:
+        metrics.add_bus("capture", bus)
+        if packs is not None:
+            metrics.add_packs(packs)
+        for name in port_names:
+            port_metrics[name] = metrics.port(name)
+            metrics.add_decoder(name, decoders[name])
+
+    def log_frames(port, frames, ts_ns, direction):
+        port_id = port_ids.get(port)
+        if port_id is None:
+            return  # Another port on a shared bus
+        writer.write_many(frames, port_id, direction, ts_ns=ts_ns)
+        if port_metrics:
+            port_metrics[port].count(frames, 'tx' if direction == DIR_TX else 'rx')
+
+    bus.tap(log_frames)
+    if packs is not None:
+        # A tap rather than a subscription: the coulomb counting must not lose frames
+        packs.offset_ns = bus.offset_ns
+        bus.tap(packs.tap)
+    server = None
+    if clients_port or clients_socket:
+        server = await serve_clients(bus, clients_port, path=clients_socket)
+        print(f"Frame bus clients on {clients_socket or f'127.0.0.1:{clients_port}'}")
+    try:
+        ports = await bus.run(port_names, stop, BAUDRATE, decoders)
+    finally:
+        bus.untap(log_frames)
+        if packs is not None:
+            bus.untap(packs.tap)
+        if server is not None:
+            server.close()
+    for port in ports:
+        stats = port.decoder.stats()
+        print(f"{port.path} closed ({port.error}): {stats['frames']} frames, {stats['dropped_bytes']} bytes dropped")
+
+
+def read_serial(port_names, writer, metrics=None, bus=None, clients_port=None, clients_socket=None, packs=None):
+    """Reader thread of the GUI: all ports on one asyncio loop."""
+    asyncio.run(capture_ports(port_names, writer, metrics, bus=bus, clients_port=clients_port,
+                              clients_socket=clients_socket, packs=packs))
+
+
+def print_anomaly(pack, flags):
+    print(f"Pack 0x{pack.talker:02X}: {', '.join(sorted(flags))}")
+
+
+async def run_headless(port_names, writer, metrics=None, clients_port=None, clients_socket=None, packs=None):
+    """Capture without a GUI until SIGINT or SIGTERM."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    print(f"Capturing {', '.join(port_names)}, stop with Ctrl-C or SIGTERM")
+    await capture_ports(port_names, writer, metrics, stop, clients_port=clients_port, clients_socket=clients_socket,
+                        packs=packs)
+    if packs is not None:
+        for _, pack in sorted(packs.packs.items()):
+            print(format_pack(pack.summary()))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Capture frames from one or more SDC serial ports")
+    parser.add_argument('ports', nargs='*', help="serial ports to capture (asks when not given)")
+    parser.add_argument('--headless', action='store_true', help="no GUI, capture until SIGINT/SIGTERM")
+    parser.add_argument('--mode', choices=('MPPT3', 'BATTPAK'), default=DEVICEMODE, help="frames shown in the GUI")
+    parser.add_argument('--out', default=OUTPUT_FILE_PFX, help=f"capture file prefix (default {OUTPUT_FILE_PFX})")
+    parser.add_argument('--rotate-bytes', type=int, default=ROTATE_BYTES, help="start a new file after this many bytes, 0 = never")
+    parser.add_argument('--hourly', action='store_true', default=ROTATE_HOURLY, help="start a new file every hour")
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT, help="serve Prometheus metrics on this localhost port, e.g. 9108")
+    parser.add_argument('--clients-port', type=int, help="stream live frames to localhost TCP clients on this port")
+    parser.add_argument('--clients-socket', help="stream live frames to clients on this Unix socket")
+    return parser.parse_args()
+
+def parse_frame(frame, ts_ns=None):
     if frame[0] != 0x55:
         return None
     if len(frame) != frame[1]:
@@ -77,52 +156,84 @@ def parse_frame(frame):
     
     if DEVICEMODE == "MPPT3":
         if frame[3] == 0x38:
-            payload_text = ' '.join(f'{byte:02X}' for byte in frame)
-            text_area_38.insert(tk.END, f'Payload: {payload_text}\n')
-            text_area_38.see(tk.END)
+            payload_text = frame.hex(' ').upper()
+            ui.append(text_area_38, f'Payload: {payload_text}')
 
-            request_voltage_var.set(f"Voltage: {(int.from_bytes(frame[12:14], byteorder='little') * 0.01):.2f} V")
-            request_current_var.set(f"Current: {(int.from_bytes(frame[14:16], byteorder='little') * 0.01):.2f} A")
+            record = decode(frame)
+            if record is None:
+                return None
+            ui.set(request_voltage_var, f"Voltage: {record.voltage:.2f} V")
+            ui.set(request_current_var, f"Current: {record.current:.2f} A")
         elif frame[3] == 0x9C:
-            payload_text = ' '.join(f'{byte:02X}' for byte in frame)
-            text_area_9C.insert(tk.END, f'Payload: {payload_text}\n')
-            text_area_9C.see(tk.END)
-
-            output_voltage  = int.from_bytes(frame[16:18], byteorder='little') * 0.01
-            output_current  = int.from_bytes(frame[18:20], byteorder='little') * 0.01
-            temperature     = int.from_bytes(frame[28:30], byteorder='little') * 0.1
-            input_voltage_1 = int.from_bytes(frame[30:32], byteorder='little') * 0.01
-            input_voltage_2 = int.from_bytes(frame[32:34], byteorder='little') * 0.01
-            input_voltage_3 = int.from_bytes(frame[34:36], byteorder='little') * 0.01
-
-            byte2021_var.set(f"Byte20 21: {int.from_bytes(frame[20:22], byteorder='little')}")
-            byte2223_var.set(f"Byte22 23: {int.from_bytes(frame[22:24], byteorder='little')}")
-            byte2627_var.set(f"Input Power: {int.from_bytes(frame[26:28], byteorder='little')}")
-
-            output_power_var.set(f"Output Power(Calculated): {(output_voltage*output_current):.2f} W")
-            output_voltage_var.set(f"Output Voltage: {output_voltage:.2f} V")
-            output_current_var.set(f"Output Current: {output_current:.2f} A")
-            temperature_var.set(f"Temperature: {temperature:.1f} C")
-            input_voltage_1_var.set(f"Input Voltage 1: {input_voltage_1:.2f} V")
-            input_voltage_2_var.set(f"Input Voltage 2: {input_voltage_2:.2f} V")
-            input_voltage_3_var.set(f"Input Voltage 3: {input_voltage_3:.2f} V")
+            payload_text = frame.hex(' ').upper()
+            ui.append(text_area_9C, f'Payload: {payload_text}')
+
+            record = decode(frame)
+            if record is None:
+                return None
+            ui.set(byte2021_var, f"Input Voltage: {record.input_voltage:.2f} V")
+            ui.set(byte2223_var, f"Input Current: {record.input_current:.2f} A")
+            ui.set(byte2627_var, f"Input Power: {record.input_power}")
+
+            ui.set(output_power_var, f"Output Power(Calculated): {(record.output_voltage*record.output_current):.2f} W")
+            ui.set(output_voltage_var, f"Output Voltage: {record.output_voltage:.2f} V")
+            ui.set(output_current_var, f"Output Current: {record.output_current:.2f} A")
+            ui.set(temperature_var, f"Temperature: {record.temperature:.1f} C")
+            ui.set(input_voltage_1_var, f"Input Voltage 1: {record.input_voltage_1:.2f} V")
+            ui.set(input_voltage_2_var, f"Input Voltage 2: {record.input_voltage_2:.2f} V")
+            ui.set(input_voltage_3_var, f"Input Voltage 3: {record.input_voltage_3:.2f} V")
+            charts.add_record((ts_ns or time.monotonic_ns()) / 1e9, record)
     if DEVICEMODE == "BATTPAK":
         if frame[3] == 0xFC:
-            payload_text = ' '.join(f'{byte:02X}' for byte in frame)
-            text_area_FC.insert(tk.END, f'Payload: {payload_text}\n')
-            text_area_FC.see(tk.END)
+            payload_text = frame.hex(' ').upper()
+            ui.append(text_area_FC, f'Payload: {payload_text}')
         if frame[3] == 0x2D:
-            payload_text = ' '.join(f'{byte:02X}' for byte in frame)
-            text_area_2D.insert(tk.END, f'Payload: {payload_text}\n')
-            text_area_2D.see(tk.END)
+            payload_text = frame.hex(' ').upper()
+            ui.append(text_area_2D, f'Payload: {payload_text}')
+
+            record = decode(frame)
+            if record is not None:
+                charts.add_record((ts_ns or time.monotonic_ns()) / 1e9, record)
 
 if __name__ == '__main__':
+    args = parse_args()
+    DEVICEMODE = args.mode
 
-    serial_ports = select_serial_ports()
+    serial_ports = args.ports
+    if not serial_ports and not args.headless:
+        serial_ports = select_serial_ports()
+    if not serial_ports:
+        raise SystemExit("No serial ports to capture.")
 
-    # Initialize GUI
+    # Frames are written by a background thread, the readers only queue them; each file gets an index sidecar
+    writer = CaptureLogWriter(args.out + "{time}z" + CAPTURE_EXT, index=True,
+                              rotate_bytes=args.rotate_bytes, rotate_hourly=args.hourly).start()
+    metrics = None
+    if args.metrics_port:
+        metrics = Metrics()
+        metrics.add_writer("capture", writer)
+        serve(metrics, args.metrics_port)
+    # Cell statistics and anomaly flags of the battery packs, from every 0x2D frame
+    packs = PackMonitor(on_anomaly=print_anomaly if args.headless else None) if DEVICEMODE == "BATTPAK" else None
+
+    if args.headless:
+        try:
+            asyncio.run(run_headless(serial_ports, writer, metrics, args.clients_port, args.clients_socket, packs))
+        finally:
+            writer.close()
+            print(f"Captured to {', '.join(writer.paths)}")
+        raise SystemExit(0)
+
+    # Initialize GUI, tkinter is only needed here
+    import tkinter as tk
+    from tkinter import scrolledtext
+    from live_plot import MPPT_CHARTS, PACK_CHARTS, ChartWindow
     root = tk.Tk()
     root.title("Serial Frame Payload Viewer")
+    ui = GuiRefresher(root, GUI_REFRESH_MS, MAX_PANE_LINES)
+    # History of the decoded values, in its own window; closing it only hides it
+    charts = ChartWindow(root, MPPT_CHARTS if DEVICEMODE == "MPPT3" else PACK_CHARTS, title=f"{DEVICEMODE} charts")
+    tk.Button(root, text="Charts", command=charts.show, width=10).pack(anchor=tk.W, padx=10, pady=5)
 
     if DEVICEMODE == "MPPT3":
         text_area_38 = scrolledtext.ScrolledText(root, wrap="none", width=180, height=10)
@@ -189,12 +300,38 @@ if __name__ == '__main__':
         text_area_2D.pack(padx=10, pady=10)
         text_area_2D.insert(tk.END, "Payloads with class_b = 0x2D:\n")
 
-    OUTPUT_FILE = OUTPUT_FILE_PFX + datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S") + "z.txt"
-    file_lock = threading.Lock()
-    threads = []
-    for port in serial_ports:
-        t = threading.Thread(target=read_serial, args=(port, file_lock), daemon=True)
-        t.start()
-        threads.append(t)
+        pack_var = tk.StringVar(value="No 0x2D frames yet")
+        pack_label = tk.Label(root, textvariable=pack_var, anchor=tk.W, justify=tk.LEFT, font="TkFixedFont")
+        pack_label.pack(padx=10, pady=5, fill=tk.X)
+
+    # The reader thread only queues frames for the GUI, they are parsed on the Tk thread before each refresh
+    bus = FrameBus()
+    display = bus.subscribe(GUI_QUEUE, class_bs=GUI_CLASS_BS[DEVICEMODE], name="gui")
+
+    def show_frames():
+        for item in display.drain():
+            parse_frame(item.frame, item.ts_ns)
+
+    ui.poll(show_frames)
+    ui.poll(charts.poll)
+
+    if packs is not None:
+        pack_ticks = [0]
+
+        def show_packs():
+            pack_ticks[0] += 1
+            if pack_ticks[0] % PACK_REFRESH_TICKS or not packs.packs:
+                return
+            ui.set(pack_var, '\n'.join(format_pack(pack.summary()) for _, pack in sorted(list(packs.packs.items()))))
+
+        ui.poll(show_packs)
+    ui.start()
+
+    # All ports share one reader thread running the asyncio loop
+    reader_thread = threading.Thread(target=read_serial, daemon=True,
+                                     args=(serial_ports, writer, metrics, bus, args.clients_port, args.clients_socket, packs))
+    reader_thread.start()
 
     root.mainloop()
+    writer.close()
+    print(f"Captured to {', '.join(writer.paths)}")
@@ -0,0 +1,402 @@
+"""
+Pty based simulators of the devices on an SDC port, for load testing without hardware.
+
+Each simulated device owns a pseudo-terminal and speaks the protocol on it.
+Open the printed /dev/pts/N path with serial_log, host_mppt or replay
+(SERIAL_PORT / port selection) as if it was a real port.
+
+    mppt        3 port MPPT: answers 0x66 with 0x9C and 0x38 with 0x20
+    power-unit  power unit: handshake (INITIAL_BYTES1/2), then 0x66 + 0x38 at --rate.
+                With --sniff the MPPT replies are generated on the same pty, so the
+                stream looks like a tap on a live link (for serial_log).
+    battpak     expansion battery pack: sends 0x2D at --rate, accepts 0xFC
+
+--fault-rate is the probability that a sent frame is corrupted (bit flip,
+truncation or leading garbage), to exercise CRC checks and resync.
+
+Usage:
+    python simulators.py mppt --count 200 --paths-file mppt_ports.txt
+    python simulators.py power-unit --count 50 --rate 20 --sniff --fault-rate 0.01
+    python simulators.py battpak --count 10 --rate 4 --duration 60
+
+Linux only (os.openpty). All instances share one asyncio loop.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import resource
+import struct
+import time
+import tty
+
+from crc16 import add_crc16_checksum
+from frame_decoder import FrameDecoder
+from frame_encoder import frame_20, frame_38, frame_66, frame_9c
+from request_tracker import next_sequence
+from sdc_frames import (BATTPAK_ID, DIR_TO_POWER_UNIT, INITIAL_BYTES1, INITIAL_BYTES2, MPPT_ID,
+                        POWER_UNIT_ID, build_frame, set_sequence)
+
+FRAME_2D_LEN = 131
+CELL_COUNT = 16
+
+READ_SIZE = 4096
+
+
+class SimDevice:
+    """A device behind a pty. Subclasses implement run() (periodic traffic) and on_frame() (replies)."""
+
+    talker = 0x00
+
+    def __init__(self, rate=2.0, fault_rate=0.0, seed=None):
+        self.rate = rate
+        self.fault_rate = fault_rate
+        self.rng = random.Random(seed)
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        tty.setraw(self.master)
+        os.set_blocking(self.master, False)
+        self.path = os.ttyname(self.slave)
+        self.decoder = FrameDecoder()
+        self.loop = None
+        self.task = None
+        self.sequence = 1
+        self.frames_sent = 0
+        self.frames_received = 0
+        self.faults = 0
+        self.overruns = 0
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(self.master, self._on_readable)
+        self.task = self.loop.create_task(self.run())
+        return self
+
+    async def run(self):
+        pass
+
+    def on_frame(self, frame):
+        pass
+
+    def next_sequence(self):
+        sequence = self.sequence
+        self.sequence = next_sequence(sequence)
+        return sequence
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.master, READ_SIZE)
+        except (BlockingIOError, OSError):
+            return
+        for frame in self.decoder.feed(data):
+            self.frames_received += 1
+            self.on_frame(frame)
+
+    def send(self, frame):
+        """Add the CRC, maybe corrupt the frame, and write it to the pty."""
+        self.send_frame(add_crc16_checksum(frame))
+
+    def send_frame(self, data):
+        """Like send() for a frame that has its CRC, e.g. a frame_encoder view."""
+        if self.fault_rate and self.rng.random() < self.fault_rate:
+            data = self.corrupt(data)
+            self.faults += 1
+        try:
+            written = os.write(self.master, data)
+        except BlockingIOError:
+            written = 0
+        except OSError:
+            return
+        if written < len(data):
+            # Nobody is reading fast enough, like a real UART the rest is lost
+            self.overruns += 1
+        self.frames_sent += 1
+
+    def corrupt(self, data):
+        data = bytearray(data)
+        kind = self.rng.randrange(3)
+        if kind == 0:
+            data[self.rng.randrange(len(data))] ^= 1 << self.rng.randrange(8)
+        elif kind == 1:
+            del data[self.rng.randrange(1, len(data)):]
+        else:
+            data[:0] = bytes(self.rng.randrange(256) for _ in range(self.rng.randrange(1, 8)))
+        return bytes(data)
+
+    async def tick(self):
+        """Yield periodic ticks at self.rate per second on the monotonic loop clock."""
+        period = 1.0 / self.rate
+        next_time = self.loop.time()
+        while True:
+            yield
+            next_time += period
+            delay = next_time - self.loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                # Fell behind, don't try to catch up with a burst
+                next_time = self.loop.time()
+
+    def stats(self):
+        return {
+            'sent': self.frames_sent,
+            'received': self.frames_received,
+            'faults': self.faults,
+            'overruns': self.overruns,
+            'dropped_bytes': self.decoder.dropped_bytes,
+        }
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        if self.loop is not None:
+            self.loop.remove_reader(self.master)
+        os.close(self.master)
+        os.close(self.slave)
+
+
+class MpptModel:
+    """
+    Made up but plausible 3 port MPPT telemetry, following the 0x38 limits.
+    Replies are complete frames (CRC included) from reused encoders, valid until the next reply.
+    """
+
+    def __init__(self, rng, inputs=3):
+        self.rng = rng
+        self.inputs = inputs
+        self.voltage_limit = 0.0
+        self.current_limit = 0.0
+        self.temperature = 30.0
+        self.encoder_9c = frame_9c()
+        self.encoder_20 = frame_20()
+
+    def set_limits(self, frame):
+        self.voltage_limit = int.from_bytes(frame[12:14], byteorder='little') * 0.01
+        self.current_limit = int.from_bytes(frame[14:16], byteorder='little') * 0.01
+
+    def reply_9c(self, request):
+        rng = self.rng
+        port_voltages = [rng.uniform(35.0, 45.0) if i < self.inputs else 0.0 for i in range(3)]
+        input_voltage = max(port_voltages)
+        output_voltage = self.voltage_limit * rng.uniform(0.98, 1.0) if self.voltage_limit else 0.0
+        output_current = self.current_limit * rng.uniform(0.8, 1.0) if self.current_limit else 0.0
+        output_power = output_voltage * output_current
+        input_current = output_power / 0.95 / input_voltage if input_voltage else 0.0
+        self.temperature = min(70.0, max(20.0, self.temperature + rng.uniform(-0.2, 0.25)))
+
+        encoder = self.encoder_9c
+        encoder.set(output_voltage=output_voltage, output_current=output_current,
+                    input_voltage=input_voltage, input_current=input_current,
+                    input_count=self.inputs, charging=1 if output_current > 0 else 0,
+                    input_power=input_current * input_voltage, temperature=self.temperature,
+                    input_voltage_1=port_voltages[0], input_voltage_2=port_voltages[1], input_voltage_3=port_voltages[2])
+        return reply_frame(encoder, request)
+
+    def reply_20(self, request):
+        self.set_limits(request)
+        # Echo the setpoints back (bytes 10 to the CRC)
+        self.encoder_20.set_bytes(10, request[10:-2])
+        return reply_frame(self.encoder_20, request)
+
+    def reply(self, request):
+        if request[3] == 0x66:
+            return self.reply_9c(request)
+        if request[3] == 0x38:
+            return self.reply_20(request)
+        return None
+
+
+def reply_frame(encoder, request):
+    """Reply with the request's sequence number and byte 9, addressed back to its talker."""
+    encoder.set_listener(request[4])
+    encoder.buffer[9] = request[9]
+    return encoder.encode(request[6] | (request[7] << 8))
+
+
+class MpptSim(SimDevice):
+    """3 port MPPT. Only talks when asked."""
+
+    talker = MPPT_ID
+
+    def __init__(self, inputs=3, **kwargs):
+        super().__init__(**kwargs)
+        self.model = MpptModel(self.rng, inputs)
+
+    def on_frame(self, frame):
+        reply = self.model.reply(frame)
+        if reply is not None:
+            self.send_frame(reply)
+
+
+class PowerUnitSim(SimDevice):
+    """Power unit polling an MPPT: handshake, then 0x66 and 0x38 at rate per second."""
+
+    talker = POWER_UNIT_ID
+
+    def __init__(self, voltage=52.2, current=7.65, sniff=False, reply_timeout=0.2, **kwargs):
+        super().__init__(**kwargs)
+        self.voltage = voltage
+        self.current = current
+        self.sniff = sniff
+        self.reply_timeout = reply_timeout
+        self.listener = 0x00
+        self.replies = 0
+        self._waiter = None
+        self.model = MpptModel(self.rng) if sniff else None
+
+    def request(self, frame):
+        """Send a complete request frame (CRC included)."""
+        self.send_frame(frame)
+        if self.model is not None:
+            reply = self.model.reply(frame)
+            if reply is not None:
+                self.send_frame(reply)
+                self.on_frame(reply)
+
+    async def wait_reply(self):
+        if self.model is not None:
+            return
+        self._waiter = self.loop.create_future()
+        try:
+            await asyncio.wait_for(self._waiter, self.reply_timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._waiter = None
+
+    def on_frame(self, frame):
+        if frame[4] == self.talker:
+            return
+        self.replies += 1
+        if self.listener == 0x00:
+            self.listener = frame[4]
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(frame)
+
+    async def run(self):
+        self.request(add_crc16_checksum(set_sequence(INITIAL_BYTES1, self.next_sequence(), self.listener)))
+        await self.wait_reply()
+        self.request(add_crc16_checksum(set_sequence(INITIAL_BYTES2, self.next_sequence(), self.listener)))
+        await self.wait_reply()
+        encoder_66 = frame_66(self.listener)
+        encoder_38 = frame_38(self.listener)
+        async for _ in self.tick():
+            self.request(encoder_66.encode(self.next_sequence()))
+            encoder_38.set(voltage=self.voltage, current=self.current)
+            self.request(encoder_38.encode(self.next_sequence()))
+
+    def stats(self):
+        stats = super().stats()
+        stats['replies'] = self.replies
+        return stats
+
+
+class BatteryPackSim(SimDevice):
+    """Expansion battery pack: streams 0x2D, accepts 0xFC."""
+
+    talker = BATTPAK_ID
+
+    def __init__(self, current_ma=3000, **kwargs):
+        super().__init__(**kwargs)
+        self.cells = [self.rng.uniform(3.25, 3.35) for _ in range(CELL_COUNT)]
+        self.current_ma = current_ma
+        self.lcd_on = True
+        self.fc_frames = 0
+
+    def frame_2d(self):
+        rng = self.rng
+        # Cells drift with the current, each a little differently
+        for i, cell in enumerate(self.cells):
+            self.cells[i] = min(3.65, max(2.8, cell + self.current_ma * 1e-8 + rng.gauss(0, 0.0005)))
+        self.current_ma = max(-30000, min(30000, int(self.current_ma + rng.gauss(0, 50))))
+        payload = bytearray(FRAME_2D_LEN - 12)
+        struct.pack_into('<H', payload, 77 - 10, int(sum(self.cells) * 1000) & 0xFFFF)
+        struct.pack_into('<h', payload, 85 - 10, self.current_ma)
+        struct.pack_into(f'<{CELL_COUNT}H', payload, 97 - 10, *(int(cell * 100) for cell in self.cells))
+        return build_frame(0x2D, self.talker, POWER_UNIT_ID, self.next_sequence(), DIR_TO_POWER_UNIT, payload)
+
+    async def run(self):
+        async for _ in self.tick():
+            self.send(self.frame_2d())
+
+    def on_frame(self, frame):
+        if frame[3] == 0xFC and len(frame) > 17:
+            self.fc_frames += 1
+            self.lcd_on = bool(frame[17] & 0x01)
+
+    def stats(self):
+        stats = super().stats()
+        stats['fc_frames'] = self.fc_frames
+        return stats
+
+
+SIMULATORS = {
+    'mppt': MpptSim,
+    'power-unit': PowerUnitSim,
+    'battpak': BatteryPackSim,
+}
+
+
+def raise_fd_limit(count):
+    """Each instance needs two descriptors, raise the soft limit if hundreds are requested."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = count * 2 + 64
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+
+
+def start_simulators(kind, count=1, **kwargs):
+    """Create and start count simulators of a kind on the running loop."""
+    raise_fd_limit(count)
+    cls = SIMULATORS[kind]
+    return [cls(**kwargs).start() for _ in range(count)]
+
+
+def print_stats(devices, elapsed):
+    totals = {}
+    for device in devices:
+        for key, value in device.stats().items():
+            totals[key] = totals.get(key, 0) + value
+    rates = ', '.join(f"{key} {value} ({value / elapsed:.0f}/s)" for key, value in totals.items())
+    print(f"{len(devices)} devices, {elapsed:.1f} s: {rates}")
+
+
+async def main(args):
+    kwargs = {'rate': args.rate, 'fault_rate': args.fault_rate, 'seed': args.seed}
+    if args.kind == 'power-unit':
+        kwargs['sniff'] = args.sniff
+    devices = start_simulators(args.kind, args.count, **kwargs)
+    paths = [device.path for device in devices]
+    for path in paths:
+        print(path)
+    if args.paths_file:
+        with open(args.paths_file, 'w') as f:
+            f.write('\n'.join(paths) + '\n')
+    start = time.monotonic()
+    try:
+        if args.duration:
+            await asyncio.sleep(args.duration)
+        else:
+            while True:
+                await asyncio.sleep(10)
+                print_stats(devices, time.monotonic() - start)
+    finally:
+        print_stats(devices, time.monotonic() - start)
+        for device in devices:
+            device.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulated SDC devices on pseudo-terminals")
+    parser.add_argument('kind', choices=sorted(SIMULATORS))
+    parser.add_argument('--count', type=int, default=1, help="number of instances")
+    parser.add_argument('--rate', type=float, default=2.0, help="frames (or request cycles) per second per instance")
+    parser.add_argument('--fault-rate', type=float, default=0.0, help="probability that a sent frame is corrupted")
+    parser.add_argument('--sniff', action='store_true', help="power-unit: also emit the MPPT replies on the same pty")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--duration', type=float, default=0, help="stop after this many seconds (default: run until Ctrl-C)")
+    parser.add_argument('--paths-file', help="write the pty paths to this file, one per line")
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
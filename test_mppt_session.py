@@ -0,0 +1,42 @@
+"""
+Regression tests for MpptSession setpoint confirmation, run with pytest.
+"""
+
+import asyncio
+import random
+
+from mppt_session import MpptSession
+from simulators import MpptModel
+
+
+def confirm(voltage, current):
+    """Run one _send_setpoint against the simulated MPPT, echoing each 0x38 with its 0x20."""
+    session = MpptSession('sim', voltage, current)
+    sim = MpptModel(random.Random(0))
+    session._log = lambda entry: None
+
+    async def request(build_frame, retries=0):
+        return bytes(sim.reply(bytes(build_frame())))
+
+    async def main():
+        session._stop = asyncio.Event()
+        session.request = request
+        return await session._send_setpoint(voltage, current)
+
+    return asyncio.run(main()), session
+
+
+def test_setpoint_confirmed():
+    confirmed, session = confirm(52.2, 7.65)
+    assert confirmed
+    assert (session.applied_voltage, session.applied_current) == (52.2, 7.65)
+    assert session.setpoint_failures == 0
+
+
+def test_setpoint_rounding_half_value():
+    # round(0.235 * 100) and round(0.235 / 0.01) disagree, the echo must still match what was sent
+    for current in (0.235, 0.285, 1.005):
+        confirmed, session = confirm(52.2, current)
+        assert confirmed, current
+        assert session.applied_current == current
+        assert session.setpoint_failures == 0